@@ -1,41 +1,103 @@
 # analytics.py
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple
-from sqlalchemy import func, and_
+from sqlalchemy import func, and_, case, select, true
+from sqlalchemy.orm import Session
+from analytics_cache import cached_by_vacancy
 from models import Candidate, CandidateStatus, Vacancy, Company
+from sql_functions import day_of, json_array_elements
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Диапазоны оценок: (название, верхняя граница включительно; None — всё остальное)
+SCORE_BUCKETS = [('0-20', 20), ('21-40', 40), ('41-60', 60), ('61-80', 80), ('81-100', None)]
+
+
+def score_bucket(score_column):
+    """CASE-выражение: оценка → название диапазона из SCORE_BUCKETS"""
+    return case(
+        *[(score_column <= upper, name) for name, upper in SCORE_BUCKETS if upper is not None],
+        else_=SCORE_BUCKETS[-1][0],
+    )
+
+
+def conversion_rates(stats: Dict[str, int]) -> Dict[str, float]:
+    """
+    Конверсия на каждом этапе воронки по готовой статистике статусов
+    """
+    total = stats.get(CandidateStatus.FOUND.value, 0)
+    if total == 0:
+        return {}
+    
+    rates = {}
+    
+    # Конверсия в filtered
+    filtered = stats.get(CandidateStatus.FILTERED.value, 0)
+    rates['found_to_filtered'] = round((filtered / total) * 100, 1)
+    
+    # Конверсия в invited
+    invited = stats.get(CandidateStatus.INVITED.value, 0)
+    rates['filtered_to_invited'] = round((invited / max(filtered, 1)) * 100, 1)
+    
+    # Конверсия в answering
+    answering = stats.get(CandidateStatus.ANSWERING.value, 0)
+    rates['invited_to_answering'] = round((answering / max(invited, 1)) * 100, 1)
+    
+    # Конверсия в qualified
+    qualified = stats.get(CandidateStatus.QUALIFIED.value, 0)
+    rates['answering_to_qualified'] = round((qualified / max(answering, 1)) * 100, 1)
+    
+    # Конверсия в interview
+    interview = stats.get(CandidateStatus.INTERVIEW.value, 0)
+    rates['qualified_to_interview'] = round((interview / max(qualified, 1)) * 100, 1)
+    
+    # Общая конверсия
+    rates['overall_conversion'] = round((interview / total) * 100, 1)
+    
+    return rates
+
+
+def red_flag_counts(session: Session, vacancy_id: int) -> Dict[str, int]:
+    """
+    Сколько раз встречается каждый красный флаг у кандидатов вакансии.
+    Один агрегирующий запрос: массив red_flags разворачивается в строки
+    в самой БД (json_each / jsonb_array_elements_text), кандидаты не загружаются.
+    """
+    flags = json_array_elements(Candidate.red_flags).table_valued('value')
+    rows = session.execute(
+        select(flags.c.value, func.count())
+        .select_from(Candidate)
+        .join(flags, true())
+        .where(Candidate.vacancy_id == vacancy_id, flags.c.value.isnot(None))
+        .group_by(flags.c.value)
+    ).all()
+    return {flag: count for flag, count in rows}
+
 
 class AnalyticsService:
-    """Сервис для аналитики и статистики"""
+    """
+    Сервис для аналитики и статистики.
+    Результаты кэшируются до изменения кандидатов вакансии (analytics_cache.py)
+    """
     
     @staticmethod
+    @cached_by_vacancy
     def get_pipeline_stats(vacancy_id: int) -> Dict[str, int]:
         """
         Получает статистику по воронке для конкретной вакансии
         """
         from db import get_session
+        from pipeline import get_pipeline_counts
         
+        # Счётчики воронки поддерживаются инкрементально — одна строка вместо GROUP BY
         with get_session() as session:
-            status_counts = session.query(
-                Candidate.status, func.count(Candidate.id)
-            ).filter(
-                Candidate.vacancy_id == vacancy_id
-            ).group_by(Candidate.status).all()
+            counts = get_pipeline_counts(session, vacancy_id)
         
-        result = {status: count for status, count in status_counts}
-        
-        # Добавляем нулевые значения для отсутствующих статусов
-        all_statuses = [s.value for s in CandidateStatus]
-        for status in all_statuses:
-            if status not in result:
-                result[status] = 0
-        
-        return result
+        return {status.value: counts[status.value] for status in CandidateStatus}
     
     @staticmethod
+    @cached_by_vacancy
     def get_source_stats(vacancy_id: int) -> Dict[str, int]:
         """
         Статистика по источникам кандидатов
@@ -52,138 +114,93 @@ class AnalyticsService:
         return {source: count for source, count in source_counts}
     
     @staticmethod
+    @cached_by_vacancy
     def get_conversion_rates(vacancy_id: int) -> Dict[str, float]:
         """
-        Рассчитывает конверсию на каждом этапе воронки
+        Рассчитывает конверсию на каждом этапе воронки.
+        Этапы считаются по журналу смен статуса: кандидат, ушедший дальше
+        или отклонённый после этапа, всё равно учитывается как дошедший до него
         """
-        stats = AnalyticsService.get_pipeline_stats(vacancy_id)
-        
-        total = stats.get(CandidateStatus.FOUND.value, 0)
-        if total == 0:
-            return {}
-        
-        rates = {}
-        
-        # Конверсия в filtered
-        filtered = stats.get(CandidateStatus.FILTERED.value, 0)
-        rates['found_to_filtered'] = round((filtered / total) * 100, 1)
-        
-        # Конверсия в invited
-        invited = stats.get(CandidateStatus.INVITED.value, 0)
-        rates['filtered_to_invited'] = round((invited / max(filtered, 1)) * 100, 1)
-        
-        # Конверсия в answering
-        answering = stats.get(CandidateStatus.ANSWERING.value, 0)
-        rates['invited_to_answering'] = round((answering / max(invited, 1)) * 100, 1)
-        
-        # Конверсия в qualified
-        qualified = stats.get(CandidateStatus.QUALIFIED.value, 0)
-        rates['answering_to_qualified'] = round((qualified / max(answering, 1)) * 100, 1)
-        
-        # Конверсия в interview
-        interview = stats.get(CandidateStatus.INTERVIEW.value, 0)
-        rates['qualified_to_interview'] = round((interview / max(qualified, 1)) * 100, 1)
-        
-        # Общая конверсия
-        rates['overall_conversion'] = round((interview / total) * 100, 1)
-        
-        return rates
+        return conversion_rates(AnalyticsService.get_funnel_stats(vacancy_id)['reached'])
     
     @staticmethod
-    def get_time_stats(vacancy_id: int) -> Dict[str, any]:
+    @cached_by_vacancy
+    def get_funnel_stats(vacancy_id: int) -> Dict[str, Dict]:
         """
-        Статистика по времени: среднее время на каждом этапе
+        Воронка по журналу смен статуса: сколько кандидатов дошли до каждого этапа
+        и среднее время до этапа (pipeline.get_funnel_stats)
         """
         from db import get_session
-        from sqlalchemy import func
+        from pipeline import get_funnel_stats
         
         with get_session() as session:
-            # Среднее время от создания до приглашения
-            invited_time = session.query(
-                func.avg(
-                    func.julianday(Candidate.last_message_at) - 
-                    func.julianday(Candidate.created_at)
-                )
-            ).filter(
-                Candidate.vacancy_id == vacancy_id,
-                Candidate.status == CandidateStatus.INVITED.value,
-                Candidate.last_message_at.isnot(None)
-            ).scalar()
-            
-            # Среднее время от приглашения до ответа
-            answering_time = session.query(
-                func.avg(
-                    func.julianday(Candidate.last_reply_at) - 
-                    func.julianday(Candidate.last_message_at)
-                )
-            ).filter(
-                Candidate.vacancy_id == vacancy_id,
-                Candidate.status.in_([CandidateStatus.ANSWERING.value, CandidateStatus.QUALIFIED.value]),
-                Candidate.last_reply_at.isnot(None),
-                Candidate.last_message_at.isnot(None)
-            ).scalar()
-            
-            # Среднее время от ответа до квалификации
-            qualify_time = session.query(
-                func.avg(
-                    func.julianday(Candidate.qualification_date) - 
-                    func.julianday(Candidate.last_reply_at)
-                )
-            ).filter(
-                Candidate.vacancy_id == vacancy_id,
-                Candidate.qualification_date.isnot(None),
-                Candidate.last_reply_at.isnot(None)
-            ).scalar()
-        
-        return {
-            'avg_invite_time': round(invited_time * 24, 1) if invited_time else None,  # в часах
-            'avg_response_time': round(answering_time * 24, 1) if answering_time else None,  # в часах
-            'avg_qualify_time': round(qualify_time * 24, 1) if qualify_time else None,  # в часах
-        }
+            return get_funnel_stats(session, vacancy_id)
+    
+    @staticmethod
+    @cached_by_vacancy
+    def get_time_stats(vacancy_id: int) -> Dict[str, any]:
+        """
+        Статистика по времени: среднее время до каждого этапа в часах.
+        Считается по журналу смен статуса — по моменту первого перехода в этап,
+        а не по отметкам последнего сообщения, которые перезаписываются
+        """
+        return AnalyticsService.get_funnel_stats(vacancy_id)['timings']
     
     @staticmethod
+    @cached_by_vacancy
     def get_red_flags_stats(vacancy_id: int) -> Dict[str, int]:
         """
         Статистика по красным флагам
         """
         from db import get_session
-        import json
         
-        flag_counts = {}
+        with get_session() as session:
+            return red_flag_counts(session, vacancy_id)
+    
+    @staticmethod
+    @cached_by_vacancy
+    def get_normalization_stats(vacancy_id: int) -> Dict[str, int]:
+        """
+        Сколько кандидатов с нормализованными данными — одним запросом
+        (COUNT(колонка) считает только заполненные значения)
+        """
+        from db import get_session
         
         with get_session() as session:
-            candidates = session.query(Candidate).filter(
-                Candidate.vacancy_id == vacancy_id,
-                Candidate.red_flags.isnot(None)
-            ).all()
-            
-            for c in candidates:
-                if c.red_flags:
-                    for flag in c.red_flags:
-                        flag_counts[flag] = flag_counts.get(flag, 0) + 1
+            row = session.query(
+                func.count(Candidate.id),
+                func.count(Candidate.experience_years),
+                func.count(Candidate.extracted_skills),
+                func.count(Candidate.extracted_keywords),
+            ).filter(Candidate.vacancy_id == vacancy_id).one()
         
-        return flag_counts
+        return {
+            'total': row[0],
+            'with_exp_years': row[1],
+            'with_norm_skills': row[2],
+            'with_keywords': row[3],
+        }
     
     @staticmethod
+    @cached_by_vacancy
     def get_daily_stats(vacancy_id: int, days: int = 30) -> Dict[str, List]:
         """
         Ежедневная статистика за последние N дней
         """
         from db import get_session
-        from sqlalchemy import func, cast, Date
         
         cutoff_date = datetime.now() - timedelta(days=days)
         
         with get_session() as session:
+            # CAST(... AS DATE) в SQLite даёт число (год), date() работает в обеих БД
+            day = day_of(Candidate.created_at)
             daily_counts = session.query(
-                cast(Candidate.created_at, Date).label('date'),
+                day.label('date'),
                 func.count(Candidate.id).label('count')
             ).filter(
                 Candidate.vacancy_id == vacancy_id,
                 Candidate.created_at >= cutoff_date
-            ).group_by(
-                cast(Candidate.created_at, Date)
-            ).order_by('date').all()
+            ).group_by(day).order_by('date').all()
         
         dates = []
         counts = []
@@ -198,51 +215,112 @@ class AnalyticsService:
         }
     
     @staticmethod
+    @cached_by_vacancy
     def get_score_distribution(vacancy_id: int) -> Dict[str, int]:
         """
         Распределение кандидатов по оценкам
         """
         from db import get_session
         
-        distribution = {
-            '0-20': 0,
-            '21-40': 0,
-            '41-60': 0,
-            '61-80': 0,
-            '81-100': 0
-        }
+        bucket = score_bucket(Candidate.score)
         
+        # Раскладка по диапазонам — в SQL (CASE + GROUP BY), без загрузки кандидатов
         with get_session() as session:
-            candidates = session.query(Candidate).filter(
+            rows = session.query(bucket, func.count(Candidate.id)).filter(
                 Candidate.vacancy_id == vacancy_id
-            ).all()
-            
-            for c in candidates:
-                score = c.score
-                if score <= 20:
-                    distribution['0-20'] += 1
-                elif score <= 40:
-                    distribution['21-40'] += 1
-                elif score <= 60:
-                    distribution['41-60'] += 1
-                elif score <= 80:
-                    distribution['61-80'] += 1
-                else:
-                    distribution['81-100'] += 1
+            ).group_by(bucket).all()
         
+        distribution = {name: 0 for name, _ in SCORE_BUCKETS}
+        distribution.update(rows)
         return distribution
 
 
+# ===== ОТЧЁТ ОДНИМ ПРОХОДОМ =====
+
+def report_aggregate_select(vacancy_id: int, days: int = 7):
+    """
+    Агрегирующий запрос отчёта: группы (источник, день за последние days дней
+    или NULL для более старых) с CASE-суммами по оценкам
+    """
+    cutoff = datetime.now() - timedelta(days=days)
+    day = case((Candidate.created_at >= cutoff, day_of(Candidate.created_at)))
+    
+    columns = [Candidate.source, day.label('day'), func.count().label('total')]
+    lower = None
+    for i, (_, upper) in enumerate(SCORE_BUCKETS):
+        in_bucket = and_(
+            Candidate.score > lower if lower is not None else true(),
+            Candidate.score <= upper if upper is not None else true(),
+        )
+        columns.append(func.count(case((in_bucket, 1))).label(f'score_{i}'))
+        lower = upper
+    
+    return select(*columns).where(Candidate.vacancy_id == vacancy_id).group_by(Candidate.source, day)
+
+
+def collect_report_data(session: Session, vacancy_id: int, days: int = 7) -> Dict:
+    """
+    Все данные аналитического отчёта за один проход по кандидатам вакансии.
+    
+    Один агрегирующий запрос группирует кандидатов по (источник, день за последние
+    days дней): CASE-суммы дают распределение по оценкам, источники и динамика
+    по дням складываются из групп. Статусы берутся из счётчиков воронки
+    (одна строка по первичному ключу), конверсия и время этапов — из журнала
+    смен статуса (запрос по покрывающему индексу журнала).
+    Читаются только короткие колонки — стоимость не зависит от размера резюме.
+    """
+    from pipeline import get_funnel_stats, get_pipeline_counts
+    
+    rows = session.execute(report_aggregate_select(vacancy_id, days)).mappings().all()
+    counts = get_pipeline_counts(session, vacancy_id)
+    funnel = get_funnel_stats(session, vacancy_id)
+    
+    sources: Dict[str, int] = {}
+    daily: Dict = {}
+    score_dist = {name: 0 for name, _ in SCORE_BUCKETS}
+    for row in rows:
+        sources[row['source']] = sources.get(row['source'], 0) + row['total']
+        if row['day'] is not None:
+            daily[row['day']] = daily.get(row['day'], 0) + row['total']
+        for i, (name, _) in enumerate(SCORE_BUCKETS):
+            score_dist[name] += row[f'score_{i}']
+    
+    stats = {status.value: counts[status.value] for status in CandidateStatus}
+    return {
+        'stats': stats,
+        'sources': sources,
+        'conversion': conversion_rates(funnel['reached']),
+        'time_stats': funnel['timings'],
+        'score_dist': score_dist,
+        'daily': {
+            'dates': [d.strftime('%d.%m') for d in sorted(daily)],
+            'counts': [daily[d] for d in sorted(daily)],
+        },
+    }
+
+
+@cached_by_vacancy
 def format_analytics_report(vacancy_id: int) -> str:
     """
     Форматирует аналитический отчёт для отображения в Telegram
     """
-    stats = AnalyticsService.get_pipeline_stats(vacancy_id)
-    sources = AnalyticsService.get_source_stats(vacancy_id)
-    conversion = AnalyticsService.get_conversion_rates(vacancy_id)
-    time_stats = AnalyticsService.get_time_stats(vacancy_id)
-    score_dist = AnalyticsService.get_score_distribution(vacancy_id)
-    daily = AnalyticsService.get_daily_stats(vacancy_id, days=7)
+    from db import get_session
+    
+    with get_session() as session:
+        data = collect_report_data(session, vacancy_id, days=7)
+    return render_analytics_report(data)
+
+
+def render_analytics_report(data: Dict) -> str:
+    """
+    Текст отчёта по данным collect_report_data
+    """
+    stats = data['stats']
+    sources = data['sources']
+    conversion = data['conversion']
+    time_stats = data['time_stats']
+    score_dist = data['score_dist']
+    daily = data['daily']
     
     total = stats.get(CandidateStatus.FOUND.value, 0)
     
@@ -293,4 +371,59 @@ def format_analytics_report(vacancy_id: int) -> str:
         for i, date in enumerate(daily['dates'][-7:]):
             text += f"• {date}: {daily['counts'][-7:][i]} кандидатов\n"
     
-    return text
\ No newline at end of file
+    return text
+
+
+# ===== АНАЛИТИКА КОМПАНИИ (ДНЕВНЫЕ АГРЕГАТЫ) =====
+
+STATUS_TITLES = {
+    CandidateStatus.FOUND.value: '🔍 Найдено',
+    CandidateStatus.FILTERED.value: '🟢 Подходят',
+    CandidateStatus.INVITED.value: '📩 Приглашены',
+    CandidateStatus.ANSWERING.value: '💬 Отвечают',
+    CandidateStatus.CLARIFY.value: '⚠️ Уточнение',
+    CandidateStatus.QUALIFIED.value: '✅ Квалифицированы',
+    CandidateStatus.INTERVIEW.value: '📅 Собеседование',
+    CandidateStatus.OFFER.value: '🤝 Оффер',
+    CandidateStatus.REJECTED.value: '❌ Отсеяно',
+}
+
+
+def format_company_report(company_id: int, days: int = 90) -> str:
+    """
+    Отчёт по всем вакансиям компании за период — только по дневным агрегатам (rollups.py)
+    """
+    from db import get_session
+    from rollups import company_rollup_stats
+    
+    with get_session() as session:
+        stats = company_rollup_stats(session, company_id, days)
+    
+    total = stats['total']
+    text = f"🏢 <b>Аналитика компании за {days} дн.</b>\n\n"
+    if total == 0:
+        text += "Нет данных за период. Агрегаты обновляются раз в сутки."
+        return text
+    
+    text += f"• Всего кандидатов: {total}\n"
+    text += f"• С оценкой 80+: {stats['score_top']} ({round(stats['score_top'] / total * 100, 1)}%)\n\n"
+    
+    text += "<b>По вакансиям:</b>\n"
+    for vacancy in sorted(stats['by_vacancy'].values(), key=lambda v: v['candidates'], reverse=True)[:10]:
+        text += f"• {vacancy['role']}: {vacancy['candidates']} (80+: {vacancy['score_top']})\n"
+    
+    text += "\n<b>Воронка:</b>\n"
+    for status, title in STATUS_TITLES.items():
+        count = stats['by_status'].get(status, 0)
+        if count:
+            text += f"• {title}: {count}\n"
+    
+    text += "\n<b>Источники:</b>\n"
+    for source, count in sorted(stats['by_source'].items(), key=lambda x: x[1], reverse=True):
+        text += f"• {source}: {count} ({round(count / total * 100, 1)}%)\n"
+    
+    text += "\n<b>По месяцам:</b>\n"
+    for month, count in stats['by_month'].items():
+        text += f"• {month}: {count}\n"
+    
+    return text
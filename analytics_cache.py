@@ -0,0 +1,129 @@
+# analytics_cache.py
+"""
+Кэш результатов аналитики по вакансиям.
+
+Отчёты (/analytics, /sources, /conversion, /stats_normalized) пересчитываются
+только после изменения кандидатов вакансии. У каждой вакансии есть версия данных
+(в памяти процесса), она увеличивается после коммита транзакции, в которой
+менялись кандидаты этой вакансии. Результат из кэша отдаётся, пока версия та же
+и не истёк TTL (settings.analytics_cache_ttl_seconds) — TTL покрывает записи
+из других процессов и «скользящие» окна вроде динамики за 7 дней.
+
+ORM-изменения кандидатов (add/delete, изменение полей) отслеживаются событиями
+сессии автоматически. Записи в обход ORM (пакетные INSERT/UPDATE через Core,
+точечные update()) отмечают вакансии сами: mark_vacancies_changed(session, ids).
+"""
+import copy
+import functools
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from config import settings
+from models import Candidate
+
+logger = logging.getLogger(__name__)
+
+_VERSIONS: Dict[int, int] = {}
+# (функция, vacancy_id, аргументы) → (версия данных, истекает, результат)
+_CACHE: Dict[Tuple, Tuple[int, float, Any]] = {}
+_CACHE_MAX = 4096
+_LOCK = threading.Lock()
+
+# Ключ в session.info: вакансии, изменённые в текущей транзакции
+_CHANGED_KEY = "analytics_changed_vacancies"
+
+
+def data_version(vacancy_id: int) -> int:
+    """Текущая версия данных вакансии"""
+    with _LOCK:
+        return _VERSIONS.get(vacancy_id, 0)
+
+
+def bump_versions(vacancy_ids: Iterable[int]) -> None:
+    """Увеличить версии данных: закэшированные результаты этих вакансий устаревают"""
+    with _LOCK:
+        for vacancy_id in vacancy_ids:
+            _VERSIONS[vacancy_id] = _VERSIONS.get(vacancy_id, 0) + 1
+
+
+def mark_vacancies_changed(session: Session, vacancy_ids: Iterable[Optional[int]]) -> None:
+    """Отметить вакансии изменёнными в транзакции сессии; версии увеличатся после коммита"""
+    session.info.setdefault(_CHANGED_KEY, set()).update(v for v in vacancy_ids if v is not None)
+
+
+def cached_by_vacancy(fn):
+    """
+    Декоратор для функций вида fn(vacancy_id, ...): результат кэшируется
+    до изменения кандидатов вакансии (или до истечения TTL).
+    Вызывающий код получает копию — изменять её можно.
+    """
+    @functools.wraps(fn)
+    def wrapper(vacancy_id: int, *args, **kwargs):
+        ttl = settings.analytics_cache_ttl_seconds
+        if ttl <= 0:
+            return fn(vacancy_id, *args, **kwargs)
+
+        key = (fn.__qualname__, vacancy_id, args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with _LOCK:
+            version = _VERSIONS.get(vacancy_id, 0)
+            cached = _CACHE.get(key)
+        if cached is not None and cached[0] == version and cached[1] > now:
+            return copy.deepcopy(cached[2])
+
+        # Версия взята до расчёта: если кандидаты изменятся во время него,
+        # результат сохранится со старой версией и следующий вызов пересчитает его
+        value = fn(vacancy_id, *args, **kwargs)
+        with _LOCK:
+            if len(_CACHE) >= _CACHE_MAX:
+                _CACHE.clear()
+            _CACHE[key] = (version, now + ttl, value)
+        return copy.deepcopy(value)
+
+    return wrapper
+
+
+def invalidate_analytics_cache(vacancy_id: Optional[int] = None) -> None:
+    """Сбросить кэш вакансии (или весь кэш, если vacancy_id не задан)"""
+    if vacancy_id is None:
+        with _LOCK:
+            _CACHE.clear()
+        return
+    bump_versions([vacancy_id])
+
+
+# ===== ОТСЛЕЖИВАНИЕ ЗАПИСЕЙ =====
+
+@event.listens_for(Session, "before_flush")
+def _collect_changed_vacancies(session: Session, flush_context, instances) -> None:
+    changed = set()
+    for obj in session.new:
+        if isinstance(obj, Candidate):
+            changed.add(obj.vacancy_id)
+    for obj in session.deleted:
+        if isinstance(obj, Candidate):
+            changed.add(obj.vacancy_id)
+    for obj in session.dirty:
+        if isinstance(obj, Candidate) and session.is_modified(obj):
+            changed.add(obj.vacancy_id)
+            # Кандидата перенесли в другую вакансию — меняются обе
+            changed.update(inspect(obj).attrs.vacancy_id.history.deleted)
+    if changed:
+        mark_vacancies_changed(session, changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_on_commit(session: Session) -> None:
+    changed = session.info.pop(_CHANGED_KEY, None)
+    if changed:
+        bump_versions(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session: Session) -> None:
+    session.info.pop(_CHANGED_KEY, None)
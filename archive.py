@@ -0,0 +1,326 @@
+# archive.py
+"""
+Архив кандидатов закрытых вакансий.
+
+Кандидаты вакансии, которая закрыта (у компании есть более новая вакансия)
+и давно неактивна (settings.archive_after_days), переносятся в отдельную БД
+архива (settings.archive_db_url): каждая строка — сжатый zlib JSON со всеми
+полями кандидата. В основной БД остаются вакансия (с отметкой archived_at)
+и её счётчики воронки с дневными агрегатами — аналитика продолжает работать.
+В архиве дополнительно сохраняется сводка по источникам и причинам отсева.
+
+Запуск вручную:
+    python archive.py archive [дней]   — архивировать закрытые вакансии
+    python archive.py restore <id>     — вернуть кандидатов вакансии в основную БД
+    python archive.py list             — что лежит в архиве
+Бот запускает архивацию сам раз в settings.archive_interval_hours.
+"""
+import json
+import logging
+import sys
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import (
+    JSON,
+    Column,
+    DateTime,
+    Integer,
+    LargeBinary,
+    MetaData,
+    String,
+    Table,
+    delete,
+    exists,
+    func,
+    insert,
+    select,
+    update,
+)
+from sqlalchemy.orm import aliased
+
+from analytics_cache import mark_vacancies_changed
+from config import settings
+from db import create_db_engine, get_session
+from models import Candidate, CandidateStatusEvent, Vacancy
+from rollups import refresh_rollups
+
+logger = logging.getLogger(__name__)
+
+archive_metadata = MetaData()
+
+archived_vacancies = Table(
+    "archived_vacancies",
+    archive_metadata,
+    Column("vacancy_id", Integer, primary_key=True),
+    Column("company_id", Integer, index=True),
+    Column("role", String(255)),
+    Column("city", String(255)),
+    Column("candidates_count", Integer, nullable=False),
+    Column("summary", JSON),
+    Column("archived_at", DateTime, nullable=False),
+)
+
+archived_candidates = Table(
+    "archived_candidates",
+    archive_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("vacancy_id", Integer, nullable=False, index=True),
+    Column("status", String(32)),
+    Column("score", Integer),
+    Column("created_at", DateTime),
+    Column("payload", LargeBinary, nullable=False),
+)
+
+CANDIDATES_TABLE = Candidate.__table__
+_DATETIME_COLUMNS = {c.name for c in CANDIDATES_TABLE.columns if isinstance(c.type, DateTime)}
+
+# Размер пачки id в IN (...): ограничение SQLite на число параметров запроса
+ID_CHUNK = 500
+
+_archive_engine = None
+
+
+def get_archive_engine():
+    """Движок БД архива; схема архива создаётся при первом обращении"""
+    global _archive_engine
+    if _archive_engine is None:
+        _archive_engine = create_db_engine(settings.archive_db_url)
+        archive_metadata.create_all(bind=_archive_engine)
+    return _archive_engine
+
+
+# ===== СЖАТИЕ СТРОК =====
+
+def pack_candidate(row: Dict) -> bytes:
+    """Строка кандидата (все колонки) → сжатый JSON"""
+    data = {
+        key: value.isoformat() if key in _DATETIME_COLUMNS and value is not None else value
+        for key, value in row.items()
+    }
+    return zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+def unpack_candidate(payload: bytes) -> Dict:
+    """Сжатый JSON → значения колонок для INSERT в candidates"""
+    data = json.loads(zlib.decompress(payload).decode("utf-8"))
+    row = {}
+    for column in CANDIDATES_TABLE.columns:
+        if column.name not in data:
+            # Колонка добавлена в схему после архивации — значение по умолчанию
+            default = column.default
+            value = None if default is None else (default.arg(None) if default.is_callable else default.arg)
+        else:
+            value = data[column.name]
+        if column.name in _DATETIME_COLUMNS and isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        row[column.name] = value
+    return row
+
+
+def _chunks(ids: List[int]):
+    for start in range(0, len(ids), ID_CHUNK):
+        yield ids[start:start + ID_CHUNK]
+
+
+def _summary(rows: List[Dict]) -> Dict:
+    """Агрегаты, которые иначе пришлось бы считать по строкам кандидатов"""
+    return {
+        "by_source": dict(Counter(r["source"] or "unknown" for r in rows)),
+        "by_status": dict(Counter(r["status"] or "found" for r in rows)),
+        "rejection_reasons": dict(Counter(r["rejection_reason"] for r in rows if r["rejection_reason"])),
+    }
+
+
+# ===== АРХИВАЦИЯ =====
+
+def find_archivable_vacancies(days: int) -> List[int]:
+    """
+    Закрытые и неактивные вакансии: старше days дней, у компании есть более
+    новая вакансия, и ни один кандидат не проявлял активности за этот срок.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    newer = aliased(Vacancy)
+    with get_session() as session:
+        return list(session.scalars(
+            select(Vacancy.id).where(
+                Vacancy.archived_at.is_(None),
+                Vacancy.created_at < cutoff,
+                exists().where(newer.company_id == Vacancy.company_id, newer.created_at > Vacancy.created_at),
+                ~exists().where(Candidate.vacancy_id == Vacancy.id, Candidate.last_activity_at >= cutoff),
+            )
+        ))
+
+
+def archive_vacancy(vacancy_id: int) -> int:
+    """
+    Переносит кандидатов вакансии в архив. Сначала фиксируется запись в архиве,
+    затем строки удаляются из основной БД — при сбое между шагами повторный
+    запуск просто перезапишет архив. Возвращает число перенесённых кандидатов.
+    """
+    with get_session() as session:
+        vacancy = session.get(Vacancy, vacancy_id)
+        if vacancy is None:
+            return 0
+        rows = [dict(r) for r in session.execute(
+            select(CANDIDATES_TABLE).where(CANDIDATES_TABLE.c.vacancy_id == vacancy_id)
+        ).mappings()]
+        vacancy_row = {
+            "vacancy_id": vacancy.id,
+            "company_id": vacancy.company_id,
+            "role": vacancy.role,
+            "city": vacancy.city,
+        }
+
+    archived_at = datetime.utcnow()
+    with get_archive_engine().begin() as conn:
+        conn.execute(delete(archived_candidates).where(archived_candidates.c.vacancy_id == vacancy_id))
+        conn.execute(delete(archived_vacancies).where(archived_vacancies.c.vacancy_id == vacancy_id))
+        if rows:
+            conn.execute(insert(archived_candidates), [
+                {
+                    "id": r["id"],
+                    "vacancy_id": vacancy_id,
+                    "status": r["status"],
+                    "score": r["score"],
+                    "created_at": r["created_at"],
+                    "payload": pack_candidate(r),
+                }
+                for r in rows
+            ])
+        conn.execute(insert(archived_vacancies).values(
+            **vacancy_row,
+            candidates_count=len(rows),
+            summary=_summary(rows),
+            archived_at=archived_at,
+        ))
+
+    with get_session() as session:
+        # Дневные агрегаты вакансии фиксируются по всей истории до удаления кандидатов
+        refresh_rollups(session, days=0, vacancy_ids=[vacancy_id])
+        # Удаление в обход ORM: счётчики воронки сознательно не уменьшаются —
+        # они остаются агрегатами по вакансии для аналитики
+        for ids in _chunks([r["id"] for r in rows]):
+            session.execute(delete(CANDIDATES_TABLE).where(CANDIDATES_TABLE.c.id.in_(ids)))
+        session.execute(update(Vacancy).where(Vacancy.id == vacancy_id).values(archived_at=archived_at))
+        mark_vacancies_changed(session, [vacancy_id])
+
+    logger.info(f"🗄️ Вакансия {vacancy_id}: в архив перенесено кандидатов: {len(rows)}")
+    return len(rows)
+
+
+def archive_old_vacancies(days: Optional[int] = None) -> int:
+    """Архивирует все подходящие вакансии; возвращает общее число перенесённых кандидатов"""
+    days = settings.archive_after_days if days is None else days
+    if days <= 0:
+        return 0
+    total = 0
+    for vacancy_id in find_archivable_vacancies(days):
+        try:
+            total += archive_vacancy(vacancy_id)
+        except Exception as e:
+            logger.error(f"❌ Не удалось архивировать вакансию {vacancy_id}: {e}")
+    return total
+
+
+# ===== ВОССТАНОВЛЕНИЕ =====
+
+def restore_vacancy(vacancy_id: int) -> int:
+    """
+    Возвращает кандидатов вакансии из архива в основную БД.
+
+    Id удалённых при архивации строк SQLite может выдать новым кандидатам,
+    поэтому кандидат, чей id уже занят кандидатом другой вакансии, вставляется
+    с новым id (его события в журнале смен статуса переносятся на новый id).
+    Строка с тем же id в этой же вакансии — уже восстановленная при прошлом,
+    прерванном запуске: повторно не вставляется. Из архива удаляются только
+    восстановленные строки; запись о вакансии — когда строк не осталось.
+    Счётчики воронки не меняются: при архивации они не уменьшались.
+    """
+    with get_archive_engine().connect() as conn:
+        archived = conn.execute(
+            select(archived_candidates.c.id, archived_candidates.c.payload)
+            .where(archived_candidates.c.vacancy_id == vacancy_id)
+        ).all()
+        is_archived = conn.execute(
+            select(func.count()).select_from(archived_vacancies).where(archived_vacancies.c.vacancy_id == vacancy_id)
+        ).scalar()
+    if not is_archived:
+        return 0
+
+    rows = [unpack_candidate(payload) for _, payload in archived]
+    reassigned: Dict[int, int] = {}
+    with get_session() as session:
+        taken: Dict[int, int] = {}
+        for ids in _chunks([r["id"] for r in rows]):
+            taken.update(session.execute(
+                select(Candidate.id, Candidate.vacancy_id).where(Candidate.id.in_(ids))
+            ).all())
+
+        fresh = [r for r in rows if r["id"] not in taken]
+        moved = [r for r in rows if taken.get(r["id"], vacancy_id) != vacancy_id]
+        # Сначала строки со свободными id: иначе новый id перенесённой строки
+        # мог бы занять один из них
+        if fresh:
+            session.execute(insert(CANDIDATES_TABLE), fresh)
+        for row in moved:
+            values = {k: v for k, v in row.items() if k != "id"}
+            reassigned[row["id"]] = session.execute(
+                insert(CANDIDATES_TABLE).values(**values).returning(CANDIDATES_TABLE.c.id)
+            ).scalar_one()
+        restored_ids = [r["id"] for r in rows]
+        for old_id, new_id in reassigned.items():
+            session.execute(
+                update(CandidateStatusEvent)
+                .where(CandidateStatusEvent.vacancy_id == vacancy_id, CandidateStatusEvent.candidate_id == old_id)
+                .values(candidate_id=new_id)
+            )
+        session.execute(update(Vacancy).where(Vacancy.id == vacancy_id).values(archived_at=None))
+        mark_vacancies_changed(session, [vacancy_id])
+
+    with get_archive_engine().begin() as conn:
+        for ids in _chunks(restored_ids):
+            conn.execute(delete(archived_candidates).where(
+                archived_candidates.c.vacancy_id == vacancy_id, archived_candidates.c.id.in_(ids)
+            ))
+        left = conn.execute(
+            select(func.count()).select_from(archived_candidates).where(archived_candidates.c.vacancy_id == vacancy_id)
+        ).scalar()
+        if left == 0:
+            conn.execute(delete(archived_vacancies).where(archived_vacancies.c.vacancy_id == vacancy_id))
+        else:
+            logger.error(f"❌ Вакансия {vacancy_id}: в архиве остались невосстановленные кандидаты: {left}")
+
+    if reassigned:
+        logger.warning(f"♻️ Вакансия {vacancy_id}: id заняты новыми кандидатами, выданы новые: {reassigned}")
+    logger.info(f"♻️ Вакансия {vacancy_id}: из архива восстановлено кандидатов: {len(restored_ids)}")
+    return len(restored_ids)
+
+
+def archived_vacancies_of(company_id: int) -> List[Dict]:
+    """Архивные вакансии компании со сводкой"""
+    with get_archive_engine().connect() as conn:
+        return [dict(r) for r in conn.execute(
+            select(archived_vacancies)
+            .where(archived_vacancies.c.company_id == company_id)
+            .order_by(archived_vacancies.c.archived_at.desc())
+        ).mappings()]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else "archive"
+    if command == "archive":
+        days = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        print(f"🗄️ Перенесено в архив кандидатов: {archive_old_vacancies(days)}")
+    elif command == "restore" and len(sys.argv) > 2:
+        print(f"♻️ Восстановлено кандидатов: {restore_vacancy(int(sys.argv[2]))}")
+    elif command == "list":
+        with get_archive_engine().connect() as conn:
+            for r in conn.execute(select(archived_vacancies).order_by(archived_vacancies.c.archived_at)).mappings():
+                print(f"   #{r['vacancy_id']} {r['role']} ({r['city']}): {r['candidates_count']} кандидатов, {r['archived_at']:%d.%m.%Y}")
+    else:
+        print("Использование: python archive.py archive [дней] | restore <vacancy_id> | list")
+        sys.exit(1)
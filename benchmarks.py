@@ -0,0 +1,476 @@
+# benchmarks.py
+"""
+Нагрузочные замеры слоя БД.
+
+Запуск: python benchmarks.py [имя_замера ...]
+Без аргументов выполняются все замеры. Каждый работает на временной
+SQLite-базе и не трогает рабочую gwork.db.
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, func, insert, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, undefer_group
+
+from analytics import SCORE_BUCKETS, collect_report_data, render_analytics_report
+from db import Base, create_db_engine
+from html_report import HtmlReportRenderer, iter_html_report, report_counts
+from migrations import migration_0005_pipeline_counts
+from models import PAYLOAD_GROUP, Candidate, CandidateStatus, Company, Vacancy
+from pipeline import get_pipeline_counts
+from rollups import company_rollup_stats, refresh_rollups
+from queries import SCORING_FIELDS, bulk_insert_candidates, bulk_update_candidates, export_chunk_select, get_candidates_page
+from xlsx_writer import XlsxStreamWriter
+
+
+def _temp_db_url(directory: str, name: str) -> str:
+    return f"sqlite:///{os.path.join(directory, name)}"
+
+
+def _seed_vacancy(db_engine) -> int:
+    """Создаёт схему, компанию и вакансию; возвращает id вакансии"""
+    Base.metadata.create_all(bind=db_engine)
+    with db_engine.begin() as conn:
+        company_id = conn.execute(
+            insert(Company).values(
+                owner_id=1, name_and_industry="Бенчмарк", location="Москва",
+                schedule="5/2", salary_range="100-150", tone="neutral",
+            )
+        ).inserted_primary_key[0]
+        return conn.execute(
+            insert(Vacancy).values(
+                company_id=company_id, role="Python разработчик", city="Москва",
+                schedule="5/2", start_when="сразу", must_have="python, sql",
+                created_at=datetime.utcnow(),
+            )
+        ).inserted_primary_key[0]
+
+
+def _candidate_row(vacancy_id: int, n: int) -> dict:
+    return {
+        "vacancy_id": vacancy_id,
+        "name_or_nick": f"Кандидат {n}",
+        "contact": f"@candidate_{n}",
+        "city": "Москва",
+        "experience_text": "3 года Python",
+        "skills_text": "python, sql, docker",
+        "source": "benchmark",
+        "source_link": "",
+        "raw_text": "Опыт разработки backend на Python, SQL, Docker. " * 5,
+        "score": n % 100,
+        "explanation": "",
+        "status": "found",
+        "created_at": datetime.utcnow(),
+    }
+
+
+# ===== КОНКУРЕНТНАЯ ЗАПИСЬ =====
+
+def _concurrent_writes(db_engine, threads: int, writes_per_thread: int) -> tuple[float, int]:
+    """Каждый поток делает writes_per_thread коротких транзакций (INSERT + COMMIT)"""
+    vacancy_id = _seed_vacancy(db_engine)
+    errors = 0
+    errors_lock = threading.Lock()
+
+    def worker(worker_id: int) -> None:
+        nonlocal errors
+        for i in range(writes_per_thread):
+            try:
+                with db_engine.begin() as conn:
+                    conn.execute(insert(Candidate).values(**_candidate_row(vacancy_id, worker_id * 100000 + i)))
+            except OperationalError:
+                with errors_lock:
+                    errors += 1
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    ok = threads * writes_per_thread - errors
+    return ok / elapsed, errors
+
+
+def bench_concurrent_writes(threads: int = 8, writes_per_thread: int = 200) -> None:
+    """Сравнение движка по умолчанию (прежний create_engine(url)) и production-профиля (WAL + pragmas)"""
+    print(f"\n📝 КОНКУРЕНТНАЯ ЗАПИСЬ: {threads} потоков × {writes_per_thread} транзакций")
+    print("=" * 60)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Старое поведение: rollback journal, таймаут блокировки драйвера по умолчанию (5 с)
+        default_engine = create_engine(_temp_db_url(tmp, "default.db"))
+        rate, errors = _concurrent_writes(default_engine, threads, writes_per_thread)
+        default_engine.dispose()
+        print(f"   по умолчанию:  {rate:8.0f} записей/с, ошибок «database is locked»: {errors}")
+
+        tuned_engine = create_db_engine(_temp_db_url(tmp, "tuned.db"))
+        rate, errors = _concurrent_writes(tuned_engine, threads, writes_per_thread)
+        tuned_engine.dispose()
+        print(f"   production:    {rate:8.0f} записей/с, ошибок «database is locked»: {errors}")
+
+
+# ===== СТРАНИЦА КАНДИДАТОВ =====
+
+STATUSES = [s.value for s in CandidateStatus]
+
+
+def _seed_candidates(db_engine, vacancy_id: int, count: int, batch: int = 5000, resume_bytes: int = 0) -> None:
+    """
+    Кандидаты с реалистичными «тяжёлыми» полями (резюме, детали предквалификации).
+    resume_bytes > 0 — резюме из случайных символов заданного размера (плохо сжимается).
+    """
+    rnd = random.Random(vacancy_id)
+    details = {"verdict_text": "Подходит", "schedule": {"score": 80, "comment": "ок" * 50}, "history": ["ответ" * 40] * 5}
+    with db_engine.begin() as conn:
+        for start in range(0, count, batch):
+            rows = []
+            for n in range(start, min(start + batch, count)):
+                row = _candidate_row(vacancy_id, n)
+                row["raw_text"] = "Опыт разработки backend на Python, SQL, Docker, Kubernetes. " * 40
+                if resume_bytes:
+                    row["raw_text"] = rnd.randbytes(resume_bytes // 2).hex()
+                row["created_at"] = datetime.now() - timedelta(hours=n % 500)
+                row["last_message_at"] = row["created_at"] + timedelta(hours=n % 7 + 1)
+                row["status"] = STATUSES[n % len(STATUSES)]
+                row["qualification_details"] = details
+                row["qualification_history"] = details["history"]
+                row["extracted_keywords"] = ["python", "sql", "docker", "backend"] * 5
+                row["experience_years"] = n % 12 + 0.5
+                row["salary_expectations"] = 100000 + n % 50 * 5000
+                rows.append(row)
+            conn.execute(insert(Candidate), rows)
+        # Вставка в обход ORM — счётчики воронки пересчитываем так же, как миграция
+        migration_0005_pipeline_counts(conn)
+
+
+def _legacy_page(session: Session, vacancy_id: int, page: int, per_page: int) -> list:
+    """Прежний способ: все кандидаты вакансии целиком, счётчики и срез страницы — в Python"""
+    all_cands = session.scalars(
+        select(Candidate)
+        .where(Candidate.vacancy_id == vacancy_id)
+        .order_by(Candidate.score.desc())
+        .options(undefer_group(PAYLOAD_GROUP))
+    ).all()
+    payable = [c for c in all_cands if c.status != CandidateStatus.REJECTED.value]
+    _ = (
+        len([c for c in all_cands if c.score >= 80]),
+        len([c for c in all_cands if 60 <= c.score < 80]),
+        len([c for c in all_cands if c.status == CandidateStatus.REJECTED.value]),
+    )
+    return payable[page * per_page:(page + 1) * per_page]
+
+
+def bench_candidates_page(count: int = 50000, repeats: int = 5) -> None:
+    """Время подготовки одной страницы карточек при большом числе кандидатов"""
+    print(f"\n📄 СТРАНИЦА КАНДИДАТОВ: {count} кандидатов у вакансии, {repeats} повторов")
+    print("=" * 60)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_engine = create_db_engine(_temp_db_url(tmp, "page.db"))
+        vacancy_id = _seed_vacancy(db_engine)
+        _seed_candidates(db_engine, vacancy_id, count)
+
+        for title, render in (
+            ("все строки целиком", lambda s: _legacy_page(s, vacancy_id, 3, 5)),
+            ("счётчики + страница", lambda s: get_candidates_page(s, vacancy_id, 3, 5)[0]),
+        ):
+            timings = []
+            for _ in range(repeats):
+                with Session(db_engine) as session:
+                    started = time.perf_counter()
+                    page_cands = render(session)
+                    _ = [len(c.raw_text) for c in page_cands]
+                    timings.append(time.perf_counter() - started)
+            print(f"   {title:20s} {min(timings) * 1000:8.1f} мс (лучший), {sum(timings) / len(timings) * 1000:8.1f} мс (средний)")
+        db_engine.dispose()
+
+
+# ===== АНАЛИТИЧЕСКИЙ ОТЧЁТ =====
+
+def _legacy_report(session: Session, vacancy_id: int) -> dict:
+    """Прежний способ: отдельный запрос на каждый блок отчёта, оценки — по объектам в Python"""
+    stats = get_pipeline_counts(session, vacancy_id)
+    sources = dict(session.execute(
+        select(Candidate.source, func.count(Candidate.id))
+        .where(Candidate.vacancy_id == vacancy_id).group_by(Candidate.source)
+    ).all())
+    conversion = get_pipeline_counts(session, vacancy_id)
+    for status in ("invited", "answering", "qualified"):
+        session.scalar(
+            select(func.avg(func.julianday(Candidate.last_message_at) - func.julianday(Candidate.created_at)))
+            .where(Candidate.vacancy_id == vacancy_id, Candidate.status == status)
+        )
+    score_dist = {name: 0 for name, _ in SCORE_BUCKETS}
+    for c in session.scalars(select(Candidate).where(Candidate.vacancy_id == vacancy_id)):
+        name = next((name for name, upper in SCORE_BUCKETS if upper is None or c.score <= upper))
+        score_dist[name] += 1
+    daily = session.execute(
+        select(func.date(Candidate.created_at), func.count(Candidate.id))
+        .where(Candidate.vacancy_id == vacancy_id, Candidate.created_at >= datetime.now() - timedelta(days=7))
+        .group_by(func.date(Candidate.created_at))
+    ).all()
+    return {"stats": stats, "sources": sources, "conversion": conversion, "score_dist": score_dist, "daily": daily}
+
+
+def bench_analytics_report(count: int = 20000, repeats: int = 5) -> None:
+    """Время сборки аналитического отчёта при разном размере резюме кандидатов"""
+    print(f"\n📊 АНАЛИТИЧЕСКИЙ ОТЧЁТ: {count} кандидатов у вакансии, {repeats} повторов")
+    print("=" * 60)
+    with tempfile.TemporaryDirectory() as tmp:
+        for resume_bytes in (200, 20000):
+            db_engine = create_db_engine(_temp_db_url(tmp, f"report_{resume_bytes}.db"))
+            vacancy_id = _seed_vacancy(db_engine)
+            _seed_candidates(db_engine, vacancy_id, count, batch=1000, resume_bytes=resume_bytes)
+            for title, build in (
+                ("запрос на блок", lambda s: _legacy_report(s, vacancy_id)),
+                ("один проход", lambda s: render_analytics_report(collect_report_data(s, vacancy_id))),
+            ):
+                timings = []
+                for _ in range(repeats):
+                    with Session(db_engine) as session:
+                        started = time.perf_counter()
+                        build(session)
+                        timings.append(time.perf_counter() - started)
+                print(f"   резюме {resume_bytes:6d} Б, {title:15s} {min(timings) * 1000:8.1f} мс (лучший), {sum(timings) / len(timings) * 1000:8.1f} мс (средний)")
+            db_engine.dispose()
+
+
+# ===== АНАЛИТИКА КОМПАНИИ =====
+
+def _company_stats_direct(session: Session, company_id: int) -> dict:
+    """Без агрегатов: GROUP BY по всем кандидатам компании"""
+    rows = session.execute(
+        select(Candidate.source, Candidate.status, func.count())
+        .join(Vacancy, Vacancy.id == Candidate.vacancy_id)
+        .where(Vacancy.company_id == company_id)
+        .group_by(Candidate.source, Candidate.status)
+    ).all()
+    return {(source, status): count for source, status, count in rows}
+
+
+def bench_company_stats(sizes: tuple = (10000, 50000), repeats: int = 5) -> None:
+    """Аналитика компании: по кандидатам и по дневным агрегатам при разном числе кандидатов"""
+    print(f"\n🏢 АНАЛИТИКА КОМПАНИИ: {', '.join(map(str, sizes))} кандидатов, {repeats} повторов")
+    print("=" * 60)
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in sizes:
+            db_engine = create_db_engine(_temp_db_url(tmp, f"company_{count}.db"))
+            vacancy_id = _seed_vacancy(db_engine)
+            _seed_candidates(db_engine, vacancy_id, count)
+            with Session(db_engine) as session:
+                company_id = session.get(Vacancy, vacancy_id).company_id
+                refresh_rollups(session, days=0)
+                session.commit()
+            for title, build in (
+                ("по кандидатам", lambda s: _company_stats_direct(s, company_id)),
+                ("по агрегатам", lambda s: company_rollup_stats(s, company_id, days=90)),
+            ):
+                timings = []
+                for _ in range(repeats):
+                    with Session(db_engine) as session:
+                        started = time.perf_counter()
+                        build(session)
+                        timings.append(time.perf_counter() - started)
+                print(f"   {count:6d} канд., {title:14s} {min(timings) * 1000:8.1f} мс (лучший), {sum(timings) / len(timings) * 1000:8.1f} мс (средний)")
+            db_engine.dispose()
+
+
+# ===== ЗАПИСЬ НАЙДЕННЫХ КАНДИДАТОВ =====
+
+def _ingest_per_row(db_engine, candidates: list) -> None:
+    """Прежний способ: session.add по одному, commit вставки, затем commit оценок"""
+    with Session(db_engine, expire_on_commit=False) as session:
+        for c in candidates:
+            session.add(c)
+        session.commit()
+        for c in candidates:
+            c.score = 75
+            c.status = CandidateStatus.FILTERED.value
+        session.commit()
+
+
+def _ingest_bulk(db_engine, candidates: list) -> None:
+    """Один INSERT ... RETURNING id и один пакетный UPDATE оценок"""
+    with Session(db_engine) as session:
+        bulk_insert_candidates(session, candidates)
+        session.commit()
+    for c in candidates:
+        c.score = 75
+        c.status = CandidateStatus.FILTERED.value
+    with Session(db_engine) as session:
+        bulk_update_candidates(session, candidates, SCORING_FIELDS)
+        session.commit()
+
+
+def bench_ingest(count: int = 2000) -> None:
+    """Сохранение пачки найденных кандидатов и их оценок"""
+    print(f"\n📥 ЗАПИСЬ НАЙДЕННЫХ КАНДИДАТОВ: {count} кандидатов")
+    print("=" * 60)
+    with tempfile.TemporaryDirectory() as tmp:
+        for title, ingest in (("по одному", _ingest_per_row), ("пакетом", _ingest_bulk)):
+            db_engine = create_db_engine(_temp_db_url(tmp, f"ingest_{ingest.__name__}.db"))
+            vacancy_id = _seed_vacancy(db_engine)
+            candidates = [Candidate(**_candidate_row(vacancy_id, n)) for n in range(count)]
+            statements = []
+            event.listen(db_engine, "before_cursor_execute", lambda *args: statements.append(1))
+            started = time.perf_counter()
+            ingest(db_engine, candidates)
+            elapsed = time.perf_counter() - started
+            db_engine.dispose()
+            print(f"   {title:12s} {elapsed * 1000:8.1f} мс, {count / elapsed:8.0f} кандидатов/с, запросов к БД: {len(statements)}")
+
+
+# ===== ВЫГРУЗКА XLSX =====
+
+_XLSX_HEADERS = [
+    "ID", "Имя", "Город", "Опыт", "Опыт, лет", "Навыки", "Источник", "Оценка",
+    "Объяснение оценки", "Статус", "Дата найден", "Ожидания по зарплате", "Контакт", "Предквалификация",
+]
+
+
+def _export_xlsx(db_engine, vacancy_id: int, path: str) -> int:
+    """Выгрузка вакансии в .xlsx тем же путём, что и бот: keyset-пачки → XlsxStreamWriter"""
+    writer = XlsxStreamWriter(_XLSX_HEADERS, sheet_name="Кандидаты")
+    after_id = 0
+    with open(path, "wb") as out:
+        while True:
+            with Session(db_engine) as session:
+                rows = session.execute(export_chunk_select(vacancy_id, after_id)).all()
+            if not rows:
+                break
+            out.write(writer.write_rows(
+                (
+                    r.id, r.name_or_nick, r.city, r.experience_text, r.experience_years, r.skills_text,
+                    r.source, r.score, r.explanation, r.status, r.created_at, r.salary_expectations,
+                    r.contact, r.qualification_score,
+                )
+                for r in rows
+            ))
+            after_id = rows[-1].id
+        out.write(writer.close())
+    return writer.rows_written
+
+
+def bench_xlsx_export(sizes: tuple = (10000, 100000)) -> None:
+    """Время и пиковая память потоковой выгрузки в Excel при разном числе кандидатов"""
+    print(f"\n📗 ВЫГРУЗКА XLSX: {', '.join(map(str, sizes))} кандидатов")
+    print("=" * 60)
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in sizes:
+            db_engine = create_db_engine(_temp_db_url(tmp, f"xlsx_{count}.db"))
+            vacancy_id = _seed_vacancy(db_engine)
+            _seed_candidates(db_engine, vacancy_id, count)
+            path = os.path.join(tmp, f"export_{count}.xlsx")
+
+            started = time.perf_counter()
+            rows = _export_xlsx(db_engine, vacancy_id, path)
+            elapsed = time.perf_counter() - started
+
+            # Отдельный прогон под tracemalloc: он сильно замедляет выполнение
+            tracemalloc.start()
+            _export_xlsx(db_engine, vacancy_id, path)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            db_engine.dispose()
+
+            with zipfile.ZipFile(path) as archive:
+                assert archive.testzip() is None, "повреждённый архив"
+            print(
+                f"   {rows:7d} строк: {elapsed * 1000:8.1f} мс, {rows / elapsed:8.0f} строк/с, "
+                f"файл {os.path.getsize(path) / 1024 / 1024:6.1f} МБ, пик памяти {peak / 1024 / 1024:5.1f} МБ"
+            )
+
+
+# ===== HTML-ОТЧЁТ =====
+
+def _legacy_html_report(candidates: list, vacancy, company) -> str:
+    """Прежний способ: html += на каждую строку, datetime.now() на каждую строку (без лимита в 50)"""
+    total = len(candidates)
+    qualified = len([c for c in candidates if c.status == "qualified"])
+    html = f"<html><body><h1>{vacancy.role}</h1><p>{company.name_and_industry} {datetime.now()}</p>"
+    html += f"<p>{total} {qualified}</p><table>"
+    for c in candidates:
+        row_class = "new" if (datetime.now() - c.created_at) < timedelta(days=1) else ""
+        status_class = "qualified" if c.status == "qualified" else ""
+        html += f"""
+            <tr class="{row_class}">
+                <td>{c.id}</td>
+                <td>{c.name_or_nick}</td>
+                <td>{c.city}</td>
+                <td>{c.experience_text[:50]}</td>
+                <td>{c.score}</td>
+                <td class="{status_class}">{c.status}</td>
+                <td>{c.created_at.strftime('%d.%m.%Y') if c.created_at else ''}</td>
+                <td>{c.contact}</td>
+            </tr>
+        """
+    html += "</table></body></html>"
+    return html
+
+
+def bench_html_report(sizes: tuple = (1000, 10000, 50000), repeats: int = 3) -> None:
+    """Время рендера HTML-отчёта (без чтения из БД) при разном числе кандидатов"""
+    print(f"\n🧾 HTML-ОТЧЁТ: {', '.join(map(str, sizes))} кандидатов, {repeats} повторов")
+    print("=" * 60)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_engine = create_db_engine(_temp_db_url(tmp, "html.db"))
+        vacancy_id = _seed_vacancy(db_engine)
+        _seed_candidates(db_engine, vacancy_id, max(sizes))
+        with Session(db_engine) as session:
+            vacancy = session.get(Vacancy, vacancy_id)
+            company = session.get(Company, vacancy.company_id)
+            rows = session.execute(export_chunk_select(vacancy_id, limit=max(sizes))).all()
+        db_engine.dispose()
+
+    for count in sizes:
+        candidates = rows[:count]
+        chunks = [candidates[i:i + 1000] for i in range(0, count, 1000)]
+        for title, render in (
+            ("html +=", lambda: len(_legacy_html_report(candidates, vacancy, company))),
+            # Как при отправке: части документа уходят дальше, целиком он не собирается
+            ("шаблоны", lambda: sum(len(part) for part in iter_html_report(
+                HtmlReportRenderer(vacancy, company, report_counts(candidates)), chunks
+            ))),
+        ):
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                size = render()
+                timings.append(time.perf_counter() - started)
+            tracemalloc.start()
+            render()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"   {count:6d} строк, {title:8s} {min(timings) * 1000:8.1f} мс, "
+                f"документ {size / 1024 / 1024:5.1f} МБ, пик памяти {peak / 1024 / 1024:5.1f} МБ"
+            )
+
+
+BENCHMARKS = {
+    "writes": bench_concurrent_writes,
+    "page": bench_candidates_page,
+    "ingest": bench_ingest,
+    "report": bench_analytics_report,
+    "company": bench_company_stats,
+    "xlsx": bench_xlsx_export,
+    "html": bench_html_report,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"❌ Неизвестный замер: {name}. Доступны: {', '.join(BENCHMARKS)}")
+            continue
+        BENCHMARKS[name]()
@@ -29,13 +29,14 @@ from aiogram.types import (
     SuccessfulPayment,
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from sqlalchemy import func
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import undefer_group
 from flask import Flask, jsonify
 
 from config import settings
-from db import get_session, init_db
+from db import get_async_session, get_session, init_db
 from deepseek_client import DeepSeekClient
-from models import Candidate, CandidateStatus, Company, InterviewSlot, Vacancy, VacancyTemplate
+from models import PAYLOAD_GROUP, Candidate, CandidateStatus, Company, InterviewSlot, Vacancy, VacancyTemplate
 try:
     from models import Payment, PaymentStatus
 except Exception:
@@ -59,6 +60,25 @@ from filters import (
     extract_city_from_text
 )
 from pre_qualification import PreQualificationAnalyzer, format_qualification_results
+from queries import (
+    SCORING_FIELDS,
+    bulk_insert_candidates,
+    bulk_update_candidates,
+    count_payable_candidates,
+    get_candidates_page,
+)
+from scoring import (
+    SEARCH_BASE_SCORE,
+    calculate_candidate_score,
+    candidate_explanation,
+    mark_scored,
+    needs_rescoring,
+    render_score_explanation,
+    select_llm_shortlist,
+)
+from pipeline import bulk_set_status, get_pipeline_counts, set_candidate_status
+from similarity import TfidfMatcher, candidate_match_text, vacancy_match_text
+from user_context import get_owner_company, get_owner_company_and_vacancy
 from export_utils import (
     generate_csv_report,
     generate_html_report,
@@ -67,9 +87,13 @@ from export_utils import (
     get_date_filter_keyboard,
     get_sort_keyboard
 )
+from archive import archive_old_vacancies, archived_vacancies_of, restore_vacancy
+from rollups import refresh_all_rollups
+from analytics_cache import mark_vacancies_changed
 from analytics import (
     AnalyticsService,
-    format_analytics_report
+    format_analytics_report,
+    red_flag_counts,
 )
 from email_service import email_service
 from yandex_calendar import YandexCalendarClient
@@ -226,81 +250,93 @@ def run_vk_bot_in_separate_loop():
 # ===== АВТОМАТИЧЕСКИЕ ПРИГЛАШЕНИЯ ДЛЯ ТОП-КАНДИДАТОВ =====
 async def auto_invite_top_candidates(vacancy_id: int, company: Company, vacancy: Vacancy):
     """Автоматически приглашает кандидатов с высоким рейтингом"""
-    with get_session() as session:
-        top_candidates = session.query(Candidate).filter(
-            Candidate.vacancy_id == vacancy_id,
-            Candidate.score >= 80,
-            Candidate.status == CandidateStatus.FILTERED.value
-        ).all()
-        
-        invited_count = 0
-        no_contact_count = 0
-        email_count = 0
-        phone_count = 0
-        
-        for candidate in top_candidates:
-            # Проверяем наличие контактов
-            contact_info = candidate.contact or ""
-            
-            # Ищем Telegram username
-            tg_match = re.search(r'@(\w+)', contact_info)
-            
-            if tg_match:
-                # Есть Telegram - отправляем автоматически
-                tg_username = tg_match.group(0)
-                invite_text = generate_invite_message(candidate, vacancy, company)
-                try:
-                    await bot.send_message(
-                        chat_id=tg_username,
-                        text=invite_text,
-                        parse_mode="HTML"
-                    )
-                    candidate.status = CandidateStatus.INVITED.value
-                    invited_count += 1
-                    logger.info(f"✅ Авто-приглашение отправлено в Telegram: {candidate.name_or_nick} ({tg_username})")
-                    await asyncio.sleep(0.5)
-                except Exception as e:
-                    logger.error(f"❌ Ошибка отправки в Telegram {candidate.name_or_nick}: {e}")
-                    # Если не отправилось, пробуем другие контакты
-                    await _send_alternative_contact_notification(company, candidate, contact_info, vacancy)
-            else:
-                # Нет Telegram - ищем email или телефон
-                no_contact_count += 1
-                
-                # Поиск email
-                email_match = re.search(r'[\w\.-]+@[\w\.-]+\.\w+', contact_info)
-                # Поиск телефона (российские номера)
-                phone_match = re.search(r'\+?7[\s\-]?\(?[0-9]{3}\)?[\s\-]?[0-9]{3}[\s\-]?[0-9]{2}[\s\-]?[0-9]{2}', contact_info)
-                
-                if email_match:
-                    email_count += 1
-                    await _send_email_contact_notification(company, candidate, email_match.group(0), contact_info, vacancy)
-                elif phone_match:
-                    phone_count += 1
-                    await _send_phone_contact_notification(company, candidate, phone_match.group(0), contact_info, vacancy)
-                else:
-                    # Нет никаких контактов - просто уведомляем работодателя
-                    await _send_no_contact_notification(company, candidate, contact_info, vacancy)
+    # Сессия нужна только на выборку: рассылка идёт без открытой транзакции
+    async with get_async_session() as session:
+        top_candidates = (await session.scalars(
+            select(Candidate).where(
+                Candidate.vacancy_id == vacancy_id,
+                Candidate.score >= 80,
+                Candidate.status == CandidateStatus.FILTERED.value
+            )
+        )).all()
+    
+    invited_ids = []
+    invited_count = 0
+    no_contact_count = 0
+    email_count = 0
+    phone_count = 0
+    
+    for candidate in top_candidates:
+        # Проверяем наличие контактов
+        contact_info = candidate.contact or ""
         
-        session.commit()
+        # Ищем Telegram username
+        tg_match = re.search(r'@(\w+)', contact_info)
         
-        # Отправляем сводку работодателю
-        if invited_count > 0 or no_contact_count > 0:
-            summary = f"📊 <b>Сводка авто-приглашений</b>\n\n"
-            summary += f"✅ Отправлено в Telegram: {invited_count}\n"
-            if email_count > 0:
-                summary += f"📧 Найдено email: {email_count} (требуется ручной контакт)\n"
-            if phone_count > 0:
-                summary += f"📞 Найдено телефонов: {phone_count} (требуется ручной контакт)\n"
-            if no_contact_count - email_count - phone_count > 0:
-                summary += f"⚠️ Без контактов: {no_contact_count - email_count - phone_count}\n"
+        if tg_match:
+            # Есть Telegram - отправляем автоматически
+            tg_username = tg_match.group(0)
+            invite_text = generate_invite_message(candidate, vacancy, company)
+            try:
+                await bot.send_message(
+                    chat_id=tg_username,
+                    text=invite_text,
+                    parse_mode="HTML"
+                )
+                invited_ids.append(candidate.id)
+                invited_count += 1
+                logger.info(f"✅ Авто-приглашение отправлено в Telegram: {candidate.name_or_nick} ({tg_username})")
+                await asyncio.sleep(0.5)
+            except Exception as e:
+                logger.error(f"❌ Ошибка отправки в Telegram {candidate.name_or_nick}: {e}")
+                # Если не отправилось, пробуем другие контакты
+                await _send_alternative_contact_notification(company, candidate, contact_info, vacancy)
+        else:
+            # Нет Telegram - ищем email или телефон
+            no_contact_count += 1
             
-            await bot.send_message(
-                chat_id=company.owner_id,
-                text=summary,
-                parse_mode="HTML"
-            )
-            logger.info(f"📨 Отправлено {invited_count} авто-приглашений, {no_contact_count} кандидатов без Telegram")
+            # Поиск email
+            email_match = re.search(r'[\w\.-]+@[\w\.-]+\.\w+', contact_info)
+            # Поиск телефона (российские номера)
+            phone_match = re.search(r'\+?7[\s\-]?\(?[0-9]{3}\)?[\s\-]?[0-9]{3}[\s\-]?[0-9]{2}[\s\-]?[0-9]{2}', contact_info)
+            
+            if email_match:
+                email_count += 1
+                await _send_email_contact_notification(company, candidate, email_match.group(0), contact_info, vacancy)
+            elif phone_match:
+                phone_count += 1
+                await _send_phone_contact_notification(company, candidate, phone_match.group(0), contact_info, vacancy)
+            else:
+                # Нет никаких контактов - просто уведомляем работодателя
+                await _send_no_contact_notification(company, candidate, contact_info, vacancy)
+    
+    # Уведомления выше перевели часть кандидатов в CLARIFY на отсоединённых
+    # объектах: add() возвращает их в сессию с этими изменениями, а счётчики
+    # и журнал статусов обновятся при flush
+    clarified = [c for c in top_candidates if c.status == CandidateStatus.CLARIFY.value]
+    if invited_ids or clarified:
+        async with get_async_session() as session:
+            if invited_ids:
+                await session.run_sync(bulk_set_status, invited_ids, CandidateStatus.INVITED)
+            session.add_all(clarified)
+    
+    # Отправляем сводку работодателю
+    if invited_count > 0 or no_contact_count > 0:
+        summary = f"📊 <b>Сводка авто-приглашений</b>\n\n"
+        summary += f"✅ Отправлено в Telegram: {invited_count}\n"
+        if email_count > 0:
+            summary += f"📧 Найдено email: {email_count} (требуется ручной контакт)\n"
+        if phone_count > 0:
+            summary += f"📞 Найдено телефонов: {phone_count} (требуется ручной контакт)\n"
+        if no_contact_count - email_count - phone_count > 0:
+            summary += f"⚠️ Без контактов: {no_contact_count - email_count - phone_count}\n"
+        
+        await bot.send_message(
+            chat_id=company.owner_id,
+            text=summary,
+            parse_mode="HTML"
+        )
+        logger.info(f"📨 Отправлено {invited_count} авто-приглашений, {no_contact_count} кандидатов без Telegram")
 
 
 async def _send_alternative_contact_notification(company: Company, candidate: Candidate, contact_info: str, vacancy: Vacancy):
@@ -340,7 +376,7 @@ async def _send_alternative_contact_notification(company: Company, candidate: Ca
     )
     
     # Обновляем статус кандидата
-    candidate.status = CandidateStatus.CLARIFY.value
+    set_candidate_status(candidate, CandidateStatus.CLARIFY)
     candidate.rejection_reason = "Нет Telegram для авто-приглашения. Требуется ручной контакт."
 
 
@@ -370,7 +406,7 @@ async def _send_email_contact_notification(company: Company, candidate: Candidat
         parse_mode="HTML"
     )
     
-    candidate.status = CandidateStatus.CLARIFY.value
+    set_candidate_status(candidate, CandidateStatus.CLARIFY)
     candidate.rejection_reason = f"Нет Telegram. Email: {email}"
 
 
@@ -397,7 +433,7 @@ async def _send_phone_contact_notification(company: Company, candidate: Candidat
         parse_mode="HTML"
     )
     
-    candidate.status = CandidateStatus.CLARIFY.value
+    set_candidate_status(candidate, CandidateStatus.CLARIFY)
     candidate.rejection_reason = f"Нет Telegram. Телефон: {phone}"
 
 
@@ -425,7 +461,7 @@ async def _send_no_contact_notification(company: Company, candidate: Candidate,
         parse_mode="HTML"
     )
     
-    candidate.status = CandidateStatus.CLARIFY.value
+    set_candidate_status(candidate, CandidateStatus.CLARIFY)
     candidate.rejection_reason = "Нет контактных данных для связи"
 
 
@@ -1008,14 +1044,19 @@ async def send_message_to_candidate(candidate: Candidate, message_text: str) ->
                 )
                 logger.info(f"✅ Сообщение отправлено {username}")
                 
-                # Обновляем время последнего сообщения
-                with get_session() as session:
-                    cand = session.query(Candidate).filter(Candidate.id == candidate.id).first()
-                    if cand:
-                        cand.last_message_sent = message_text[:500]
-                        cand.last_message_at = datetime.now()
-                        cand.last_activity_at = datetime.now()
-                        session.commit()
+                # Обновляем время последнего сообщения (точечный UPDATE, без загрузки строки)
+                async with get_async_session() as session:
+                    await session.execute(
+                        update(Candidate)
+                        .where(Candidate.id == candidate.id)
+                        .values(
+                            last_message_sent=message_text[:500],
+                            last_message_at=datetime.now(),
+                            last_activity_at=datetime.now(),
+                        )
+                    )
+                    # UPDATE в обход ORM — время сообщения входит в аналитику вакансии
+                    mark_vacancies_changed(session.sync_session, [candidate.vacancy_id])
                 
                 return True
             except Exception as e:
@@ -1194,150 +1235,6 @@ def _create_calendar_event_for_candidate(
 
     return event, calendar_note
 
-def calculate_candidate_score(candidate: Candidate, vacancy: Vacancy, company: Company) -> tuple:
-    """
-    Улучшенный алгоритм оценки кандидата без использования внешнего API
-    Оценивает по нескольким критериям с весами
-    Возвращает (score, explanation_parts)
-    """
-    score = 0
-    explanation_parts = []
-    
-    # 1. Город (вес: 20 баллов)
-    city_score = 0
-    if vacancy.city.lower() in candidate.city.lower():
-        city_score = 20
-        explanation_parts.append(f"🏙️ Город совпадает: +20")
-    elif candidate.normalized_city and vacancy.city.lower() in candidate.normalized_city.lower():
-        city_score = 15
-        explanation_parts.append(f"🏙️ Город (нормализованный) совпадает: +15")
-    else:
-        if candidate.normalized_city_from_text and vacancy.city.lower() in candidate.normalized_city_from_text.lower():
-            city_score = 10
-            explanation_parts.append(f"🏙️ Город упомянут в тексте: +10")
-        else:
-            explanation_parts.append(f"🏙️ Город не совпадает: +0")
-    score += city_score
-    
-    # 2. Опыт работы (вес: 25 баллов)
-    experience_score = 0
-    if candidate.experience_years:
-        exp_years = candidate.experience_years
-        if exp_years >= 5:
-            experience_score = 25
-            explanation_parts.append(f"💼 Опыт {exp_years} лет (эксперт): +25")
-        elif exp_years >= 3:
-            experience_score = 20
-            explanation_parts.append(f"💼 Опыт {exp_years} лет (хорошо): +20")
-        elif exp_years >= 1:
-            experience_score = 12
-            explanation_parts.append(f"💼 Опыт {exp_years} лет (начальный): +12")
-        else:
-            experience_score = 5
-            explanation_parts.append(f"💼 Опыт {exp_years} лет (мало): +5")
-    else:
-        exp_text = (candidate.experience_text or "").lower()
-        if "более 5" in exp_text or "более пяти" in exp_text:
-            experience_score = 20
-            explanation_parts.append(f"💼 В тексте указан опыт более 5 лет: +20")
-        elif "более 3" in exp_text or "более трех" in exp_text:
-            experience_score = 15
-            explanation_parts.append(f"💼 В тексте указан опыт более 3 лет: +15")
-        elif "опыт работы" in exp_text or "стаж" in exp_text:
-            experience_score = 10
-            explanation_parts.append(f"💼 Есть упоминание опыта: +10")
-        else:
-            experience_score = 5
-            explanation_parts.append(f"💼 Опыт не указан явно: +5")
-    score += experience_score
-    
-    # 3. Навыки и ключевые слова (вес: 30 баллов)
-    skills_score = 0
-    must_have = vacancy.must_have if vacancy.must_have and vacancy.must_have != "-" else ""
-    
-    if must_have:
-        must_have_list = [skill.strip().lower() for skill in must_have.split(",")]
-        candidate_skills = (candidate.skills_text or "").lower()
-        candidate_extracted = " ".join(c.extracted_skills or []) if hasattr(candidate, 'extracted_skills') else ""
-        
-        found_skills = 0
-        for skill in must_have_list:
-            if skill in candidate_skills or skill in candidate_extracted:
-                found_skills += 1
-        
-        if found_skills > 0:
-            skills_score = int((found_skills / len(must_have_list)) * 25)
-            explanation_parts.append(f"📋 Найдено {found_skills}/{len(must_have_list)} требуемых навыков: +{skills_score}")
-        else:
-            skills_score = 5
-            explanation_parts.append(f"📋 Требуемые навыки не найдены: +5")
-    else:
-        skills_count = len(candidate.extracted_skills) if hasattr(candidate, 'extracted_skills') and candidate.extracted_skills else 0
-        if skills_count >= 10:
-            skills_score = 25
-            explanation_parts.append(f"📋 Много навыков ({skills_count}): +25")
-        elif skills_count >= 5:
-            skills_score = 18
-            explanation_parts.append(f"📋 Хороший набор навыков ({skills_count}): +18")
-        elif skills_count >= 2:
-            skills_score = 10
-            explanation_parts.append(f"📋 Базовые навыки ({skills_count}): +10")
-        else:
-            skills_score = 5
-            explanation_parts.append(f"📋 Навыки не указаны: +5")
-    score += skills_score
-    
-    # 4. Зарплатные ожидания (вес: 15 баллов)
-    salary_score = 0
-    if candidate.salary_expectations and (vacancy.salary_from or vacancy.salary_to):
-        salary_expected = candidate.salary_expectations
-        salary_min = vacancy.salary_from or 0
-        salary_max = vacancy.salary_to or float('inf')
-        
-        if salary_min <= salary_expected <= salary_max:
-            salary_score = 15
-            explanation_parts.append(f"💰 Зарплата {salary_expected} руб. входит в вилку: +15")
-        elif salary_expected < salary_min:
-            diff_percent = ((salary_min - salary_expected) / salary_min) * 100 if salary_min > 0 else 0
-            if diff_percent <= 20:
-                salary_score = 10
-                explanation_parts.append(f"💰 Зарплата немного ниже вилки: +10")
-            else:
-                salary_score = 5
-                explanation_parts.append(f"💰 Зарплата значительно ниже вилки: +5")
-        else:
-            diff_percent = ((salary_expected - salary_max) / salary_max) * 100 if salary_max != float('inf') else 0
-            if diff_percent <= 20:
-                salary_score = 8
-                explanation_parts.append(f"💰 Зарплата немного выше вилки: +8")
-            else:
-                salary_score = 3
-                explanation_parts.append(f"💰 Зарплата значительно выше вилки: +3")
-    else:
-        salary_score = 7
-        explanation_parts.append(f"💰 Зарплатные ожидания не указаны: +7")
-    score += salary_score
-    
-    # 5. Качество резюме/текста (вес: 10 баллов)
-    quality_score = 0
-    text_length = len(candidate.raw_text or "")
-    if text_length > 500:
-        quality_score = 10
-        explanation_parts.append(f"📝 Подробное резюме ({text_length} символов): +10")
-    elif text_length > 200:
-        quality_score = 7
-        explanation_parts.append(f"📝 Хорошее резюме ({text_length} символов): +7")
-    elif text_length > 50:
-        quality_score = 4
-        explanation_parts.append(f"📝 Короткое резюме ({text_length} символов): +4")
-    else:
-        quality_score = 1
-        explanation_parts.append(f"📝 Очень краткое резюме: +1")
-    score += quality_score
-    
-    return min(100, score), explanation_parts
-
-
 async def score_candidates_with_fallback(vacancy_desc: str, candidates: List[Dict], vacancy: Vacancy, company: Company) -> Dict:
     """
     Оценивает кандидатов с использованием DeepSeek API,
@@ -1373,7 +1270,7 @@ async def score_candidates_with_fallback(vacancy_desc: str, candidates: List[Dic
             if not candidate:
                 continue
             
-            score, explanation_parts = calculate_candidate_score(candidate, vacancy, company)
+            score, breakdown = calculate_candidate_score(candidate, vacancy, company)
             
             # Учитываем красные флаги
             if candidate.red_flags:
@@ -1381,13 +1278,13 @@ async def score_candidates_with_fallback(vacancy_desc: str, candidates: List[Dic
                 if penalty > 0:
                     old_score = score
                     score = max(0, score - penalty)
-                    explanation_parts.append(f"🚩 Штраф за красные флаги: -{penalty}")
+                    breakdown.append(["red_flags", -penalty])
                     logger.info(f"Кандидат {candidate.name_or_nick}: штраф {penalty}, скор снижен с {old_score} до {score}")
             
             results[candidate_id] = {
                 "id": candidate_id,
                 "score": score,
-                "explanation": " | ".join(explanation_parts)
+                "explanation": render_score_explanation(breakdown)
             }
     
     return results
@@ -1442,7 +1339,7 @@ def score_single_candidate(candidate_id: int) -> None:
             if not candidate.explanation:
                 candidate.explanation = "эвристическая оценка по городу"
         if candidate.score >= 80:
-            candidate.status = CandidateStatus.FILTERED.value
+            set_candidate_status(candidate, CandidateStatus.FILTERED)
         session.commit()
 
 
@@ -1638,7 +1535,7 @@ def build_candidate_card_text(c: Candidate) -> str:
     lines.extend([
         "",
         f"📈 <b>Оценка: {c.score}/100</b>",
-        f"📝 {c.explanation or '—'}",
+        f"📝 {candidate_explanation(c) or '—'}",
         f"📌 Статус: {c.status}",
         f"📊 Источник: {source_text}",
     ])
@@ -1673,7 +1570,7 @@ async def cmd_start(message: Message):
     
     # Проверяем, есть ли профиль компании
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company = get_owner_company(session, message.from_user.id)
     
     if company:
         kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -1699,7 +1596,8 @@ async def cmd_start(message: Message):
             f"<b>Основные команды:</b>\n"
             f"/filters — управление фильтрами\n"
             f"/sort — сортировка кандидатов\n"
-            f"/export — скачать отчёт (CSV/HTML)\n"
+            f"/export — скачать отчёт (CSV/Excel/HTML)\n"
+            f"/export_all — все вакансии компании одним архивом\n"
             f"/send_report — отправить отчёт на email\n"
             f"/analytics — аналитика по вакансии\n"
             f"/calendar_setup — настроить Яндекс.Календарь\n"
@@ -1788,7 +1686,7 @@ async def onboarding_tone(message: Message, state: FSMContext):
     await state.clear()
 
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company = get_owner_company(session, message.from_user.id)
         if company is None:
             company = Company(owner_id=message.from_user.id)
             session.add(company)
@@ -1819,7 +1717,7 @@ async def onboarding_tone(message: Message, state: FSMContext):
 @router.message(Command("new_job"))
 async def cmd_new_job(message: Message, state: FSMContext):
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company = get_owner_company(session, message.from_user.id)
         if company is None:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
@@ -2011,10 +1909,9 @@ async def cb_smart_tariff(callback: CallbackQuery):
 
     status_msg = await callback.message.answer("🔍 Ищу кандидатов и рассчитываю тарифы...")
     try:
-        existing = _get_payable_candidates(vacancy_id)
-        if not existing:
+        if not _count_payable_candidates(vacancy_id):
             await gather_real_candidates(vacancy_id, limit=50, payment_id=None)
-        payable_count = len(_get_payable_candidates(vacancy_id))
+        payable_count = _count_payable_candidates(vacancy_id)
 
         if payable_count == 0:
             await status_msg.edit_text(
@@ -2076,345 +1973,145 @@ async def cb_tariff(callback: CallbackQuery):
         await callback.answer()
 
 
+def _llm_shortlist_size(session, payment_id: Optional[int]) -> int:
+    """Размер top-K для уточнения через LLM: по оплаченному тарифу или из настроек."""
+    if payment_id and Payment is not None:
+        payment = session.query(Payment).filter(Payment.id == payment_id).first()
+        tariff = TARIFFS.get(payment.tariff_key) if payment else None
+        if tariff:
+            return tariff.get("llm_shortlist", settings.llm_shortlist_size)
+    return settings.llm_shortlist_size
+
+
+# Источники кандидатов в порядке опроса: (source, название для логов, функция поиска)
+CANDIDATE_SOURCES = (
+    ("hh", "HeadHunter", search_hh_resumes),
+    ("superjob", "SuperJob", search_superjob_real_candidates),
+    ("habr", "Habr Career", search_habr_candidates),
+    # Trudvsem - ищет ТОЛЬКО резюме
+    ("trudvsem", "Trudvsem", search_trudvsem_candidates),
+    ("telegram", "Telegram", telegram_parser.search_candidates),
+)
+
+
+def _build_sourced_candidate(cand: dict, source: str, vacancy: Vacancy, company: Company) -> Candidate:
+    """Новый (ещё не сохранённый) кандидат из ответа источника: нормализация и жёсткие фильтры"""
+    c = Candidate(
+        vacancy_id=vacancy.id,
+        name_or_nick=cand["name"],
+        contact=cand.get("contact", ""),
+        city=cand["city"],
+        experience_text=cand["experience"],
+        skills_text=", ".join(cand["skills"]),
+        source=source,
+        source_link=cand["url"],
+        raw_text=cand["about"],
+        status=CandidateStatus.FOUND.value,
+        dialog_step=0,
+        first_seen_at=datetime.now(),
+        is_new=True
+    )
+
+    c.salary_expectations = extract_salary(c.raw_text)
+    c.experience_years = extract_experience_years(c.raw_text)
+    c.normalized_city = normalize_city(c.city)
+
+    if c.experience_years:
+        c.normalized_experience_level = normalize_experience_level(c.experience_years)
+    else:
+        parsed_years = parse_experience_to_years(c.experience_text)
+        if parsed_years:
+            c.experience_years = parsed_years
+            c.normalized_experience_level = normalize_experience_level(parsed_years)
+
+    if c.skills_text:
+        normalized_skills = normalize_skills_list(c.skills_text)
+        c.extracted_skills = normalized_skills
+        c.skills_text = ", ".join(normalized_skills[:8])
+
+    city_from_text = extract_city_from_text(c.raw_text)
+    if city_from_text:
+        c.normalized_city_from_text = city_from_text
+
+    keywords = extract_keywords(f"{c.experience_text} {c.skills_text} {c.raw_text}")
+    if keywords:
+        c.extracted_keywords = keywords[:20]
+
+    passed, reason = apply_hard_filters(c, vacancy, company)
+    if not passed:
+        set_candidate_status(c, CandidateStatus.REJECTED)
+        c.rejection_reason = reason
+        logger.info(f"Кандидат {c.name_or_nick} отсеян: {reason}")
+    return c
+
+
 async def gather_real_candidates(vacancy_id: int, limit: Optional[int] = None, payment_id: Optional[int] = None) -> int:
-    """Сбор реальных кандидатов из ВСЕХ источников с применением фильтров и нормализацией"""
+    """
+    Сбор реальных кандидатов из ВСЕХ источников с применением фильтров и нормализацией.
+
+    Запись пакетная: сначала все источники опрашиваются без открытой транзакции,
+    затем новые кандидаты вставляются одним INSERT ... RETURNING id, а оценки
+    и списание по платежу сохраняются одним пакетным UPDATE в конце.
+    """
     with get_session() as session:
         vacancy = session.query(Vacancy).filter(Vacancy.id == vacancy_id).one()
         company = session.query(Company).filter(Company.id == vacancy.company_id).one()
+        llm_top_k = _llm_shortlist_size(session, payment_id)
 
-        candidates: List[Candidate] = []
-        added_count = 0
+    candidates: List[Candidate] = []
 
-        def limit_reached() -> bool:
-            return limit is not None and added_count >= limit
+    def limit_reached() -> bool:
+        return limit is not None and len(candidates) >= limit
 
-        # 1) HeadHunter
-        if not limit_reached():
-            logger.info(f"🔍 Поиск резюме в HeadHunter: {vacancy.role} в {vacancy.city}")
+    for source, title, search in CANDIDATE_SOURCES:
+        if limit_reached():
+            break
+        logger.info(f"🔍 Поиск кандидатов в {title}: {vacancy.role} в {vacancy.city}")
         try:
-            hh_candidates = await search_hh_resumes(vacancy.role, vacancy.city, limit=5 if limit is None else min(5, max(limit - added_count, 1)))
-            for cand in hh_candidates:
+            found = await search(vacancy.role, vacancy.city, limit=min(5, max(limit - len(candidates), 1)) if limit is not None else 5)
+            for cand in found:
                 if limit_reached():
                     break
-                c = Candidate(
-                    vacancy_id=vacancy.id,
-                    name_or_nick=cand["name"],
-                    contact=cand.get("contact", ""),
-                    city=cand["city"],
-                    experience_text=cand["experience"],
-                    skills_text=", ".join(cand["skills"]),
-                    source="hh",
-                    source_link=cand["url"],
-                    raw_text=cand["about"],
-                    status=CandidateStatus.FOUND.value,
-                    dialog_step=0,
-                    first_seen_at=datetime.now(),
-                    is_new=True
-                )
-                
-                c.salary_expectations = extract_salary(c.raw_text)
-                c.experience_years = extract_experience_years(c.raw_text)
-                c.normalized_city = normalize_city(c.city)
-                
-                if c.experience_years:
-                    c.normalized_experience_level = normalize_experience_level(c.experience_years)
-                else:
-                    parsed_years = parse_experience_to_years(c.experience_text)
-                    if parsed_years:
-                        c.experience_years = parsed_years
-                        c.normalized_experience_level = normalize_experience_level(parsed_years)
-                
-                if c.skills_text:
-                    normalized_skills = normalize_skills_list(c.skills_text)
-                    c.extracted_skills = normalized_skills
-                    c.skills_text = ", ".join(normalized_skills[:8])
-                
-                city_from_text = extract_city_from_text(c.raw_text)
-                if city_from_text:
-                    c.normalized_city_from_text = city_from_text
-                
-                keywords = extract_keywords(f"{c.experience_text} {c.skills_text} {c.raw_text}")
-                if keywords:
-                    c.extracted_keywords = keywords[:20]
-                
-                passed, reason = apply_hard_filters(c, vacancy, company)
-                if not passed:
-                    c.status = CandidateStatus.REJECTED.value
-                    c.rejection_reason = reason
-                    logger.info(f"Кандидат {c.name_or_nick} отсеян: {reason}")
-                
-                session.add(c)
-                candidates.append(c)
-                added_count += 1
+                candidates.append(_build_sourced_candidate(cand, source, vacancy, company))
         except Exception as e:
-            logger.error(f"❌ Ошибка HeadHunter: {e}")
+            logger.error(f"❌ Ошибка {title}: {e}")
 
-        # 2) SuperJob
-        if not limit_reached():
-            logger.info(f"🔍 Поиск кандидатов в SuperJob: {vacancy.role} в {vacancy.city}")
-        try:
-            if limit_reached():
-                sj_candidates = []
-            else:
-                sj_candidates = await search_superjob_real_candidates(vacancy.role, vacancy.city, limit=min(5, max(limit - added_count, 1)) if limit is not None else 5)
-            for cand in sj_candidates:
-                if limit_reached():
-                    break
-                c = Candidate(
-                    vacancy_id=vacancy.id,
-                    name_or_nick=cand["name"],
-                    contact=cand.get("contact", ""),
-                    city=cand["city"],
-                    experience_text=cand["experience"],
-                    skills_text=", ".join(cand["skills"]),
-                    source="superjob",
-                    source_link=cand["url"],
-                    raw_text=cand["about"],
-                    status=CandidateStatus.FOUND.value,
-                    dialog_step=0,
-                    first_seen_at=datetime.now(),
-                    is_new=True
-                )
-                
-                c.salary_expectations = extract_salary(c.raw_text)
-                c.experience_years = extract_experience_years(c.raw_text)
-                c.normalized_city = normalize_city(c.city)
-                
-                if c.experience_years:
-                    c.normalized_experience_level = normalize_experience_level(c.experience_years)
-                else:
-                    parsed_years = parse_experience_to_years(c.experience_text)
-                    if parsed_years:
-                        c.experience_years = parsed_years
-                        c.normalized_experience_level = normalize_experience_level(parsed_years)
-                
-                if c.skills_text:
-                    normalized_skills = normalize_skills_list(c.skills_text)
-                    c.extracted_skills = normalized_skills
-                    c.skills_text = ", ".join(normalized_skills[:8])
-                
-                city_from_text = extract_city_from_text(c.raw_text)
-                if city_from_text:
-                    c.normalized_city_from_text = city_from_text
-                
-                keywords = extract_keywords(f"{c.experience_text} {c.skills_text} {c.raw_text}")
-                if keywords:
-                    c.extracted_keywords = keywords[:20]
-                
-                passed, reason = apply_hard_filters(c, vacancy, company)
-                if not passed:
-                    c.status = CandidateStatus.REJECTED.value
-                    c.rejection_reason = reason
-                    logger.info(f"Кандидат {c.name_or_nick} отсеян: {reason}")
-                
-                session.add(c)
-                candidates.append(c)
-                added_count += 1
-        except Exception as e:
-            logger.error(f"❌ Ошибка SuperJob: {e}")
-
-        # 3) Habr Career
-        if not limit_reached():
-            logger.info(f"🔍 Поиск кандидатов в Habr Career: {vacancy.role} в {vacancy.city}")
-        try:
-            if limit_reached():
-                habr_candidates = []
-            else:
-                habr_candidates = await search_habr_candidates(vacancy.role, vacancy.city, limit=min(5, max(limit - added_count, 1)) if limit is not None else 5)
-            for cand in habr_candidates:
-                if limit_reached():
-                    break
-                c = Candidate(
-                    vacancy_id=vacancy.id,
-                    name_or_nick=cand["name"],
-                    contact=cand.get("contact", ""),
-                    city=cand["city"],
-                    experience_text=cand["experience"],
-                    skills_text=", ".join(cand["skills"]),
-                    source="habr",
-                    source_link=cand["url"],
-                    raw_text=cand["about"],
-                    status=CandidateStatus.FOUND.value,
-                    dialog_step=0,
-                    first_seen_at=datetime.now(),
-                    is_new=True
-                )
-                
-                c.salary_expectations = extract_salary(c.raw_text)
-                c.experience_years = extract_experience_years(c.raw_text)
-                c.normalized_city = normalize_city(c.city)
-                
-                if c.experience_years:
-                    c.normalized_experience_level = normalize_experience_level(c.experience_years)
-                else:
-                    parsed_years = parse_experience_to_years(c.experience_text)
-                    if parsed_years:
-                        c.experience_years = parsed_years
-                        c.normalized_experience_level = normalize_experience_level(parsed_years)
-                
-                if c.skills_text:
-                    normalized_skills = normalize_skills_list(c.skills_text)
-                    c.extracted_skills = normalized_skills
-                    c.skills_text = ", ".join(normalized_skills[:8])
-                
-                city_from_text = extract_city_from_text(c.raw_text)
-                if city_from_text:
-                    c.normalized_city_from_text = city_from_text
-                
-                keywords = extract_keywords(f"{c.experience_text} {c.skills_text} {c.raw_text}")
-                if keywords:
-                    c.extracted_keywords = keywords[:20]
-                
-                passed, reason = apply_hard_filters(c, vacancy, company)
-                if not passed:
-                    c.status = CandidateStatus.REJECTED.value
-                    c.rejection_reason = reason
-                    logger.info(f"Кандидат {c.name_or_nick} отсеян: {reason}")
-                
-                session.add(c)
-                candidates.append(c)
-                added_count += 1
-        except Exception as e:
-            logger.error(f"❌ Ошибка Habr: {e}")
-
-        # 4) Trudvsem - ИСПРАВЛЕНО: теперь ищет ТОЛЬКО резюме
-        if not limit_reached():
-            logger.info(f"🔍 Поиск кандидатов в Trudvsem: {vacancy.role} в {vacancy.city}")
-        try:
-            if limit_reached():
-                trudvsem_candidates = []
-            else:
-                trudvsem_candidates = await search_trudvsem_candidates(vacancy.role, vacancy.city, limit=min(5, max(limit - added_count, 1)) if limit is not None else 5)
-            for cand in trudvsem_candidates:
-                if limit_reached():
-                    break
-                c = Candidate(
-                    vacancy_id=vacancy.id,
-                    name_or_nick=cand["name"],
-                    contact=cand.get("contact", ""),
-                    city=cand["city"],
-                    experience_text=cand["experience"],
-                    skills_text=", ".join(cand["skills"]),
-                    source="trudvsem",
-                    source_link=cand["url"],
-                    raw_text=cand["about"],
-                    status=CandidateStatus.FOUND.value,
-                    dialog_step=0,
-                    first_seen_at=datetime.now(),
-                    is_new=True
-                )
-                
-                c.salary_expectations = extract_salary(c.raw_text)
-                c.experience_years = extract_experience_years(c.raw_text)
-                c.normalized_city = normalize_city(c.city)
-                
-                if c.experience_years:
-                    c.normalized_experience_level = normalize_experience_level(c.experience_years)
-                else:
-                    parsed_years = parse_experience_to_years(c.experience_text)
-                    if parsed_years:
-                        c.experience_years = parsed_years
-                        c.normalized_experience_level = normalize_experience_level(parsed_years)
-                
-                if c.skills_text:
-                    normalized_skills = normalize_skills_list(c.skills_text)
-                    c.extracted_skills = normalized_skills
-                    c.skills_text = ", ".join(normalized_skills[:8])
-                
-                city_from_text = extract_city_from_text(c.raw_text)
-                if city_from_text:
-                    c.normalized_city_from_text = city_from_text
-                
-                keywords = extract_keywords(f"{c.experience_text} {c.skills_text} {c.raw_text}")
-                if keywords:
-                    c.extracted_keywords = keywords[:20]
-                
-                passed, reason = apply_hard_filters(c, vacancy, company)
-                if not passed:
-                    c.status = CandidateStatus.REJECTED.value
-                    c.rejection_reason = reason
-                    logger.info(f"Кандидат {c.name_or_nick} отсеян: {reason}")
-                
-                session.add(c)
-                candidates.append(c)
-                added_count += 1
-        except Exception as e:
-            logger.error(f"❌ Ошибка Trudvsem: {e}")
+    added_count = len(candidates)
+    with get_session() as session:
+        bulk_insert_candidates(session, candidates)
+    logger.info(f"✅ ВСЕГО найдено кандидатов: {added_count}")
 
-        # 5) Telegram
-        if not limit_reached():
-            logger.info(f"🔍 Поиск кандидатов в Telegram: {vacancy.role} в {vacancy.city}")
-        try:
-            if limit_reached():
-                tg_candidates = []
-            else:
-                tg_candidates = await telegram_parser.search_candidates(vacancy.role, vacancy.city, limit=min(5, max(limit - added_count, 1)) if limit is not None else 5)
-            for cand in tg_candidates:
-                if limit_reached():
-                    break
-                c = Candidate(
-                    vacancy_id=vacancy.id,
-                    name_or_nick=cand["name"],
-                    contact=cand.get("contact", ""),
-                    city=cand["city"],
-                    experience_text=cand["experience"],
-                    skills_text=", ".join(cand["skills"]),
-                    source="telegram",
-                    source_link=cand["url"],
-                    raw_text=cand["about"],
-                    status=CandidateStatus.FOUND.value,
-                    dialog_step=0,
-                    first_seen_at=datetime.now(),
-                    is_new=True
-                )
-                
-                c.salary_expectations = extract_salary(c.raw_text)
-                c.experience_years = extract_experience_years(c.raw_text)
-                c.normalized_city = normalize_city(c.city)
-                
-                if c.experience_years:
-                    c.normalized_experience_level = normalize_experience_level(c.experience_years)
-                else:
-                    parsed_years = parse_experience_to_years(c.experience_text)
-                    if parsed_years:
-                        c.experience_years = parsed_years
-                        c.normalized_experience_level = normalize_experience_level(parsed_years)
-                
-                if c.skills_text:
-                    normalized_skills = normalize_skills_list(c.skills_text)
-                    c.extracted_skills = normalized_skills
-                    c.skills_text = ", ".join(normalized_skills[:8])
-                
-                city_from_text = extract_city_from_text(c.raw_text)
-                if city_from_text:
-                    c.normalized_city_from_text = city_from_text
-                
-                keywords = extract_keywords(f"{c.experience_text} {c.skills_text} {c.raw_text}")
-                if keywords:
-                    c.extracted_keywords = keywords[:20]
-                
-                passed, reason = apply_hard_filters(c, vacancy, company)
-                if not passed:
-                    c.status = CandidateStatus.REJECTED.value
-                    c.rejection_reason = reason
-                    logger.info(f"Кандидат {c.name_or_nick} отсеян: {reason}")
-                
-                session.add(c)
-                candidates.append(c)
-                added_count += 1
-        except Exception as e:
-            logger.error(f"❌ Ошибка Telegram: {e}")
+    filtered_candidates = [c for c in candidates if c.status != CandidateStatus.REJECTED.value]
+    logger.info(f"✅ Прошли фильтры: {len(filtered_candidates)}")
+    logger.info(f"❌ Отсеяно: {added_count - len(filtered_candidates)}")
 
-        session.commit()
-        logger.info(f"✅ ВСЕГО найдено кандидатов: {len(candidates)}")
-        
-        passed_count = len([c for c in candidates if c.status != CandidateStatus.REJECTED.value])
-        logger.info(f"✅ Прошли фильтры: {passed_count}")
-        logger.info(f"❌ Отсеяно: {len(candidates) - passed_count}")
+    # Скоринг идёт вне транзакции: запросы к DeepSeek не держат блокировку БД
+    if filtered_candidates:
+        vacancy_desc = vacancy_to_description(vacancy, company)
 
-        filtered_candidates = [c for c in candidates if c.status != CandidateStatus.REJECTED.value]
-        if filtered_candidates:
-            vacancy_desc = vacancy_to_description(vacancy, company)
+        # Этап 1: быстрый локальный скоринг всех кандидатов (+ TF-IDF релевантность без сети)
+        matcher = TfidfMatcher(
+            vacancy_match_text(vacancy),
+            [candidate_match_text(c) for c in filtered_candidates],
+        )
+        penalties: Dict[int, int] = {}
+        for c, relevance in zip(filtered_candidates, matcher.corpus_scores()):
+            c.keyword_match_percentage = round(relevance * 100, 1)
+            score, breakdown = calculate_candidate_score(
+                c, vacancy, company, relevance=relevance, base=SEARCH_BASE_SCORE
+            )
+            c.score = score
+            # Текст объяснения не храним — он собирается из breakdown при показе
+            c.score_breakdown = breakdown
+            c.explanation = ""
+            penalties[c.id] = get_red_flags_score(c.raw_text) if c.red_flags else 0
+
+        # Этап 2: DeepSeek уточняет только шорт-лист (top-K и пограничных у порогов 60/80)
+        shortlist = select_llm_shortlist(
+            [(c, c.score - penalties[c.id]) for c in filtered_candidates],
+            top_k=llm_top_k,
+        )
+        if shortlist:
             payload = [
                 {
                     "id": c.id,
@@ -2424,208 +2121,87 @@ async def gather_real_candidates(vacancy_id: int, limit: Optional[int] = None, p
                     "skills": c.skills_text,
                     "source": c.source,
                 }
-                for c in filtered_candidates
+                for c in shortlist
             ]
-
-            # Пытаемся использовать DeepSeek API
-            deepseek_success = False
             try:
                 scores = deepseek.score_candidates(vacancy_desc, payload)
                 scores_by_id = {int(s["id"]): s for s in scores if "id" in s}
-                
-                # Проверяем, что оценки не все одинаковые
+
+                # Проверяем, что оценки не все одинаковые (признак «заглушки» от API)
                 unique_scores = set(int(s.get("score", 0)) for s in scores if "score" in s)
-                if len(unique_scores) > 1:
-                    deepseek_success = True
-                    logger.info(f"✅ DeepSeek вернул оценки: {unique_scores}")
-                    
-                    for c in filtered_candidates:
+                if len(unique_scores) > 1 or (len(unique_scores) == 1 and next(iter(unique_scores)) not in [65, 70]):
+                    logger.info(f"✅ DeepSeek уточнил оценки шорт-листа: {unique_scores}")
+                    for c in shortlist:
                         result = scores_by_id.get(c.id)
                         if result:
                             c.score = int(result.get("score", 0))
                             c.explanation = str(result.get("explanation", ""))
-                        else:
-                            # Fallback для кандидатов без оценки
-                            c.score = 50
-                            c.explanation = "Оценка не получена от API"
                 else:
-                    logger.warning(f"⚠️ DeepSeek вернул одинаковые оценки: {unique_scores}")
+                    logger.warning(f"⚠️ DeepSeek вернул подозрительные оценки: {unique_scores}, оставляем локальные")
             except Exception as e:
-                logger.error(f"❌ Ошибка DeepSeek API: {e}")
-            
-            # Если DeepSeek не сработал или вернул плохие оценки - используем локальный алгоритм
-            if not deepseek_success:
-                logger.info("📊 Используем локальный алгоритм оценки")
-                for c in filtered_candidates:
-                    score = 50
-                    explanation_parts = []
-                    
-                    # 1. Город (до 20 баллов)
-                    if vacancy.city.lower() in c.city.lower():
-                        score += 20
-                        explanation_parts.append("🏙️ Город совпадает: +20")
-                    elif c.normalized_city and vacancy.city.lower() in c.normalized_city.lower():
-                        score += 15
-                        explanation_parts.append("🏙️ Город (нормализованный) совпадает: +15")
-                    else:
-                        score += 5
-                        explanation_parts.append("🏙️ Город не совпадает: +5")
-                    
-                    # 2. Опыт (до 25 баллов)
-                    if c.experience_years:
-                        exp_years = c.experience_years
-                        if exp_years >= 5:
-                            score += 25
-                            explanation_parts.append(f"💼 Опыт {exp_years} лет (эксперт): +25")
-                        elif exp_years >= 3:
-                            score += 20
-                            explanation_parts.append(f"💼 Опыт {exp_years} лет (хорошо): +20")
-                        elif exp_years >= 1:
-                            score += 12
-                            explanation_parts.append(f"💼 Опыт {exp_years} лет (начальный): +12")
-                        else:
-                            score += 5
-                            explanation_parts.append(f"💼 Опыт {exp_years} лет (мало): +5")
-                    else:
-                        score += 10
-                        explanation_parts.append("💼 Опыт не указан: +10")
-                    
-                    # 3. Навыки (до 25 баллов)
-                    must_have = vacancy.must_have if vacancy.must_have and vacancy.must_have != "-" else ""
-                    if must_have:
-                        must_have_list = [skill.strip().lower() for skill in must_have.split(",")]
-                        candidate_skills = (c.skills_text or "").lower()
-                        found = sum(1 for skill in must_have_list if skill in candidate_skills)
-                        if found > 0:
-                            skill_points = min(25, int((found / len(must_have_list)) * 25))
-                            score += skill_points
-                            explanation_parts.append(f"📋 Найдено {found}/{len(must_have_list)} навыков: +{skill_points}")
-                        else:
-                            score += 5
-                            explanation_parts.append("📋 Требуемые навыки не найдены: +5")
-                    else:
-                        score += 15
-                        explanation_parts.append("📋 Нет требований к навыкам: +15")
-                    
-                    # 4. Зарплата (до 15 баллов)
-                    if c.salary_expectations and (vacancy.salary_from or vacancy.salary_to):
-                        salary_expected = c.salary_expectations
-                        salary_min = vacancy.salary_from or 0
-                        salary_max = vacancy.salary_to or float('inf')
-                        if salary_min <= salary_expected <= salary_max:
-                            score += 15
-                            explanation_parts.append(f"💰 Зарплата {salary_expected} в вилке: +15")
-                        elif salary_expected < salary_min:
-                            score += 8
-                            explanation_parts.append(f"💰 Зарплата ниже вилки: +8")
+                logger.error(f"❌ Ошибка DeepSeek API: {e}, оставляем локальные оценки")
+
+        # Применяем штрафы за красные флаги (для всех кандидатов)
+        for c in filtered_candidates:
+            if c.red_flags:
+                try:
+                    penalty = penalties[c.id]
+                    if penalty > 0:
+                        old_score = c.score
+                        c.score = max(0, c.score - penalty)
+                        if c.explanation:
+                            # Оценка уточнена LLM — дописываем к её тексту
+                            c.explanation += f" | 🚩 Штраф за красные флаги: -{penalty}"
                         else:
-                            score += 5
-                            explanation_parts.append(f"💰 Зарплата выше вилки: +5")
-                    else:
-                        score += 7
-                        explanation_parts.append("💰 Зарплата не указана: +7")
-                    
-                    # 5. Качество резюме (до 15 баллов)
-                    text_length = len(c.raw_text or "")
-                    if text_length > 500:
-                        score += 15
-                        explanation_parts.append("📝 Подробное резюме: +15")
-                    elif text_length > 200:
-                        score += 10
-                        explanation_parts.append("📝 Хорошее резюме: +10")
-                    elif text_length > 50:
-                        score += 5
-                        explanation_parts.append("📝 Короткое резюме: +5")
-                    else:
-                        score += 2
-                        explanation_parts.append("📝 Очень краткое резюме: +2")
-                    
-                    c.score = min(100, score)
-                    c.explanation = " | ".join(explanation_parts)
-            
-            # Применяем штрафы за красные флаги (для всех кандидатов)
-            for c in filtered_candidates:
-                if c.red_flags:
-                    try:
-                        penalty = get_red_flags_score(c.raw_text)
-                        if penalty > 0:
-                            old_score = c.score
-                            c.score = max(0, c.score - penalty)
-                            if c.explanation:
-                                c.explanation += f" | 🚩 Штраф за красные флаги: -{penalty}"
-                            else:
-                                c.explanation = f"Штраф за красные флаги: -{penalty}"
-                            logger.info(f"Кандидат {c.name_or_nick}: скор снижен с {old_score} до {c.score} (штраф {penalty})")
-                    except:
-                        pass
-                
-                logger.info(f"📊 Кандидат {c.name_or_nick}: оценка {c.score}/100")
-                
-                if c.score >= 80:
-                    c.status = CandidateStatus.FILTERED.value
-                elif c.score >= 60:
-                    c.status = CandidateStatus.FOUND.value
-                else:
-                    c.status = CandidateStatus.REJECTED.value
-                    if not c.rejection_reason:
-                        c.rejection_reason = f"Низкая оценка: {c.score}/100"
-            
-            session.commit()
+                            c.score_breakdown = [*(c.score_breakdown or []), ["red_flags", -penalty]]
+                        logger.info(f"Кандидат {c.name_or_nick}: скор снижен с {old_score} до {c.score} (штраф {penalty})")
+                except:
+                    pass
+
+            logger.info(f"📊 Кандидат {c.name_or_nick}: оценка {c.score}/100")
+
+            if c.score >= 80:
+                set_candidate_status(c, CandidateStatus.FILTERED)
+            elif c.score >= 60:
+                set_candidate_status(c, CandidateStatus.FOUND)
+            else:
+                set_candidate_status(c, CandidateStatus.REJECTED)
+                if not c.rejection_reason:
+                    c.rejection_reason = f"Низкая оценка: {c.score}/100"
+
+            mark_scored(c, vacancy, company)
+
+    # Оценки и списание по платежу — одной короткой транзакцией
+    with get_session() as session:
+        if filtered_candidates:
+            bulk_update_candidates(session, filtered_candidates, SCORING_FIELDS)
             logger.info("✅ Скоринг завершён")
-        
+
         if payment_id and Payment is not None:
             try:
-                payment = session.query(Payment).filter(Payment.id == payment_id).first()
-                if payment is not None:
-                    payment.candidates_used = added_count
-                    session.commit()
+                with session.begin_nested():
+                    session.execute(
+                        update(Payment).where(Payment.id == payment_id).values(candidates_used=added_count)
+                    )
             except Exception as e:
                 logger.error(f"❌ Не удалось обновить платеж {payment_id}: {e}")
 
-        # === АВТОМАТИЧЕСКИЕ ПРИГЛАШЕНИЯ ДЛЯ ТОП-КАНДИДАТОВ ===
-        # Отправляем только в платном сценарии (когда есть payment_id).
-        if filtered_candidates and payment_id is not None:
-            await auto_invite_top_candidates(vacancy_id, company, vacancy)
+    # === АВТОМАТИЧЕСКИЕ ПРИГЛАШЕНИЯ ДЛЯ ТОП-КАНДИДАТОВ ===
+    # Отправляем только в платном сценарии (когда есть payment_id).
+    if filtered_candidates and payment_id is not None:
+        await auto_invite_top_candidates(vacancy_id, company, vacancy)
 
-        return added_count
+    return added_count
 
 
 async def gather_real_candidates_with_limit(vacancy_id: int, limit: int, payment_id: Optional[int] = None) -> int:
     return await gather_real_candidates(vacancy_id, limit=limit, payment_id=payment_id)
 
 
-def group_candidates_for_report(vacancy_id: int):
+def _count_payable_candidates(vacancy_id: int) -> int:
+    """Сколько кандидатов доступно для платного показа (без отсеянных)."""
     with get_session() as session:
-        all_cands = (
-            session.query(Candidate)
-            .filter(Candidate.vacancy_id == vacancy_id)
-            .order_by(Candidate.score.desc())
-            .all()
-        )
-    top = [c for c in all_cands if c.score >= 80]
-    mid = [c for c in all_cands if 60 <= c.score < 80]
-    rest = [c for c in all_cands if c.score < 60]
-    rejected = [c for c in all_cands if c.status == CandidateStatus.REJECTED.value]
-    clarify = [c for c in all_cands if c.status == CandidateStatus.CLARIFY.value]
-    qualified = [c for c in all_cands if c.status == CandidateStatus.QUALIFIED.value]
-    return all_cands, top, mid, rest, rejected, clarify, qualified
-
-
-def candidates_page(candidates: List[Candidate], page: int, per_page: int = 5):
-    start = page * per_page
-    end = start + per_page
-    return candidates[start:end], len(candidates) > end
-
-
-def _get_payable_candidates(vacancy_id: int) -> List[Candidate]:
-    """Кандидаты, доступные для платного показа (без отсеянных)."""
-    with get_session() as session:
-        return (
-            session.query(Candidate)
-            .filter(Candidate.vacancy_id == vacancy_id, Candidate.status != CandidateStatus.REJECTED.value)
-            .order_by(Candidate.score.desc(), Candidate.created_at.desc())
-            .all()
-        )
+        return count_payable_candidates(session, vacancy_id)
 
 
 async def _send_candidates_page_for_vacancy(
@@ -2652,31 +2228,39 @@ async def _send_candidates_page_for_vacancy(
             await target.answer("❌ Вакансия не найдена")
         return
 
-    all_cands, top, mid, rest, rejected, clarify, qualified = group_candidates_for_report(vacancy.id)
-    payable_candidates = [c for c in all_cands if c.status != CandidateStatus.REJECTED.value]
-    if max_candidates is not None:
-        payable_candidates = payable_candidates[:max_candidates]
+    if vacancy.archived_at is not None:
+        text = f"🗄️ Кандидаты вакансии «{vacancy.role}» в архиве. Вернуть: /archive"
+        if isinstance(target, CallbackQuery):
+            await target.answer(text, show_alert=True)
+        else:
+            await target.answer(text)
+        return
 
-    if not payable_candidates:
+    # Счётчики — одной строкой воронки, полные строки (с текстом резюме) — только для страницы
+    with get_session() as session:
+        page_cands, page, available, counts = get_candidates_page(
+            session, vacancy.id, page, per_page=per_page, max_candidates=max_candidates
+        )
+
+    if not page_cands:
         if isinstance(target, CallbackQuery):
             await target.answer("Нет кандидатов", show_alert=True)
         else:
             await target.answer("❌ Кандидаты не найдены")
         return
 
-    total_pages = (len(payable_candidates) + per_page - 1) // per_page
-    page = max(0, min(page, total_pages - 1))
-    page_cands, has_next = candidates_page(payable_candidates, page=page, per_page=per_page)
+    total_pages = (available + per_page - 1) // per_page
+    has_next = page + 1 < total_pages
 
     summary = (
         f"📊 <b>Вакансия: {vacancy.role} ({vacancy.city})</b>\n\n"
-        f"Найдено кандидатов: {len(all_cands)}\n"
-        f"Доступно к показу: {len(payable_candidates)}\n"
-        f"🔥 Отлично (80+): {len(top)}\n"
-        f"🟢 Хорошо (60-79): {len(mid)}\n"
-        f"❌ Отсеяно фильтрами: {len(rejected)}\n"
-        f"⚠️ Требуют уточнения: {len(clarify)}\n"
-        f"✅ Прошли предквалификацию: {len(qualified)}\n\n"
+        f"Найдено кандидатов: {counts['total']}\n"
+        f"Доступно к показу: {available}\n"
+        f"🔥 Отлично (80+): {counts['top']}\n"
+        f"🟢 Хорошо (60-79): {counts['mid']}\n"
+        f"❌ Отсеяно фильтрами: {counts['rejected']}\n"
+        f"⚠️ Требуют уточнения: {counts['clarify']}\n"
+        f"✅ Прошли предквалификацию: {counts['qualified']}\n\n"
         f"📄 Страница {page + 1} из {total_pages}"
     )
 
@@ -2714,13 +2298,7 @@ async def _send_candidates_page(
 ) -> None:
     """Отправить одну страницу кандидатов"""
     with get_session() as session:
-        vacancy = (
-            session.query(Vacancy)
-            .join(Company, Vacancy.company_id == Company.id)
-            .filter(Company.owner_id == user_id)
-            .order_by(Vacancy.created_at.desc())
-            .first()
-        )
+        _, vacancy = get_owner_company_and_vacancy(session, user_id)
     if not vacancy:
         if isinstance(target, CallbackQuery):
             await target.answer("Нет вакансий", show_alert=True)
@@ -2733,7 +2311,7 @@ async def _send_candidates_page(
 @router.message(Command("candidates"))
 async def cmd_candidates(message: Message):
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company = get_owner_company(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
@@ -2756,7 +2334,7 @@ async def cb_candidates_page(callback: CallbackQuery):
 async def cmd_filters(message: Message):
     """Управление фильтрами"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company = get_owner_company(session, message.from_user.id)
         
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
@@ -2808,7 +2386,7 @@ async def cb_filters(callback: CallbackQuery):
     action = callback.data.split(":")[1]
     
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == callback.from_user.id).first()
+        company = get_owner_company(session, callback.from_user.id)
         
         if not company:
             await callback.answer("❌ Компания не найдена. Пройдите онбординг: /onboarding", show_alert=True)
@@ -2848,7 +2426,7 @@ async def cb_filters(callback: CallbackQuery):
             await callback.answer(f"📋 Фильтр по требованиям: {'включён' if filters_settings['skills'] else 'выключен'}")
         
         elif action == "stats":
-            vacancy = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).first()
+            _, vacancy = get_owner_company_and_vacancy(session, callback.from_user.id)
             if vacancy:
                 total = session.query(Candidate).filter(Candidate.vacancy_id == vacancy.id).count()
                 rejected = session.query(Candidate).filter(
@@ -2886,7 +2464,7 @@ async def cb_filters(callback: CallbackQuery):
             return
         
         elif action == "archive":
-            vacancy = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).first()
+            _, vacancy = get_owner_company_and_vacancy(session, callback.from_user.id)
             if vacancy:
                 rejected = session.query(Candidate).filter(
                     Candidate.vacancy_id == vacancy.id,
@@ -2910,6 +2488,8 @@ async def cb_filters(callback: CallbackQuery):
             return
         
         company.filters_settings = filters_settings
+        # Настройки скоринга изменились — /recalculate пересчитает всех кандидатов
+        company.scoring_version = (company.scoring_version or 1) + 1
         session.commit()
         
         await callback.message.delete()
@@ -2927,36 +2507,26 @@ async def cb_filters_menu(callback: CallbackQuery):
 async def cmd_red_flags(message: Message):
     """Статистика красных флагов"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-        
-        if not vacancies:
+        if vacancy is None:
             await message.answer("📭 Нет вакансий")
             return
         
-        vacancy = vacancies[0]
-        
         total = session.query(Candidate).filter(Candidate.vacancy_id == vacancy.id).count()
         with_flags = session.query(Candidate).filter(
             Candidate.vacancy_id == vacancy.id,
             Candidate.red_flags.isnot(None)
         ).count()
         
+        # Флаги считаются в БД; здесь только сворачиваем их в категории
         flag_stats = {}
-        candidates_with_flags = session.query(Candidate).filter(
-            Candidate.vacancy_id == vacancy.id,
-            Candidate.red_flags.isnot(None)
-        ).all()
-        
-        for c in candidates_with_flags:
-            if c.red_flags:
-                for flag in c.red_flags:
-                    category = flag.split(":")[0]
-                    flag_stats[category] = flag_stats.get(category, 0) + 1
+        for flag, count in red_flag_counts(session, vacancy.id).items():
+            category = flag.split(":")[0]
+            flag_stats[category] = flag_stats.get(category, 0) + count
         
         text = f"📊 <b>Статистика красных флагов</b>\n\n"
         text += f"Вакансия: {vacancy.role}\n"
@@ -2987,35 +2557,20 @@ async def cb_red_flags(callback: CallbackQuery):
 async def cmd_stats_normalized(message: Message):
     """Статистика нормализованных данных"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-        
-        if not vacancies:
+        if vacancy is None:
             await message.answer("📭 Нет вакансий")
             return
         
-        vacancy = vacancies[0]
-        
-        total = session.query(Candidate).filter(Candidate.vacancy_id == vacancy.id).count()
-        
-        with_exp_years = session.query(Candidate).filter(
-            Candidate.vacancy_id == vacancy.id,
-            Candidate.experience_years.isnot(None)
-        ).count()
-        
-        with_norm_skills = session.query(Candidate).filter(
-            Candidate.vacancy_id == vacancy.id,
-            Candidate.extracted_skills.isnot(None)
-        ).count()
-        
-        with_keywords = session.query(Candidate).filter(
-            Candidate.vacancy_id == vacancy.id,
-            Candidate.extracted_keywords.isnot(None)
-        ).count()
+        stats = AnalyticsService.get_normalization_stats(vacancy.id)
+        total = stats['total']
+        with_exp_years = stats['with_exp_years']
+        with_norm_skills = stats['with_norm_skills']
+        with_keywords = stats['with_keywords']
         
         text = f"📊 <b>Статистика нормализации</b>\n\n"
         text += f"Вакансия: {vacancy.role}\n"
@@ -3041,18 +2596,15 @@ async def cb_normalization(callback: CallbackQuery):
 async def cmd_rejected(message: Message):
     """Просмотр отсеянных кандидатов"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-        
-        if not vacancies:
+        if vacancy is None:
             await message.answer("📭 Нет вакансий")
             return
         
-        vacancy = vacancies[0]
         rejected = session.query(Candidate).filter(
             Candidate.vacancy_id == vacancy.id,
             Candidate.status == CandidateStatus.REJECTED.value
@@ -3081,17 +2633,15 @@ async def cmd_rejected(message: Message):
 async def cmd_sort(message: Message):
     """Сортировка кандидатов"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-        if not vacancies:
+        if vacancy is None:
             await message.answer("📭 Нет вакансий. Создайте: /new_job")
             return
         
-        vacancy = vacancies[0]
         candidates = session.query(Candidate).filter(Candidate.vacancy_id == vacancy.id).all()
     
     if not candidates:
@@ -3123,17 +2673,15 @@ async def cb_sort_candidates(callback: CallbackQuery):
     sort_by = callback.data.split(":")[1]
     
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == callback.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, callback.from_user.id)
         if not company:
             await callback.answer("❌ Компания не найдена", show_alert=True)
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-        if not vacancies:
+        if vacancy is None:
             await callback.answer("📭 Нет вакансий", show_alert=True)
             return
         
-        vacancy = vacancies[0]
         candidates = session.query(Candidate).filter(Candidate.vacancy_id == vacancy.id).all()
     
     from export_utils import sort_candidates, filter_by_date
@@ -3186,17 +2734,15 @@ async def cb_sort_menu(callback: CallbackQuery):
 async def cmd_report_stats(message: Message):
     """Статистика по кандидатам с датами"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-        if not vacancies:
+        if vacancy is None:
             await message.answer("📭 Нет вакансий. Создайте: /new_job")
             return
         
-        vacancy = vacancies[0]
         candidates = session.query(Candidate).filter(Candidate.vacancy_id == vacancy.id).all()
     
     now = datetime.now()
@@ -3232,31 +2778,31 @@ async def cmd_report_stats(message: Message):
 async def cmd_export(message: Message):
     """Экспорт отчёта по кандидатам"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-        if not vacancies:
+        if vacancy is None:
             await message.answer("📭 Нет вакансий. Создайте: /new_job")
             return
         
-        vacancy = vacancies[0]
-        candidates = session.query(Candidate).filter(Candidate.vacancy_id == vacancy.id).all()
-    
-    from export_utils import generate_csv_report, generate_html_report
+        total = get_pipeline_counts(session, vacancy.id)["total"]
     
     kb = InlineKeyboardBuilder()
     kb.button(text="📊 CSV", callback_data="export:csv")
+    kb.button(text="📗 Excel", callback_data="export:xlsx")
     kb.button(text="📊 HTML", callback_data="export:html")
-    kb.adjust(2)
+    kb.button(text="🗂️ Все вакансии: CSV (ZIP)", callback_data="export_all:csv")
+    kb.button(text="🗂️ Все вакансии: Excel (ZIP)", callback_data="export_all:xlsx")
+    kb.adjust(3, 1, 1)
     
     await message.answer(
         f"📊 <b>Экспорт отчёта по вакансии {vacancy.role}</b>\n\n"
-        f"Всего кандидатов: {len(candidates)}\n\n"
+        f"Всего кандидатов: {total}\n\n"
         f"Для отправки на email используйте команду:\n"
         f"<code>/send_report</code> — отправить отчёт на ваш email\n\n"
+        f"Все вакансии компании одним архивом: <code>/export_all [csv|xlsx]</code>\n\n"
         f"Или выберите формат для скачивания:",
         parse_mode="HTML",
         reply_markup=kb.as_markup()
@@ -3265,54 +2811,113 @@ async def cmd_export(message: Message):
 
 @router.callback_query(F.data.startswith("export:"))
 async def cb_export(callback: CallbackQuery):
-    """Обработка экспорта (только CSV и HTML)"""
+    """Обработка экспорта (CSV, Excel и HTML)"""
     export_format = callback.data.split(":")[1]
     
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == callback.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, callback.from_user.id)
         if not company:
             await callback.answer("❌ Компания не найдена", show_alert=True)
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-        if not vacancies:
+        if vacancy is None:
             await callback.answer("📭 Нет вакансий", show_alert=True)
             return
-        
-        vacancy = vacancies[0]
-        candidates = session.query(Candidate).filter(Candidate.vacancy_id == vacancy.id).all()
     
-    from export_utils import generate_csv_report, generate_html_report
-    import tempfile
-    import os
+    from export_utils import CandidatesCSVFile, CandidatesHTMLFile, CandidatesXLSXFile
     
     if export_format == 'csv':
-        csv_data = generate_csv_report(candidates, vacancy)
-        
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False, encoding='utf-8') as f:
-            f.write(csv_data)
-            temp_file = f.name
-        
-        document = FSInputFile(temp_file, filename=f"candidates_{vacancy.role}_{datetime.now().strftime('%Y%m%d')}.csv")
+        # CSV формируется пачками прямо во время отправки — без временного файла
+        document = CandidatesCSVFile(
+            vacancy.id, filename=f"candidates_{vacancy.role}_{datetime.now().strftime('%Y%m%d')}.csv"
+        )
         await callback.message.answer_document(document, caption=f"📊 Отчёт по вакансии {vacancy.role}")
         
-        os.unlink(temp_file)
+    elif export_format == 'xlsx':
+        document = CandidatesXLSXFile(
+            vacancy.id, filename=f"candidates_{vacancy.role}_{datetime.now().strftime('%Y%m%d')}.xlsx"
+        )
+        await callback.message.answer_document(document, caption=f"📗 Отчёт по вакансии {vacancy.role}")
         
     elif export_format == 'html':
-        html_data = generate_html_report(candidates, vacancy, company)
-        
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as f:
-            f.write(html_data)
-            temp_file = f.name
-        
-        document = FSInputFile(temp_file, filename=f"report_{vacancy.role}_{datetime.now().strftime('%Y%m%d')}.html")
+        # Все кандидаты, разделами — без ограничения в 50 строк
+        document = CandidatesHTMLFile(
+            vacancy, company, filename=f"report_{vacancy.role}_{datetime.now().strftime('%Y%m%d')}.html"
+        )
         await callback.message.answer_document(document, caption=f"📊 Отчёт по вакансии {vacancy.role}")
-        
-        os.unlink(temp_file)
     
     await callback.answer()
 
 
+# Архивы выгрузки компаний, которые готовятся сейчас: id компании → фоновая задача
+_company_exports: Dict[int, asyncio.Task] = {}
+
+
+async def _send_company_export(message: Message, company_id: int, archive) -> None:
+    """Фоновая задача: архив формируется по ходу отправки и уходит одним документом"""
+    try:
+        await message.answer_document(archive, caption=f"🗂️ Выгрузка всех вакансий компании ({len(archive.vacancies)})")
+        logger.info(f"🗂️ Архив выгрузки компании {company_id} отправлен: кандидатов {archive.rows_written}")
+    except Exception as e:
+        logger.error(f"❌ Ошибка выгрузки архива компании {company_id}: {e}")
+        await message.answer(
+            "❌ Не удалось отправить архив. Telegram принимает файлы до 50 МБ — "
+            "если вакансий много, выгрузите их по отдельности: /export"
+        )
+    finally:
+        _company_exports.pop(company_id, None)
+
+
+async def start_company_export(message: Message, owner_id: int, export_format: str) -> None:
+    """Запускает выгрузку всех активных вакансий компании в фоне и сразу отвечает"""
+    from export_utils import EXPORT_ARCHIVE_FORMATS, CompanyExportArchive
+    
+    if export_format not in EXPORT_ARCHIVE_FORMATS:
+        await message.answer("❌ Формат: csv или xlsx. Например: /export_all xlsx")
+        return
+    
+    with get_session() as session:
+        company = get_owner_company(session, owner_id)
+        vacancies = []
+        if company:
+            vacancies = session.scalars(
+                select(Vacancy)
+                .where(Vacancy.company_id == company.id, Vacancy.archived_at.is_(None))
+                .order_by(Vacancy.created_at)
+            ).all()
+    if not company:
+        await message.answer("❌ Сначала пройдите онбординг: /onboarding")
+        return
+    if not vacancies:
+        await message.answer("📭 Нет вакансий. Создайте: /new_job")
+        return
+    if company.id in _company_exports:
+        await message.answer("⏳ Архив компании уже готовится — пришлю, как только он будет готов")
+        return
+    
+    archive = CompanyExportArchive(
+        list(vacancies),
+        filename=f"company_{company.id}_{datetime.now().strftime('%Y%m%d')}_{export_format}.zip",
+        export_format=export_format,
+    )
+    _company_exports[company.id] = asyncio.create_task(_send_company_export(message, company.id, archive))
+    await message.answer(f"⏳ Готовлю архив по {len(vacancies)} вакансиям — пришлю отдельным сообщением")
+
+
+@router.message(Command("export_all"))
+async def cmd_export_all(message: Message):
+    """Все активные вакансии компании одним ZIP-архивом (CSV или XLSX на вакансию)"""
+    parts = message.text.split()
+    export_format = parts[1].lower() if len(parts) > 1 else 'csv'
+    await start_company_export(message, message.from_user.id, export_format)
+
+
+@router.callback_query(F.data.startswith("export_all:"))
+async def cb_export_all(callback: CallbackQuery):
+    await callback.answer()
+    await start_company_export(callback.message, callback.from_user.id, callback.data.split(":")[1])
+
+
 @router.callback_query(lambda c: c.data == "export_menu")
 async def cb_export_menu(callback: CallbackQuery):
     await callback.answer()
@@ -3325,18 +2930,15 @@ async def cb_export_menu(callback: CallbackQuery):
 async def cmd_analytics(message: Message):
     """Подробная аналитика по вакансии"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-        if not vacancies:
+        if vacancy is None:
             await message.answer("📭 Нет вакансий. Создайте: /new_job")
             return
         
-        vacancy = vacancies[0]
-    
     from analytics import format_analytics_report
     report = format_analytics_report(vacancy.id)
     
@@ -3347,18 +2949,15 @@ async def cmd_analytics(message: Message):
 async def cmd_sources(message: Message):
     """Статистика по источникам кандидатов"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-        if not vacancies:
+        if vacancy is None:
             await message.answer("📭 Нет вакансий. Создайте: /new_job")
             return
         
-        vacancy = vacancies[0]
-    
     from analytics import AnalyticsService
     sources = AnalyticsService.get_source_stats(vacancy.id)
     total = sum(sources.values())
@@ -3386,20 +2985,18 @@ async def cmd_sources(message: Message):
 async def cmd_conversion(message: Message):
     """Конверсия по этапам воронки"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-        if not vacancies:
+        if vacancy is None:
             await message.answer("📭 Нет вакансий. Создайте: /new_job")
             return
         
-        vacancy = vacancies[0]
-    
     from analytics import AnalyticsService
-    stats = AnalyticsService.get_pipeline_stats(vacancy.id)
+    # Сколько кандидатов дошли до каждого этапа (по журналу смен статуса)
+    stats = AnalyticsService.get_funnel_stats(vacancy.id)['reached']
     conversion = AnalyticsService.get_conversion_rates(vacancy.id)
     
     total = stats.get(CandidateStatus.FOUND.value, 0)
@@ -3438,6 +3035,65 @@ async def cmd_conversion(message: Message):
     await message.answer(text, parse_mode="HTML")
 
 
+@router.message(Command("company_stats"))
+async def cmd_company_stats(message: Message):
+    """Аналитика по всем вакансиям компании за период: /company_stats [дней]"""
+    with get_session() as session:
+        company = get_owner_company(session, message.from_user.id)
+    if not company:
+        await message.answer("❌ Сначала пройдите онбординг: /onboarding")
+        return
+    
+    parts = (message.text or "").split()
+    days = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 90
+    
+    from analytics import format_company_report
+    report = await asyncio.to_thread(format_company_report, company.id, days)
+    await message.answer(report, parse_mode="HTML")
+
+
+@router.message(Command("archive"))
+async def cmd_archive(message: Message):
+    """Архивные вакансии компании с возможностью восстановления"""
+    with get_session() as session:
+        company = get_owner_company(session, message.from_user.id)
+    if not company:
+        await message.answer("❌ Сначала пройдите онбординг: /onboarding")
+        return
+
+    archived = await asyncio.to_thread(archived_vacancies_of, company.id)
+    if not archived:
+        await message.answer(
+            f"🗄️ Архив пуст.\n\n"
+            f"Кандидаты закрытых вакансий переносятся сюда через {settings.archive_after_days} дн. без активности."
+        )
+        return
+
+    text = "🗄️ <b>Архив вакансий</b>\n\n"
+    kb = InlineKeyboardBuilder()
+    for item in archived[:10]:
+        text += f"• {item['role']} ({item['city']}): {item['candidates_count']} канд., {item['archived_at']:%d.%m.%Y}\n"
+        kb.button(text=f"♻️ Вернуть: {item['role'][:30]}", callback_data=f"restore_vacancy:{item['vacancy_id']}")
+    kb.adjust(1)
+    await message.answer(text, parse_mode="HTML", reply_markup=kb.as_markup())
+
+
+@router.callback_query(F.data.startswith("restore_vacancy:"))
+async def cb_restore_vacancy(callback: CallbackQuery):
+    """Возврат кандидатов вакансии из архива в основную БД"""
+    vacancy_id = int(callback.data.split(":")[1])
+    with get_session() as session:
+        company = get_owner_company(session, callback.from_user.id)
+        vacancy = session.get(Vacancy, vacancy_id)
+    if not company or not vacancy or vacancy.company_id != company.id:
+        await callback.answer("❌ Вакансия не найдена", show_alert=True)
+        return
+
+    await callback.answer("♻️ Восстанавливаю...")
+    restored = await asyncio.to_thread(restore_vacancy, vacancy_id)
+    await callback.message.answer(f"✅ Вакансия «{vacancy.role}»: восстановлено кандидатов: {restored}")
+
+
 @router.callback_query(lambda c: c.data == "analytics_menu")
 async def cb_analytics_menu(callback: CallbackQuery):
     await callback.answer()
@@ -3450,7 +3106,7 @@ async def cb_analytics_menu(callback: CallbackQuery):
 async def cmd_set_email(message: Message, state: FSMContext):
     """Установка email для отчётов"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company = get_owner_company(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
@@ -3473,7 +3129,7 @@ async def process_set_email(message: Message, state: FSMContext):
         return
     
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company = get_owner_company(session, message.from_user.id)
         if company:
             company.report_email = email
             session.commit()
@@ -3489,7 +3145,7 @@ async def process_set_email(message: Message, state: FSMContext):
 async def cmd_send_report(message: Message):
     """Отправить отчёт на email"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
@@ -3498,12 +3154,10 @@ async def cmd_send_report(message: Message):
             await message.answer("❌ Сначала установите email через /set_email")
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-        if not vacancies:
+        if vacancy is None:
             await message.answer("📭 Нет вакансий. Создайте: /new_job")
             return
         
-        vacancy = vacancies[0]
         candidates = session.query(Candidate).filter(Candidate.vacancy_id == vacancy.id).all()
     
     from email_service import email_service
@@ -3522,7 +3176,7 @@ async def cmd_send_report(message: Message):
 async def cmd_test_email(message: Message):
     """Тест отправки email"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company = get_owner_company(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
@@ -3578,7 +3232,7 @@ async def cb_email_menu(callback: CallbackQuery):
 async def cmd_calendar_setup(message: Message):
     """Настройка Яндекс.Календаря"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company = get_owner_company(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
@@ -3602,7 +3256,7 @@ async def cmd_calendar_setup(message: Message):
         events = client.get_events(days=1)
         
         with get_session() as session:
-            company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+            company = get_owner_company(session, message.from_user.id)
             if company:
                 company.calendar_connected = True
                 company.calendar_email = settings.yandex_login
@@ -3627,7 +3281,7 @@ async def cmd_calendar_setup(message: Message):
 async def cmd_calendar_test(message: Message):
     """Тест Яндекс.Календаря - показывает свободные слоты на завтра"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company = get_owner_company(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
@@ -3667,7 +3321,7 @@ async def cmd_calendar_test(message: Message):
 async def cmd_calendar_events(message: Message):
     """Показывает ближайшие события в календаре"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company = get_owner_company(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
@@ -3721,71 +3375,73 @@ async def cb_calendar_menu(callback: CallbackQuery):
 async def cb_invite(callback: CallbackQuery):
     candidate_id = int(callback.data.split(":", 1)[1])
     
-    with get_session() as session:
-        candidate = session.query(Candidate).filter(Candidate.id == candidate_id).one_or_none()
-        if not candidate:
-            await callback.answer("❌ Кандидат не найден", show_alert=True)
-            return
-        
-        if candidate.status == CandidateStatus.REJECTED.value:
-            await callback.answer("❌ Кандидат отсеян фильтрами", show_alert=True)
-            return
-        
-        vacancy = session.query(Vacancy).filter(Vacancy.id == candidate.vacancy_id).one()
-        company = session.query(Company).filter(Company.id == vacancy.company_id).one()
-        
-        message_text = generate_invite_message(candidate, vacancy, company)
-        
-        sent = await send_message_to_candidate(candidate, message_text)
-        
-        if sent:
-            candidate.status = CandidateStatus.INVITED.value
+    async with get_async_session() as session:
+        candidate = await session.get(Candidate, candidate_id)
+        if candidate:
+            vacancy = await session.get(Vacancy, candidate.vacancy_id)
+            company = await session.get(Company, vacancy.company_id)
+    
+    if not candidate:
+        await callback.answer("❌ Кандидат не найден", show_alert=True)
+        return
+    
+    if candidate.status == CandidateStatus.REJECTED.value:
+        await callback.answer("❌ Кандидат отсеян фильтрами", show_alert=True)
+        return
+    
+    message_text = generate_invite_message(candidate, vacancy, company)
+    
+    sent = await send_message_to_candidate(candidate, message_text)
+    
+    if sent:
+        async with get_async_session() as session:
+            session.add(candidate)
+            set_candidate_status(candidate, CandidateStatus.INVITED)
             candidate.dialog_step = 1
             candidate.last_activity_at = datetime.now()
-            session.commit()
-            
-            await callback.answer("✅ Приглашение отправлено!")
-            
-            await callback.message.answer(
-                f"📤 <b>Приглашение отправлено кандидату {candidate.name_or_nick}</b>\n\n"
-                f"Текст сообщения:\n{message_text}",
-                parse_mode="HTML"
-            )
-        else:
-            contact_info = f"\n📞 Контакт: {candidate.contact}" if candidate.contact else ""
-            await callback.answer("⚠️ Не удалось отправить автоматически")
-            await callback.message.answer(
-                f"📝 <b>Пример сообщения для {candidate.name_or_nick}:</b>\n\n"
-                f"{message_text}\n{contact_info}",
-                parse_mode="HTML"
-            )
+        
+        await callback.answer("✅ Приглашение отправлено!")
+        
+        await callback.message.answer(
+            f"📤 <b>Приглашение отправлено кандидату {candidate.name_or_nick}</b>\n\n"
+            f"Текст сообщения:\n{message_text}",
+            parse_mode="HTML"
+        )
+    else:
+        contact_info = f"\n📞 Контакт: {candidate.contact}" if candidate.contact else ""
+        await callback.answer("⚠️ Не удалось отправить автоматически")
+        await callback.message.answer(
+            f"📝 <b>Пример сообщения для {candidate.name_or_nick}:</b>\n\n"
+            f"{message_text}\n{contact_info}",
+            parse_mode="HTML"
+        )
 
 
 @router.callback_query(F.data.startswith("skip:"))
 async def cb_skip(callback: CallbackQuery):
     candidate_id = int(callback.data.split(":", 1)[1])
-    with get_session() as session:
-        candidate = session.query(Candidate).filter(Candidate.id == candidate_id).one_or_none()
-        if not candidate:
-            await callback.answer("❌ Кандидат не найден", show_alert=True)
-            return
-        candidate.status = CandidateStatus.ARCHIVE.value
-        candidate.last_activity_at = datetime.now()
-        session.commit()
+    async with get_async_session() as session:
+        candidate = await session.get(Candidate, candidate_id)
+        if candidate:
+            set_candidate_status(candidate, CandidateStatus.ARCHIVE)
+            candidate.last_activity_at = datetime.now()
+    if not candidate:
+        await callback.answer("❌ Кандидат не найден", show_alert=True)
+        return
     await callback.answer("📦 В архиве")
 
 
 @router.callback_query(F.data.startswith("fav:"))
 async def cb_fav(callback: CallbackQuery):
     candidate_id = int(callback.data.split(":", 1)[1])
-    with get_session() as session:
-        candidate = session.query(Candidate).filter(Candidate.id == candidate_id).one_or_none()
-        if not candidate:
-            await callback.answer("❌ Кандидат не найден", show_alert=True)
-            return
-        candidate.status = CandidateStatus.FAVORITE.value
-        candidate.last_activity_at = datetime.now()
-        session.commit()
+    async with get_async_session() as session:
+        candidate = await session.get(Candidate, candidate_id)
+        if candidate:
+            set_candidate_status(candidate, CandidateStatus.FAVORITE)
+            candidate.last_activity_at = datetime.now()
+    if not candidate:
+        await callback.answer("❌ Кандидат не найден", show_alert=True)
+        return
     await callback.answer("⭐ В избранном")
 
 
@@ -3870,10 +3526,15 @@ async def handle_candidate_reply(message: Message):
     if not username:
         return
     
-    with get_session() as session:
-        candidate = session.query(Candidate).filter(
-            Candidate.contact == f"@{username}"
-        ).first()
+    # Короткая сессия только на чтение: дальше кандидат обрабатывается без открытой
+    # транзакции (между await-ами отправки сообщений), а изменения сохраняются в конце
+    async with get_async_session() as session:
+        candidate = (await session.scalars(
+            select(Candidate)
+            .where(Candidate.contact == f"@{username}")
+            .options(undefer_group(PAYLOAD_GROUP))
+            .limit(1)
+        )).first()
         
         if not candidate:
             return
@@ -3881,264 +3542,256 @@ async def handle_candidate_reply(message: Message):
         if candidate.status == CandidateStatus.REJECTED.value:
             return
         
-        vacancy = session.query(Vacancy).filter(Vacancy.id == candidate.vacancy_id).first()
-        company = session.query(Company).filter(Company.id == vacancy.company_id).first()
+        vacancy = await session.get(Vacancy, candidate.vacancy_id)
+        company = await session.get(Company, vacancy.company_id) if vacancy else None
+    
+    if not vacancy or not company:
+        return
+    
+    candidate.last_reply = message.text[:500]
+    candidate.last_reply_at = datetime.now()
+    candidate.last_activity_at = datetime.now()
+    
+    current_step = getattr(candidate, 'dialog_step', 1)
+    
+    if current_step == 1:
+        candidate.answers_schedule = message.text[:500]
+        candidate.dialog_step = 2
         
-        if not vacancy or not company:
-            return
+        reply_text = generate_followup_message(candidate, vacancy, company, step=2)
+        await send_message_to_candidate(candidate, reply_text)
         
-        candidate.last_reply = message.text[:500]
-        candidate.last_reply_at = datetime.now()
-        candidate.last_activity_at = datetime.now()
+    elif current_step == 2:
+        candidate.answers_salary = message.text[:500]
+        candidate.dialog_step = 3
         
-        current_step = getattr(candidate, 'dialog_step', 1)
+        reply_text = generate_followup_message(candidate, vacancy, company, step=3)
+        await send_message_to_candidate(candidate, reply_text)
         
-        if current_step == 1:
-            candidate.answers_schedule = message.text[:500]
-            candidate.dialog_step = 2
-            
-            reply_text = generate_followup_message(candidate, vacancy, company, step=2)
-            await send_message_to_candidate(candidate, reply_text)
-            
-        elif current_step == 2:
-            candidate.answers_salary = message.text[:500]
-            candidate.dialog_step = 3
-            
-            reply_text = generate_followup_message(candidate, vacancy, company, step=3)
-            await send_message_to_candidate(candidate, reply_text)
-            
-        elif current_step == 3:
-            candidate.answers_timing = message.text[:500]
-            candidate.dialog_step = 4
-            
-            from pre_qualification import PreQualificationAnalyzer, format_qualification_results
-            
-            answers = {
-                'schedule': candidate.answers_schedule or "",
-                'salary': candidate.answers_salary or "",
-                'timing': candidate.answers_timing or ""
-            }
-            
-            analyzer = PreQualificationAnalyzer(candidate, vacancy, company)
-            results = analyzer.analyze_all(answers)
-            
-            candidate.qualification_score = results['total_score']
-            candidate.qualification_details = results
-            candidate.qualification_date = datetime.now()
-            candidate.qualification_history = results.get('history', [])
-            candidate.extracted_keywords_from_answers = results.get('keywords', [])
+    elif current_step == 3:
+        candidate.answers_timing = message.text[:500]
+        candidate.dialog_step = 4
+        
+        from pre_qualification import PreQualificationAnalyzer, format_qualification_results
+        
+        answers = {
+            'schedule': candidate.answers_schedule or "",
+            'salary': candidate.answers_salary or "",
+            'timing': candidate.answers_timing or ""
+        }
+        
+        analyzer = PreQualificationAnalyzer(candidate, vacancy, company)
+        results = analyzer.analyze_all(answers)
+        
+        candidate.qualification_score = results['total_score']
+        candidate.qualification_details = results
+        candidate.qualification_date = datetime.now()
+        candidate.qualification_history = results.get('history', [])
+        candidate.extracted_keywords_from_answers = results.get('keywords', [])
+        
+        candidate.is_new = False
+        
+        if results['verdict'] == 'lead':
+            set_candidate_status(candidate, CandidateStatus.QUALIFIED)
+            test_slots = _get_candidate_interview_slots(company)
+            slots_data = []
+            for slot in test_slots[:3]:
+                slots_data.append({
+                    'start': slot['start'].isoformat(),
+                    'end': slot['end'].isoformat(),
+                    'text': slot['text']
+                })
+            candidate.available_slots = slots_data
+
+            if slots_data:
+                selected_slot = slots_data[0]
+                candidate.interview_slot_text = selected_slot['text']
+                set_candidate_status(candidate, CandidateStatus.INTERVIEW)
+                candidate.dialog_step = 6
+                event, calendar_note = _create_calendar_event_for_candidate(company, vacancy, candidate, selected_slot)
+
+                reply_text = (
+                    f"Отлично! Вы нам подходите, и я автоматически забронировал ближайшее время:\n\n"
+                    f"📅 {selected_slot['text']}\n"
+                    f"📍 {company.location}\n\n"
+                    f"Если это время неудобно, просто напишите в ответ — подберу другое."
+                    f"{calendar_note}"
+                )
+                admin_text = (
+                    f"✅ <b>Автоназначение собеседования</b>\n\n"
+                    f"Кандидат: {candidate.name_or_nick}\n"
+                    f"Время: {selected_slot['text']}\n"
+                )
+                admin_text += "\n📅 Событие создано в календаре." if event else "\n📞 Подтвердите слот с кандидатом."
+                await bot.send_message(chat_id=company.owner_id, text=admin_text, parse_mode="HTML")
+            else:
+                candidate.dialog_step = 4
+                reply_text = generate_followup_message(candidate, vacancy, company, step=4, slots=test_slots)
             
-            candidate.is_new = False
+        elif results['verdict'] == 'clarify':
+            set_candidate_status(candidate, CandidateStatus.CLARIFY)
             
-            if results['verdict'] == 'lead':
-                candidate.status = CandidateStatus.QUALIFIED.value
-                test_slots = _get_candidate_interview_slots(company)
-                slots_data = []
-                for slot in test_slots[:3]:
-                    slots_data.append({
-                        'start': slot['start'].isoformat(),
-                        'end': slot['end'].isoformat(),
-                        'text': slot['text']
-                    })
-                candidate.available_slots = slots_data
-
-                if slots_data:
-                    selected_slot = slots_data[0]
-                    candidate.interview_slot_text = selected_slot['text']
-                    candidate.status = CandidateStatus.INTERVIEW.value
-                    candidate.dialog_step = 6
-                    event, calendar_note = _create_calendar_event_for_candidate(company, vacancy, candidate, selected_slot)
-
-                    reply_text = (
-                        f"Отлично! Вы нам подходите, и я автоматически забронировал ближайшее время:\n\n"
-                        f"📅 {selected_slot['text']}\n"
-                        f"📍 {company.location}\n\n"
-                        f"Если это время неудобно, просто напишите в ответ — подберу другое."
-                        f"{calendar_note}"
-                    )
-                    admin_text = (
-                        f"✅ <b>Автоназначение собеседования</b>\n\n"
-                        f"Кандидат: {candidate.name_or_nick}\n"
-                        f"Время: {selected_slot['text']}\n"
-                    )
-                    admin_text += "\n📅 Событие создано в календаре." if event else "\n📞 Подтвердите слот с кандидатом."
-                    await bot.send_message(chat_id=company.owner_id, text=admin_text, parse_mode="HTML")
-                else:
-                    candidate.dialog_step = 4
-                    reply_text = generate_followup_message(candidate, vacancy, company, step=4, slots=test_slots)
-                
-            elif results['verdict'] == 'clarify':
-                candidate.status = CandidateStatus.CLARIFY.value
-                
-                questions = analyzer.generate_followup_questions(results)
-                if questions:
-                    reply_text = (
-                        f"Спасибо за ответы! У меня есть несколько уточняющих вопросов:\n\n"
-                        f"{chr(10).join(['• ' + q for q in questions])}\n\n"
-                        f"Пожалуйста, ответьте на них."
-                    )
-                else:
-                    reply_text = (
-                        f"Спасибо за ответы! Мне нужно уточнить некоторые детали. "
-                        f"Мы скоро свяжемся с вами."
-                    )
-                candidate.dialog_step = 5
-                
+            questions = analyzer.generate_followup_questions(results)
+            if questions:
+                reply_text = (
+                    f"Спасибо за ответы! У меня есть несколько уточняющих вопросов:\n\n"
+                    f"{chr(10).join(['• ' + q for q in questions])}\n\n"
+                    f"Пожалуйста, ответьте на них."
+                )
             else:
-                candidate.status = CandidateStatus.REJECTED.value
-                candidate.rejection_reason = "Не прошёл предквалификацию"
                 reply_text = (
-                    f"Спасибо за ответы! К сожалению, сейчас у нас нет подходящей "
-                    f"вакансии для вас. Мы сохраним ваши контакты и свяжемся, "
-                    f"когда появится подходящее предложение. Хорошего дня!"
+                    f"Спасибо за ответы! Мне нужно уточнить некоторые детали. "
+                    f"Мы скоро свяжемся с вами."
                 )
+            candidate.dialog_step = 5
             
-            await send_message_to_candidate(candidate, reply_text)
-            
-            admin_text = format_qualification_results(results)
-            await bot.send_message(
-                chat_id=company.owner_id,
-                text=admin_text,
-                parse_mode="HTML"
+        else:
+            set_candidate_status(candidate, CandidateStatus.REJECTED)
+            candidate.rejection_reason = "Не прошёл предквалификацию"
+            reply_text = (
+                f"Спасибо за ответы! К сожалению, сейчас у нас нет подходящей "
+                f"вакансии для вас. Мы сохраним ваши контакты и свяжемся, "
+                f"когда появится подходящее предложение. Хорошего дня!"
             )
-            
-        elif current_step == 4:
-            try:
-                choice = int(message.text.strip())
-                if 1 <= choice <= 3 and candidate.available_slots:
-                    slots_data = candidate.available_slots
-                    if slots_data and len(slots_data) >= choice:
-                        selected_slot = slots_data[choice - 1]
-                        
-                        candidate.interview_slot_text = selected_slot['text']
-                        candidate.status = CandidateStatus.INTERVIEW.value
-                        candidate.dialog_step = 6
-                        
-                        event, calendar_note = _create_calendar_event_for_candidate(company, vacancy, candidate, selected_slot)
-                        
-                        reply_text = generate_followup_message(candidate, vacancy, company, step=6) + calendar_note
-                        await send_message_to_candidate(candidate, reply_text)
-                        
-                        admin_text = f"✅ <b>Кандидат выбрал время!</b>\n\n"
-                        admin_text += f"Кандидат: {candidate.name_or_nick}\n"
-                        admin_text += f"Выбранное время: {selected_slot['text']}\n"
-                        
-                        if event:
-                            admin_text += f"\n📅 Событие создано в календаре"
-                        else:
-                            admin_text += f"\n📞 Свяжитесь с кандидатом для подтверждения."
-                        
-                        await bot.send_message(
-                            chat_id=company.owner_id,
-                            text=admin_text,
-                            parse_mode="HTML"
-                        )
-            except (ValueError, IndexError):
-                pass
         
-        elif current_step == 5:
-            candidate.answers_clarify = message.text[:500]
-            
-            from pre_qualification import PreQualificationAnalyzer, format_qualification_results
-            
-            answers = {
-                'schedule': candidate.answers_schedule or "",
-                'salary': candidate.answers_salary or "",
-                'timing': candidate.answers_timing or "",
-                'clarify': candidate.answers_clarify or ""
-            }
-            
-            analyzer = PreQualificationAnalyzer(candidate, vacancy, company)
-            results = analyzer.analyze_all(answers)
-            
-            candidate.qualification_score = results['total_score']
-            candidate.qualification_details = results
-            candidate.qualification_history = results.get('history', [])
-            candidate.extracted_keywords_from_answers = results.get('keywords', [])
-            
-            if results['verdict'] == 'lead':
-                candidate.status = CandidateStatus.QUALIFIED.value
-                test_slots = _get_candidate_interview_slots(company)
-                slots_data = []
-                for slot in test_slots[:3]:
-                    slots_data.append({
-                        'start': slot['start'].isoformat(),
-                        'end': slot['end'].isoformat(),
-                        'text': slot['text']
-                    })
-                candidate.available_slots = slots_data
-
-                if slots_data:
-                    selected_slot = slots_data[0]
+        await send_message_to_candidate(candidate, reply_text)
+        
+        admin_text = format_qualification_results(results)
+        await bot.send_message(
+            chat_id=company.owner_id,
+            text=admin_text,
+            parse_mode="HTML"
+        )
+        
+    elif current_step == 4:
+        try:
+            choice = int(message.text.strip())
+            if 1 <= choice <= 3 and candidate.available_slots:
+                slots_data = candidate.available_slots
+                if slots_data and len(slots_data) >= choice:
+                    selected_slot = slots_data[choice - 1]
+                    
                     candidate.interview_slot_text = selected_slot['text']
-                    candidate.status = CandidateStatus.INTERVIEW.value
+                    set_candidate_status(candidate, CandidateStatus.INTERVIEW)
                     candidate.dialog_step = 6
+                    
                     event, calendar_note = _create_calendar_event_for_candidate(company, vacancy, candidate, selected_slot)
-
-                    reply_text = (
-                        f"Спасибо за уточнение! Я автоматически поставил собеседование на ближайший слот:\n\n"
-                        f"📅 {selected_slot['text']}\n"
-                        f"📍 {company.location}\n\n"
-                        f"Если время не подходит — напишите, перенесу."
-                        f"{calendar_note}"
-                    )
+                    
+                    reply_text = generate_followup_message(candidate, vacancy, company, step=6) + calendar_note
                     await send_message_to_candidate(candidate, reply_text)
-
-                    admin_schedule_text = (
-                        f"✅ <b>Автоназначение после уточнений</b>\n\n"
-                        f"Кандидат: {candidate.name_or_nick}\n"
-                        f"Время: {selected_slot['text']}\n"
+                    
+                    admin_text = f"✅ <b>Кандидат выбрал время!</b>\n\n"
+                    admin_text += f"Кандидат: {candidate.name_or_nick}\n"
+                    admin_text += f"Выбранное время: {selected_slot['text']}\n"
+                    
+                    if event:
+                        admin_text += f"\n📅 Событие создано в календаре"
+                    else:
+                        admin_text += f"\n📞 Свяжитесь с кандидатом для подтверждения."
+                    
+                    await bot.send_message(
+                        chat_id=company.owner_id,
+                        text=admin_text,
+                        parse_mode="HTML"
                     )
-                    admin_schedule_text += "\n📅 Событие создано в календаре." if event else "\n📞 Подтвердите слот с кандидатом."
-                    await bot.send_message(chat_id=company.owner_id, text=admin_schedule_text, parse_mode="HTML")
-                else:
-                    candidate.dialog_step = 4
-                    reply_text = generate_followup_message(candidate, vacancy, company, step=4, slots=test_slots)
-                    await send_message_to_candidate(candidate, reply_text)
-                
-                admin_text = format_qualification_results(results)
-                await bot.send_message(
-                    chat_id=company.owner_id,
-                    text=admin_text,
-                    parse_mode="HTML"
-                )
-            else:
-                candidate.status = CandidateStatus.REJECTED.value
-                candidate.rejection_reason = "Не прошёл предквалификацию после уточнений"
+        except (ValueError, IndexError):
+            pass
+    
+    elif current_step == 5:
+        candidate.answers_clarify = message.text[:500]
+        
+        from pre_qualification import PreQualificationAnalyzer, format_qualification_results
+        
+        answers = {
+            'schedule': candidate.answers_schedule or "",
+            'salary': candidate.answers_salary or "",
+            'timing': candidate.answers_timing or "",
+            'clarify': candidate.answers_clarify or ""
+        }
+        
+        analyzer = PreQualificationAnalyzer(candidate, vacancy, company)
+        results = analyzer.analyze_all(answers)
+        
+        candidate.qualification_score = results['total_score']
+        candidate.qualification_details = results
+        candidate.qualification_history = results.get('history', [])
+        candidate.extracted_keywords_from_answers = results.get('keywords', [])
+        
+        if results['verdict'] == 'lead':
+            set_candidate_status(candidate, CandidateStatus.QUALIFIED)
+            test_slots = _get_candidate_interview_slots(company)
+            slots_data = []
+            for slot in test_slots[:3]:
+                slots_data.append({
+                    'start': slot['start'].isoformat(),
+                    'end': slot['end'].isoformat(),
+                    'text': slot['text']
+                })
+            candidate.available_slots = slots_data
+
+            if slots_data:
+                selected_slot = slots_data[0]
+                candidate.interview_slot_text = selected_slot['text']
+                set_candidate_status(candidate, CandidateStatus.INTERVIEW)
+                candidate.dialog_step = 6
+                event, calendar_note = _create_calendar_event_for_candidate(company, vacancy, candidate, selected_slot)
+
                 reply_text = (
-                    f"Спасибо за ответы! К сожалению, сейчас у нас нет подходящей "
-                    f"вакансии для вас. Мы сохраним ваши контакты и свяжемся, "
-                    f"когда появится подходящее предложение. Хорошего дня!"
+                    f"Спасибо за уточнение! Я автоматически поставил собеседование на ближайший слот:\n\n"
+                    f"📅 {selected_slot['text']}\n"
+                    f"📍 {company.location}\n\n"
+                    f"Если время не подходит — напишите, перенесу."
+                    f"{calendar_note}"
                 )
                 await send_message_to_candidate(candidate, reply_text)
-        
-        session.commit()
+
+                admin_schedule_text = (
+                    f"✅ <b>Автоназначение после уточнений</b>\n\n"
+                    f"Кандидат: {candidate.name_or_nick}\n"
+                    f"Время: {selected_slot['text']}\n"
+                )
+                admin_schedule_text += "\n📅 Событие создано в календаре." if event else "\n📞 Подтвердите слот с кандидатом."
+                await bot.send_message(chat_id=company.owner_id, text=admin_schedule_text, parse_mode="HTML")
+            else:
+                candidate.dialog_step = 4
+                reply_text = generate_followup_message(candidate, vacancy, company, step=4, slots=test_slots)
+                await send_message_to_candidate(candidate, reply_text)
+            
+            admin_text = format_qualification_results(results)
+            await bot.send_message(
+                chat_id=company.owner_id,
+                text=admin_text,
+                parse_mode="HTML"
+            )
+        else:
+            set_candidate_status(candidate, CandidateStatus.REJECTED)
+            candidate.rejection_reason = "Не прошёл предквалификацию после уточнений"
+            reply_text = (
+                f"Спасибо за ответы! К сожалению, сейчас у нас нет подходящей "
+                f"вакансии для вас. Мы сохраним ваши контакты и свяжемся, "
+                f"когда появится подходящее предложение. Хорошего дня!"
+            )
+            await send_message_to_candidate(candidate, reply_text)
+    
+    # Сохраняем только изменённые поля кандидата
+    async with get_async_session() as session:
+        session.add(candidate)
 
 
 @router.message(Command("pipeline"))
 async def cmd_pipeline(message: Message):
     """Воронка по последней вакансии"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-
-        if not vacancies:
+        if vacancy is None:
             await message.answer("📭 Нет вакансий. Создайте: /new_job")
             return
 
-        vacancy = vacancies[0]
-        qs = (
-            session.query(Candidate.status, func.count(Candidate.id))
-            .filter(Candidate.vacancy_id == vacancy.id)
-            .group_by(Candidate.status)
-            .all()
-        )
-
-    total_by_status = {status: count for status, count in qs}
+        total_by_status = get_pipeline_counts(session, vacancy.id)
 
     def cnt(s: str) -> int:
         return total_by_status.get(s, 0)
@@ -4160,6 +3813,28 @@ async def cmd_pipeline(message: Message):
     await message.answer(text, parse_mode="HTML")
 
 
+async def archive_scheduler() -> None:
+    """Периодический перенос кандидатов закрытых вакансий в архив"""
+    while True:
+        try:
+            moved = await asyncio.to_thread(archive_old_vacancies)
+            if moved:
+                logger.info(f"🗄️ Архивация: перенесено кандидатов: {moved}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка архивации: {e}")
+        await asyncio.sleep(settings.archive_interval_hours * 3600)
+
+
+async def rollup_scheduler() -> None:
+    """Периодический пересчёт дневных агрегатов для аналитики компании"""
+    while True:
+        try:
+            await asyncio.to_thread(refresh_all_rollups)
+        except Exception as e:
+            logger.error(f"❌ Ошибка пересчёта дневных агрегатов: {e}")
+        await asyncio.sleep(settings.rollup_interval_hours * 3600)
+
+
 @router.message(Command("help_hr"))
 async def cmd_help_hr(message: Message):
     """Подробная справка"""
@@ -4179,19 +3854,22 @@ async def cmd_help_hr(message: Message):
 /rejected - отсеянные кандидаты
 /red_flags - статистика красных флагов
 /stats_normalized - статистика нормализации
+/archive - архив закрытых вакансий
 
 <b>📅 СОРТИРОВКА И ДАТЫ</b>
 /sort - сортировка кандидатов
 /report_stats - статистика по датам
 
 <b>📤 ЭКСПОРТ</b>
-/export - скачать отчёт (CSV/HTML)
+/export - скачать отчёт (CSV/Excel/HTML)
+/export_all [csv|xlsx] - все вакансии компании одним ZIP-архивом
 /send_report - отправить отчёт на email
 
 <b>📊 АНАЛИТИКА</b>
 /analytics - полный аналитический отчёт
 /sources - статистика по источникам
 /conversion - воронка конверсии
+/company_stats - аналитика по всем вакансиям компании
 
 <b>📧 EMAIL-УВЕДОМЛЕНИЯ</b>
 /set_email - установить email для отчётов
@@ -4265,7 +3943,7 @@ async def cb_help(callback: CallbackQuery):
 async def cmd_find(message: Message):
     """Поиск кандидатов (заглушка)"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company = get_owner_company(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
@@ -4282,128 +3960,63 @@ async def cmd_find(message: Message):
 async def cmd_recalculate(message: Message):
     """Пересчитать оценки всех кандидатов по текущей вакансии"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == message.from_user.id).first()
+        company, vacancy = get_owner_company_and_vacancy(session, message.from_user.id)
         if not company:
             await message.answer("❌ Сначала пройдите онбординг: /onboarding")
             return
         
-        vacancies = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).all()
-        if not vacancies:
+        if vacancy is None:
             await message.answer("📭 Нет вакансий")
             return
         
-        vacancy = vacancies[0]
-        candidates = session.query(Candidate).filter(Candidate.vacancy_id == vacancy.id).all()
+        candidates = (
+            session.query(Candidate)
+            .filter(Candidate.vacancy_id == vacancy.id)
+            .options(undefer_group(PAYLOAD_GROUP))
+            .all()
+        )
         
         status_msg = await message.answer(f"🔄 Пересчитываю оценки для {len(candidates)} кандидатов...")
         
         recalculated = 0
+        skipped = 0
+        matcher = None
         for candidate in candidates:
+            if not needs_rescoring(candidate, vacancy, company):
+                # Ни данные кандидата, ни настройки скоринга не менялись
+                skipped += 1
+                continue
             if candidate.status != CandidateStatus.REJECTED.value or candidate.score < 60:
-                # Локальная функция оценки, чтобы не было зависимости от порядка объявления
-                score = 50
-                explanation_parts = []
-                
-                # 1. Город (20 баллов)
-                if vacancy.city.lower() in candidate.city.lower():
-                    score += 20
-                    explanation_parts.append("🏙️ Город совпадает: +20")
-                elif candidate.normalized_city and vacancy.city.lower() in candidate.normalized_city.lower():
-                    score += 15
-                    explanation_parts.append("🏙️ Город (нормализованный) совпадает: +15")
-                else:
-                    score += 5
-                    explanation_parts.append("🏙️ Город не совпадает: +5")
-                
-                # 2. Опыт (25 баллов)
-                if candidate.experience_years:
-                    exp_years = candidate.experience_years
-                    if exp_years >= 5:
-                        score += 25
-                        explanation_parts.append(f"💼 Опыт {exp_years} лет: +25")
-                    elif exp_years >= 3:
-                        score += 20
-                        explanation_parts.append(f"💼 Опыт {exp_years} лет: +20")
-                    elif exp_years >= 1:
-                        score += 12
-                        explanation_parts.append(f"💼 Опыт {exp_years} лет: +12")
-                    else:
-                        score += 5
-                        explanation_parts.append(f"💼 Опыт {exp_years} лет: +5")
-                else:
-                    score += 10
-                    explanation_parts.append("💼 Опыт не указан: +10")
-                
-                # 3. Навыки (25 баллов)
-                must_have = vacancy.must_have if vacancy.must_have and vacancy.must_have != "-" else ""
-                if must_have:
-                    must_have_list = [skill.strip().lower() for skill in must_have.split(",")]
-                    candidate_skills = (candidate.skills_text or "").lower()
-                    found = sum(1 for skill in must_have_list if skill in candidate_skills)
-                    if found > 0:
-                        skill_points = min(25, int((found / len(must_have_list)) * 25))
-                        score += skill_points
-                        explanation_parts.append(f"📋 Найдено {found}/{len(must_have_list)} навыков: +{skill_points}")
-                    else:
-                        score += 5
-                        explanation_parts.append("📋 Требуемые навыки не найдены: +5")
-                else:
-                    score += 15
-                    explanation_parts.append("📋 Нет требований к навыкам: +15")
+                if matcher is None:
+                    # IDF по всем кандидатам вакансии — так же, как при поиске
+                    matcher = TfidfMatcher(
+                        vacancy_match_text(vacancy),
+                        [candidate_match_text(c) for c in candidates],
+                    )
+                relevance = matcher.score(candidate_match_text(candidate))
+                candidate.keyword_match_percentage = round(relevance * 100, 1)
                 
-                # 4. Зарплата (15 баллов)
-                if candidate.salary_expectations and (vacancy.salary_from or vacancy.salary_to):
-                    salary_expected = candidate.salary_expectations
-                    salary_min = vacancy.salary_from or 0
-                    salary_max = vacancy.salary_to or float('inf')
-                    if salary_min <= salary_expected <= salary_max:
-                        score += 15
-                        explanation_parts.append(f"💰 Зарплата {salary_expected} в вилке: +15")
-                    elif salary_expected < salary_min:
-                        score += 8
-                        explanation_parts.append(f"💰 Зарплата ниже вилки: +8")
-                    else:
-                        score += 5
-                        explanation_parts.append(f"💰 Зарплата выше вилки: +5")
-                else:
-                    score += 7
-                    explanation_parts.append("💰 Зарплата не указана: +7")
-                
-                # 5. Качество резюме (15 баллов)
-                text_length = len(candidate.raw_text or "")
-                if text_length > 500:
-                    score += 15
-                    explanation_parts.append(f"📝 Подробное резюме: +15")
-                elif text_length > 200:
-                    score += 10
-                    explanation_parts.append(f"📝 Хорошее резюме: +10")
-                elif text_length > 50:
-                    score += 5
-                    explanation_parts.append(f"📝 Короткое резюме: +5")
-                else:
-                    score += 2
-                    explanation_parts.append("📝 Очень краткое резюме: +2")
+                # Тот же алгоритм, что и при поиске (профиль вакансии берётся из кэша)
+                score, breakdown = calculate_candidate_score(candidate, vacancy, company, relevance=relevance)
                 
                 # Штраф за красные флаги
                 if candidate.red_flags:
-                    try:
-                        from filters import get_red_flags_score
-                        penalty = get_red_flags_score(candidate.raw_text)
-                        if penalty > 0:
-                            score = max(0, score - penalty)
-                            explanation_parts.append(f"🚩 Штраф за красные флаги: -{penalty}")
-                    except:
-                        pass
+                    penalty = get_red_flags_score(candidate.raw_text)
+                    if penalty > 0:
+                        score = max(0, score - penalty)
+                        breakdown.append(["red_flags", -penalty])
                 
-                candidate.score = min(100, score)
-                candidate.explanation = " | ".join(explanation_parts)
+                candidate.score = score
+                candidate.score_breakdown = breakdown
+                candidate.explanation = ""
                 
                 if candidate.score >= 80:
-                    candidate.status = CandidateStatus.FILTERED.value
+                    set_candidate_status(candidate, CandidateStatus.FILTERED)
                 elif candidate.score < 60:
-                    candidate.status = CandidateStatus.REJECTED.value
+                    set_candidate_status(candidate, CandidateStatus.REJECTED)
                     candidate.rejection_reason = f"Низкая оценка после пересчёта: {candidate.score}/100"
                 
+                mark_scored(candidate, vacancy, company)
                 recalculated += 1
         
         session.commit()
@@ -4411,21 +4024,24 @@ async def cmd_recalculate(message: Message):
         await status_msg.edit_text(
             f"✅ <b>Пересчёт завершён!</b>\n\n"
             f"📊 Пересчитано: {recalculated} кандидатов\n"
+            f"⏭️ Без изменений (пропущено): {skipped}\n"
             f"🎯 Новая оценка учитывает:\n"
             f"• Город (до 20 баллов)\n"
             f"• Опыт (до 25 баллов)\n"
             f"• Навыки (до 25 баллов)\n"
             f"• Зарплату (до 15 баллов)\n"
-            f"• Качество резюме (до 15 баллов)\n\n"
+            f"• Качество резюме (до 10 баллов)\n"
+            f"• Релевантность описанию вакансии (до 5 баллов)\n\n"
             f"Посмотреть обновлённые оценки: /candidates",
             parse_mode="HTML"
         )
 
 
+# llm_shortlist — сколько лучших кандидатов уточнять через DeepSeek (top-K каскадного скоринга)
 TARIFFS = {
-    "stars_2200_5": {"label": "🌟 5 кандидатов", "price": 2200, "candidates": 5},
-    "stars_7450_15": {"label": "🚀 15 кандидатов", "price": 7450, "candidates": 15},
-    "stars_13900_30": {"label": "💼 30 кандидатов", "price": 13900, "candidates": 30},
+    "stars_2200_5": {"label": "🌟 5 кандидатов", "price": 2200, "candidates": 5, "llm_shortlist": 5},
+    "stars_7450_15": {"label": "🚀 15 кандидатов", "price": 7450, "candidates": 15, "llm_shortlist": 15},
+    "stars_13900_30": {"label": "💼 30 кандидатов", "price": 13900, "candidates": 30, "llm_shortlist": 30},
 }
 
 
@@ -4494,22 +4110,22 @@ async def successful_payment_handler(message: Message):
             logger.error(f"❌ Ошибка сохранения платежа: {e}")
 
     await message.answer(f"✅ Оплачен тариф {tariff['label']}. Проверяю доступных кандидатов...")
-    payable_candidates = _get_payable_candidates(vacancy_id)
-    if not payable_candidates:
+    payable_count = _count_payable_candidates(vacancy_id)
+    if not payable_count:
         await message.answer("🔍 Кандидаты ещё не найдены, запускаю поиск...")
         await gather_real_candidates(vacancy_id, limit=50, payment_id=payment_id)
-        payable_candidates = _get_payable_candidates(vacancy_id)
+        payable_count = _count_payable_candidates(vacancy_id)
 
-    if not payable_candidates:
+    if not payable_count:
         await message.answer(
             "❌ После поиска подходящие кандидаты не найдены.\n"
             "Оплата сохранена, можно повторить поиск позже."
         )
         return
 
-    deliver_count = min(limit, len(payable_candidates))
+    deliver_count = min(limit, payable_count)
     await message.answer(
-        f"✅ Готово! Показываю {deliver_count} из {len(payable_candidates)} найденных кандидатов."
+        f"✅ Готово! Показываю {deliver_count} из {payable_count} найденных кандидатов."
     )
     await _send_candidates_page_for_vacancy(
         message,
@@ -4555,6 +4171,14 @@ async def main() -> None:
     else:
         logger.info("📱 VK бот не запущен (VK_TOKEN не настроен)")
     
+    if settings.archive_after_days > 0:
+        asyncio.create_task(archive_scheduler())
+        logger.info(f"🗄️ Архивация закрытых вакансий: через {settings.archive_after_days} дн. без активности")
+
+    if settings.rollup_interval_hours > 0:
+        asyncio.create_task(rollup_scheduler())
+        logger.info(f"📈 Дневные агрегаты: пересчёт раз в {settings.rollup_interval_hours} ч")
+
     # Запускаем Telegram бота в основном потоке (главный event loop)
     logger.info("🤖 Запускаем Telegram бота в основном event loop...")
     await dp.start_polling(bot)
@@ -0,0 +1,145 @@
+# check_query_plans.py
+"""
+Проверка, что горячие запросы бота используют индексы (EXPLAIN QUERY PLAN).
+
+Запуск: python check_query_plans.py
+Создаёт временную SQLite-базу со схемой из models.py, прогоняет планы запросов
+и завершается с кодом 1, если какой-то запрос перестал использовать свой индекс
+(например, после изменения запроса или удаления индекса).
+"""
+import os
+import sys
+import tempfile
+from datetime import date
+
+from sqlalchemy import func, select
+
+from analytics import report_aggregate_select
+from db import Base, create_db_engine
+from models import Candidate, CandidateDailyRollup, CandidateStatus, Company, Vacancy, VacancyPipelineCounts
+from pipeline import funnel_select
+from queries import export_chunk_select
+
+
+VACANCY_ID = 1
+
+# (описание, запрос, индекс, который должен использоваться)
+HOT_QUERIES = [
+    (
+        "Выдача кандидатов по оценке",
+        select(Candidate)
+        .where(Candidate.vacancy_id == VACANCY_ID, Candidate.status != CandidateStatus.REJECTED.value)
+        .order_by(Candidate.score.desc(), Candidate.created_at.desc()),
+        "ix_candidates_vacancy_score",
+    ),
+    (
+        "Отсеянные кандидаты (/rejected)",
+        select(Candidate)
+        .where(Candidate.vacancy_id == VACANCY_ID, Candidate.status == CandidateStatus.REJECTED.value)
+        .order_by(Candidate.created_at.desc()),
+        "ix_candidates_vacancy_status",
+    ),
+    (
+        "Воронка по статусам (сверка счётчиков)",
+        select(Candidate.status, func.count(Candidate.id))
+        .where(Candidate.vacancy_id == VACANCY_ID)
+        .group_by(Candidate.status),
+        "ix_candidates_vacancy_status",
+    ),
+    (
+        "Счётчики воронки (/pipeline, /conversion, страницы кандидатов)",
+        select(VacancyPipelineCounts).where(VacancyPipelineCounts.vacancy_id == VACANCY_ID),
+        "INTEGER PRIMARY KEY",
+    ),
+    (
+        "Причины отсева (/filters → статистика)",
+        select(Candidate.rejection_reason, func.count(Candidate.id))
+        .where(Candidate.vacancy_id == VACANCY_ID, Candidate.rejection_reason.isnot(None))
+        .group_by(Candidate.rejection_reason),
+        "ix_candidates_vacancy_rejection",
+    ),
+    (
+        "Источники кандидатов (/sources)",
+        select(Candidate.source, func.count(Candidate.id))
+        .where(Candidate.vacancy_id == VACANCY_ID)
+        .group_by(Candidate.source),
+        "ix_candidates_vacancy_report",
+    ),
+    (
+        "Аналитический отчёт одним проходом (/analytics)",
+        report_aggregate_select(VACANCY_ID),
+        "COVERING INDEX ix_candidates_vacancy_report",
+    ),
+    (
+        "Воронка и время этапов по журналу статусов (/conversion, /analytics)",
+        funnel_select(VACANCY_ID),
+        "COVERING INDEX ix_status_events_vacancy_candidate",
+    ),
+    (
+        "Аналитика компании по дневным агрегатам (/company_stats)",
+        select(CandidateDailyRollup.day, func.sum(CandidateDailyRollup.candidates))
+        .where(CandidateDailyRollup.company_id == 1, CandidateDailyRollup.day >= date(2026, 1, 1))
+        .group_by(CandidateDailyRollup.day),
+        "ix_rollups_company_day",
+    ),
+    (
+        "Потоковая выгрузка CSV: пачка по keyset id",
+        export_chunk_select(VACANCY_ID, after_id=1000),
+        "ix_candidates_vacancy_id (vacancy_id=? AND rowid>?)",
+    ),
+    (
+        "Ответ кандидата в Telegram",
+        select(Candidate).where(Candidate.contact == "@username").limit(1),
+        "ix_candidates_contact",
+    ),
+    (
+        "Компания владельца",
+        select(Company).where(Company.owner_id == 123).limit(1),
+        "ix_companies_owner_id",
+    ),
+    (
+        "Последняя вакансия компании",
+        select(Vacancy).where(Vacancy.company_id == 1).order_by(Vacancy.created_at.desc()).limit(1),
+        "ix_vacancies_company_created",
+    ),
+]
+
+
+def explain(conn, stmt) -> list[str]:
+    """Строки EXPLAIN QUERY PLAN для запроса SQLAlchemy"""
+    # render_postcompile: IN (...) раскрывается в обычные параметры
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()
+    return [row[-1] for row in rows]
+
+
+def main() -> int:
+    failed = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        db_engine = create_db_engine(f"sqlite:///{os.path.join(tmp, 'plans.db')}")
+        Base.metadata.create_all(bind=db_engine)
+
+        print("\n🔍 ПРОВЕРКА ПЛАНОВ ЗАПРОСОВ")
+        print("=" * 60)
+        with db_engine.connect() as conn:
+            for title, stmt, index_name in HOT_QUERIES:
+                plan = explain(conn, stmt)
+                uses_index = any(index_name in line for line in plan)
+                print(f"{'✅' if uses_index else '❌'} {title} — ожидается {index_name}")
+                for line in plan:
+                    print(f"      {line}")
+                if not uses_index:
+                    failed += 1
+        db_engine.dispose()
+
+    print("=" * 60)
+    if failed:
+        print(f"❌ Запросов без нужного индекса: {failed}")
+        return 1
+    print("✅ Все горячие запросы используют индексы")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+# compress_columns.py
+"""
+Сжатие уже сохранённых больших текстов и JSON (колонки CompressedText/CompressedJSON).
+
+Запуск: python compress_columns.py [--vacuum]
+Новые записи сжимаются автоматически; скрипт переписывает старые строки
+пачками по id и печатает отчёт: сколько байт занимали значения до и после.
+Файл SQLite уменьшается только после VACUUM (--vacuum; на время VACUUM
+база блокируется — запускать при остановленном боте).
+"""
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+from sqlalchemy import text
+
+from compression import CompressedJSON, CompressedText, compress_text, is_compressed
+from db import Base, engine
+import models  # noqa: F401  — регистрация таблиц в Base.metadata
+
+BATCH_SIZE = 500
+
+
+def compressed_columns() -> Dict[str, List[str]]:
+    """Таблица → колонки со сжимаемыми типами"""
+    result: Dict[str, List[str]] = defaultdict(list)
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if isinstance(column.type, (CompressedText, CompressedJSON)):
+                result[table.name].append(column.name)
+    return dict(result)
+
+
+def _stored_size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return len(bytes(value))
+
+
+def _file_size(conn) -> int:
+    page_count = conn.exec_driver_sql("PRAGMA page_count").scalar()
+    page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+    return page_count * page_size
+
+
+def compress_table(table: str, columns: List[str]) -> Dict[str, List[int]]:
+    """Переписывает несжатые большие значения; возвращает {колонка: [байт до, байт после]}"""
+    sizes = {column: [0, 0] for column in columns}
+    select_sql = text(
+        f"SELECT id, {', '.join(columns)} FROM {table} WHERE id > :last_id ORDER BY id LIMIT :limit"
+    )
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select_sql, {"last_id": last_id, "limit": BATCH_SIZE}).all()
+            if not rows:
+                break
+            for column in columns:
+                updates = []
+                for row in rows:
+                    value = getattr(row, column)
+                    before = _stored_size(value)
+                    after = before
+                    if isinstance(value, str) and not is_compressed(value):
+                        new_value = compress_text(value)
+                        if isinstance(new_value, bytes):
+                            updates.append({"id": row.id, "value": new_value})
+                            after = len(new_value)
+                    sizes[column][0] += before
+                    sizes[column][1] += after
+                if updates:
+                    conn.execute(text(f"UPDATE {table} SET {column} = :value WHERE id = :id"), updates)
+            last_id = rows[-1].id
+    return sizes
+
+
+def main() -> int:
+    if engine.dialect.name != "sqlite":
+        print("ℹ️ Сжатие колонок нужно только для SQLite (в PostgreSQL большие значения сжимает TOAST)")
+        return 0
+
+    print("\n🗜️ СЖАТИЕ БОЛЬШИХ КОЛОНОК")
+    print("=" * 60)
+    with engine.connect() as conn:
+        file_before = _file_size(conn)
+
+    total_before = total_after = 0
+    for table, columns in compressed_columns().items():
+        for column, (before, after) in compress_table(table, columns).items():
+            total_before += before
+            total_after += after
+            saved = 100 - after * 100 // before if before else 0
+            print(f"   {table}.{column:24s} {before / 1024:10.1f} КБ → {after / 1024:10.1f} КБ  (−{saved}%)")
+
+    if "--vacuum" in sys.argv:
+        with engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+
+    with engine.connect() as conn:
+        file_after = _file_size(conn)
+
+    print("=" * 60)
+    print(f"   Данные колонок: {total_before / 1024:.1f} КБ → {total_after / 1024:.1f} КБ")
+    print(f"   Файл БД:        {file_before / 1024:.1f} КБ → {file_after / 1024:.1f} КБ")
+    if "--vacuum" not in sys.argv:
+        print("   ℹ️ Освобождённые страницы переиспользуются; чтобы уменьшить файл: --vacuum")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
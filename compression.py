@@ -0,0 +1,90 @@
+# compression.py
+"""
+Прозрачное сжатие больших текстовых и JSON-колонок.
+
+Значения длиннее settings.compress_min_bytes сохраняются как BLOB:
+MAGIC + zlib-сжатые байты UTF-8. Короткие значения и строки, записанные до
+включения сжатия, остаются обычным текстом — при чтении различаются по типу
+(bytes/str) и префиксу, поэтому конвертация старых строк не обязательна
+(её делает compress_columns.py).
+
+Сжатие выполняется только для SQLite: в PostgreSQL большие значения и так
+сжимаются механизмом TOAST, там типы ведут себя как обычные Text/JSON.
+По содержимому сжатых колонок нельзя искать средствами SQL (LIKE, json_*).
+"""
+import json
+import zlib
+from typing import Any, Optional
+
+from sqlalchemy import JSON, Text
+from sqlalchemy.types import TypeDecorator
+
+from config import settings
+
+MAGIC = b"\x00zl1"
+COMPRESSION_LEVEL = 6
+
+
+def compress_text(value: str) -> str | bytes:
+    """Строка → сжатые байты с MAGIC, если строка не короче порога; иначе как есть"""
+    data = value.encode("utf-8")
+    if settings.compress_min_bytes <= 0 or len(data) < settings.compress_min_bytes:
+        return value
+    compressed = zlib.compress(data, COMPRESSION_LEVEL)
+    if len(compressed) + len(MAGIC) >= len(data):
+        return value
+    return MAGIC + compressed
+
+
+def decompress_text(value: Optional[str | bytes]) -> Optional[str]:
+    """Значение из БД (текст или сжатые байты) → строка"""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value.startswith(MAGIC):
+        return zlib.decompress(value[len(MAGIC):]).decode("utf-8")
+    return value.decode("utf-8")
+
+
+def is_compressed(value: Any) -> bool:
+    return isinstance(value, (bytes, memoryview)) and bytes(value[:len(MAGIC)]) == MAGIC
+
+
+class CompressedText(TypeDecorator):
+    """Text со сжатием больших значений (в SQLite)"""
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value: Optional[str], dialect) -> Optional[str | bytes]:
+        if value is None or dialect.name != "sqlite":
+            return value
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect) -> Optional[str]:
+        return decompress_text(value)
+
+
+class CompressedJSON(TypeDecorator):
+    """
+    JSON со сжатием больших значений (в SQLite).
+    В SQLite хранится как текст JSON или сжатый BLOB, в остальных БД — обычный JSON.
+    """
+    impl = Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "sqlite":
+            return dialect.type_descriptor(Text())
+        return dialect.type_descriptor(JSON())
+
+    def process_bind_param(self, value: Any, dialect) -> Any:
+        if dialect.name != "sqlite":
+            return value
+        if value is None:
+            return None
+        return compress_text(json.dumps(value, ensure_ascii=False))
+
+    def process_result_value(self, value: Any, dialect) -> Any:
+        if dialect.name != "sqlite" or value is None:
+            return value
+        return json.loads(decompress_text(value))
@@ -19,6 +19,16 @@ class Settings:
     deepseek_base_url: str = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
     deepseek_model: str = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
 
+    # Каскадный скоринг: в LLM уходит только шорт-лист после локальной оценки
+    llm_shortlist_size: int = int(os.getenv("LLM_SHORTLIST_SIZE", "10"))
+    """Сколько лучших кандидатов уточнять через LLM, если тариф не задан"""
+
+    llm_band_margin: int = int(os.getenv("LLM_BAND_MARGIN", "5"))
+    """Ширина полосы вокруг порогов 60/80, в которой оценку уточняет LLM"""
+
+    llm_shortlist_max: int = int(os.getenv("LLM_SHORTLIST_MAX", "25"))
+    """Максимальный размер шорт-листа (top-K + пограничные)"""
+
     # SuperJob
     superjob_api_key: str = os.getenv("SUPERJOB_API_KEY", "")
     superjob_client_secret: str = os.getenv("SUPERJOB_CLIENT_SECRET", "")
@@ -73,6 +83,47 @@ class Settings:
     # База данных
     db_url: str = os.getenv("DATABASE_URL", "sqlite:///./gwork.db")
 
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    """Постоянных соединений в пуле (бот, VK-поток и Flask работают параллельно)"""
+
+    db_max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    """Дополнительных соединений сверх пула при пиковой нагрузке"""
+
+    sqlite_busy_timeout_ms: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    """Сколько SQLite ждёт снятия блокировки вместо мгновенного «database is locked»"""
+
+    sqlite_cache_size_kb: int = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+    """Размер страничного кэша SQLite на соединение (КБ)"""
+
+    sqlite_mmap_size: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    """Сколько байт файла БД SQLite отображать в память (0 — выключить mmap)"""
+
+    user_context_ttl_seconds: int = int(os.getenv("USER_CONTEXT_TTL_SECONDS", "300"))
+    """Сколько секунд кэшировать связку владелец → компания → активная вакансия"""
+
+    analytics_cache_ttl_seconds: int = int(os.getenv("ANALYTICS_CACHE_TTL_SECONDS", "300"))
+    """Сколько секунд хранить отчёты аналитики, если кандидаты вакансии не менялись (0 — не кэшировать)"""
+
+    compress_min_bytes: int = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+    """С какого размера (байт UTF-8) сжимать тексты резюме и JSON-детали в SQLite (0 — не сжимать)"""
+
+    # === АРХИВ СТАРЫХ КАНДИДАТОВ ===
+    archive_db_url: str = os.getenv("ARCHIVE_DATABASE_URL", "sqlite:///./gwork_archive.db")
+    """Отдельная БД архива: туда переносятся кандидаты закрытых вакансий"""
+
+    archive_after_days: int = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+    """Через сколько дней без активности закрытая вакансия уходит в архив (0 — не архивировать)"""
+
+    archive_interval_hours: int = int(os.getenv("ARCHIVE_INTERVAL_HOURS", "24"))
+    """Как часто бот запускает архивацию"""
+
+    # === ДНЕВНЫЕ АГРЕГАТЫ (АНАЛИТИКА КОМПАНИИ) ===
+    rollup_window_days: int = int(os.getenv("ROLLUP_WINDOW_DAYS", "30"))
+    """За сколько последних дней пересчитывать агрегаты целиком; более старые дни — только если их кандидаты сменили статус за этот срок (должен быть больше rollup_interval_hours)"""
+
+    rollup_interval_hours: int = int(os.getenv("ROLLUP_INTERVAL_HOURS", "24"))
+    """Как часто бот пересчитывает дневные агрегаты (0 — не пересчитывать)"""
+
     @property
     def admin_ids(self) -> Set[int]:
         """Парсит строку ADMIN_IDS в множество целых чисел"""
@@ -1,16 +1,76 @@
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
+from typing import TYPE_CHECKING
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import DeclarativeBase, sessionmaker, Session
 
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
 from config import settings
 
 
-engine = create_engine(
-    settings.db_url,
-    echo=False,
-    future=True,
-)
+def _engine_options(db_url: str) -> dict:
+    """
+    Параметры движка под конкретную БД.
+
+    Бот (aiogram), поток VK и Flask health-check пишут в БД одновременно,
+    поэтому для файловой SQLite соединения разрешено использовать из разных
+    потоков, а пул ограничен — писатель в SQLite всё равно один.
+    """
+    url = make_url(db_url)
+    if url.get_backend_name() != "sqlite":
+        return {
+            "pool_size": settings.db_pool_size,
+            "max_overflow": settings.db_max_overflow,
+            "pool_pre_ping": True,
+        }
+    if url.database in (None, "", ":memory:"):
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "connect_args": {
+            "check_same_thread": False,
+            "timeout": settings.sqlite_busy_timeout_ms / 1000,
+        },
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+    }
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """
+    Production-настройки SQLite на каждое новое соединение:
+    WAL — читатели не блокируют писателя и наоборот;
+    synchronous=NORMAL — в режиме WAL безопасно и заметно быстрее FULL;
+    busy_timeout — ждать блокировку, а не падать с «database is locked».
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")
+        cursor.execute(f"PRAGMA cache_size=-{settings.sqlite_cache_size_kb}")
+        cursor.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_size}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+
+def create_db_engine(db_url: str):
+    """Создаёт движок с production-профилем (для SQLite — WAL и pragmas)"""
+    db_engine = create_engine(
+        db_url,
+        echo=False,
+        future=True,
+        **_engine_options(db_url),
+    )
+    if db_engine.dialect.name == "sqlite":
+        event.listen(db_engine, "connect", _set_sqlite_pragmas)
+    return db_engine
+
+
+engine = create_db_engine(settings.db_url)
 
 
 class Base(DeclarativeBase):
@@ -20,18 +80,62 @@ class Base(DeclarativeBase):
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False, class_=Session)
 
 
+# ===== АСИНХРОННЫЙ ДОСТУП (для aiogram-хендлеров) =====
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_db_url(db_url: str) -> str:
+    """sqlite:///... → sqlite+aiosqlite:///..., postgresql://... → postgresql+asyncpg://..."""
+    url = make_url(db_url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"Нет асинхронного драйвера для {url.get_backend_name()}")
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+
+_async_engine: "AsyncEngine | None" = None
+_async_session_factory: "async_sessionmaker | None" = None
+
+
+def get_async_engine() -> "AsyncEngine":
+    """
+    Асинхронный движок над той же БД. Создаётся при первом обращении,
+    чтобы синхронные скрипты не требовали greenlet/aiosqlite/asyncpg.
+    """
+    global _async_engine, _async_session_factory
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+        _async_engine = create_async_engine(
+            async_db_url(settings.db_url),
+            echo=False,
+            **_engine_options(settings.db_url),
+        )
+        if _async_engine.dialect.name == "sqlite":
+            event.listen(_async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        _async_session_factory = async_sessionmaker(
+            bind=_async_engine, expire_on_commit=False, class_=AsyncSession
+        )
+    return _async_engine
+
+
 def init_db() -> None:
-    from models import Company, Vacancy, Candidate, InterviewSlot, VacancyTemplate  # noqa: F401
+    from models import Company, Vacancy, Candidate, InterviewSlot, VacancyTemplate, VacancyPipelineCounts, CandidateDailyRollup, CandidateStatusEvent  # noqa: F401
+    import pipeline  # noqa: F401  — учёт счётчиков воронки при каждом flush
+    from migrations import run_migrations, stamp_latest
 
+    is_new_db = not inspect(engine).has_table("candidates")
     Base.metadata.create_all(bind=engine)
 
-    # Миграция: добавить колонку interview_slot_text, если её ещё нет (для старых БД)
-    try:
-        with engine.connect() as conn:
-            conn.execute(text("ALTER TABLE candidates ADD COLUMN interview_slot_text VARCHAR(255)"))
-            conn.commit()
-    except Exception:
-        pass
+    if is_new_db:
+        # Схема только что создана по актуальным моделям — миграции не нужны
+        stamp_latest(engine)
+    else:
+        run_migrations(engine)
 
 
 @contextmanager
@@ -46,3 +150,23 @@ def get_session() -> Session:
     finally:
         session.close()
 
+
+
+@asynccontextmanager
+async def get_async_session() -> "AsyncSession":
+    """
+    Асинхронная сессия: commit при выходе, rollback при ошибке.
+    Держать её открытой только на время запросов к БД — не через await отправки
+    сообщений. Объекты после выхода остаются доступны (expire_on_commit=False);
+    чтобы сохранить изменения, их добавляют в новую короткую сессию: session.add(obj).
+    """
+    get_async_engine()
+    session = _async_session_factory()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
@@ -22,6 +22,9 @@ SMTP_USERNAME = os.getenv("SMTP_USERNAME", "")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
 FROM_EMAIL = os.getenv("FROM_EMAIL", SMTP_USERNAME)
 
+# Сколько кандидатов показывать в теле письма с отчётом (остальные — во вложении CSV)
+EMAIL_REPORT_MAX_ROWS = 200
+
 
 class EmailService:
     """Сервис для отправки email-уведомлений через Яндекс.Почту"""
@@ -142,8 +145,11 @@ class EmailService:
             logger.warning(f"⚠️ Нет email для отчётов у компании {company.id}")
             return False
         
-        # Генерируем HTML-отчёт
-        html_report = generate_html_report(candidates, vacancy, company)
+        # Генерируем HTML-отчёт: в теле письма — первые EMAIL_REPORT_MAX_ROWS кандидатов
+        html_report = generate_html_report(
+            candidates, vacancy, company,
+            max_rows=EMAIL_REPORT_MAX_ROWS, truncated_note=" — полный список во вложении CSV",
+        )
         
         # Создаём CSV-вложение
         csv_data = generate_csv_report(candidates, vacancy)
@@ -2,16 +2,81 @@
 import csv
 import io
 import logging
+import re
+import zipfile
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
-from aiogram.types import InlineKeyboardMarkup
+from typing import AsyncGenerator, List, Dict, Any
+from aiogram.types import InlineKeyboardMarkup, InputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from models import Candidate, Vacancy, Company
+from models import Candidate, CandidateStatus, Vacancy, Company
+from html_report import HtmlReportRenderer, iter_html_report, report_counts
+from scoring import candidate_explanation
+from xlsx_writer import ChunkSink, XlsxStreamWriter
 
 logger = logging.getLogger(__name__)
 
 
+CSV_HEADERS = [
+    'ID',
+    'Имя',
+    'Город',
+    'Опыт',
+    'Навыки',
+    'Источник',
+    'Оценка',
+    'Объяснение оценки',
+    'Статус',
+    'Дата найден',
+    'Телефон',
+    'Email',
+    'Telegram',
+    'Результат предквалификации'
+]
+
+
+def split_contact(contact: str) -> tuple:
+    """Контакт кандидата → (телефон, email, telegram); неподходящие — пустые строки"""
+    phone = ""
+    email = ""
+    telegram = ""
+    
+    if contact:
+        if '@' in contact and '.' in contact:
+            email = contact
+        elif contact.startswith('@'):
+            telegram = contact
+        elif contact.replace('+', '').replace('-', '').replace(' ', '').isdigit():
+            phone = contact
+    
+    return phone, email, telegram
+
+
+def candidate_csv_row(c) -> list:
+    """
+    Строка CSV по кандидату: объект Candidate или строка запроса
+    с колонками queries.EXPORT_COLUMNS
+    """
+    phone, email, telegram = split_contact(c.contact)
+    
+    return [
+        c.id,
+        c.name_or_nick,
+        c.city,
+        c.experience_text[:100],
+        c.skills_text[:100],
+        c.source,
+        c.score,
+        candidate_explanation(c),
+        c.status,
+        c.created_at.strftime('%d.%m.%Y %H:%M') if c.created_at else '',
+        phone,
+        email,
+        telegram,
+        f"{c.qualification_score:.1f}" if c.qualification_score else 'Нет'
+    ]
+
+
 def generate_csv_report(candidates: List[Candidate], vacancy: Vacancy) -> str:
     """
     Генерирует CSV отчёт по кандидатам
@@ -19,143 +84,246 @@ def generate_csv_report(candidates: List[Candidate], vacancy: Vacancy) -> str:
     output = io.StringIO()
     writer = csv.writer(output)
     
-    # Заголовки
-    writer.writerow([
-        'ID',
-        'Имя',
-        'Город',
-        'Опыт',
-        'Навыки',
-        'Источник',
-        'Оценка',
-        'Статус',
-        'Дата найден',
-        'Телефон',
-        'Email',
-        'Telegram',
-        'Результат предквалификации'
-    ])
-    
-    # Данные
+    writer.writerow(CSV_HEADERS)
     for c in candidates:
-        # Извлекаем контакты
-        phone = ""
-        email = ""
-        telegram = ""
-        
-        if c.contact:
-            if '@' in c.contact and '.' in c.contact:
-                email = c.contact
-            elif c.contact.startswith('@'):
-                telegram = c.contact
-            elif c.contact.replace('+', '').replace('-', '').replace(' ', '').isdigit():
-                phone = c.contact
-        
-        writer.writerow([
-            c.id,
-            c.name_or_nick,
-            c.city,
-            c.experience_text[:100],
-            c.skills_text[:100],
-            c.source,
-            c.score,
-            c.status,
-            c.created_at.strftime('%d.%m.%Y %H:%M') if c.created_at else '',
-            phone,
-            email,
-            telegram,
-            f"{c.qualification_score:.1f}" if c.qualification_score else 'Нет'
-        ])
+        writer.writerow(candidate_csv_row(c))
     
     return output.getvalue()
 
 
-def generate_html_report(candidates: List[Candidate], vacancy: Vacancy, company: Company) -> str:
+def csv_chunk(rows, with_headers: bool = False) -> bytes:
+    """Пачка строк CSV в UTF-8 (для потоковой выгрузки)"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    if with_headers:
+        writer.writerow(CSV_HEADERS)
+    for c in rows:
+        writer.writerow(candidate_csv_row(c))
+    return output.getvalue().encode('utf-8')
+
+
+async def iter_export_chunks(vacancy_id: int) -> AsyncGenerator[list, None]:
     """
-    Генерирует HTML отчёт по кандидатам для отправки на почту
+    Кандидаты вакансии для выгрузки пачками по queries.EXPORT_CHUNK_SIZE:
+    keyset по id, только колонки queries.EXPORT_COLUMNS
     """
-    # Подсчёт статистики
-    total = len(candidates)
-    qualified = len([c for c in candidates if c.status == 'qualified'])
-    interview = len([c for c in candidates if c.status == 'interview'])
-    rejected = len([c for c in candidates if c.status == 'rejected'])
+    from db import get_async_session
+    from queries import EXPORT_CHUNK_SIZE, export_chunk_select
     
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 20px; }}
-            h1 {{ color: #333; }}
-            .stats {{ background: #f5f5f5; padding: 15px; border-radius: 5px; margin: 20px 0; }}
-            table {{ border-collapse: collapse; width: 100%; }}
-            th {{ background: #4CAF50; color: white; padding: 10px; text-align: left; }}
-            td {{ padding: 8px; border-bottom: 1px solid #ddd; }}
-            tr:hover {{ background: #f5f5f5; }}
-            .qualified {{ color: green; font-weight: bold; }}
-            .interview {{ color: blue; font-weight: bold; }}
-            .rejected {{ color: red; font-weight: bold; }}
-            .new {{ background-color: #e8f5e8; }}
-        </style>
-    </head>
-    <body>
-        <h1>📊 Отчёт по вакансии: {vacancy.role}</h1>
-        <p>Компания: {company.name_and_industry} | Город: {vacancy.city} | Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}</p>
-        
-        <div class="stats">
-            <h2>Статистика</h2>
-            <p>Всего кандидатов: <b>{total}</b></p>
-            <p>✅ Прошли предквалификацию: <b>{qualified}</b></p>
-            <p>📅 Назначено собеседований: <b>{interview}</b></p>
-            <p>❌ Отсеяно: <b>{rejected}</b></p>
-        </div>
-        
-        <h2>Список кандидатов</h2>
-        <table>
-            <tr>
-                <th>ID</th>
-                <th>Имя</th>
-                <th>Город</th>
-                <th>Опыт</th>
-                <th>Оценка</th>
-                <th>Статус</th>
-                <th>Дата</th>
-                <th>Контакт</th>
-            </tr>
+    after_id = 0
+    while True:
+        # Сессия только на время запроса пачки — не через отправку данных
+        async with get_async_session() as session:
+            rows = (await session.execute(export_chunk_select(vacancy_id, after_id))).all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < EXPORT_CHUNK_SIZE:
+            return
+        after_id = rows[-1].id
+
+
+class CandidatesCSVFile(InputFile):
+    """
+    CSV-выгрузка кандидатов вакансии для answer_document, которая формируется
+    по ходу отправки: каждая пачка из iter_export_chunks сразу кодируется
+    и уходит в запрос к Telegram. Ни временного файла, ни всего CSV в памяти —
+    расход памяти не зависит от числа кандидатов.
     """
     
-    for c in candidates[:50]:  # Ограничим 50 кандидатами для отчёта
-        row_class = "new" if (datetime.now() - c.created_at) < timedelta(days=1) else ""
-        status_class = ""
-        if c.status == 'qualified':
-            status_class = "qualified"
-        elif c.status == 'interview':
-            status_class = "interview"
-        elif c.status == 'rejected':
-            status_class = "rejected"
-        
-        html += f"""
-            <tr class="{row_class}">
-                <td>{c.id}</td>
-                <td>{c.name_or_nick}</td>
-                <td>{c.city}</td>
-                <td>{c.experience_text[:50]}</td>
-                <td>{c.score}</td>
-                <td class="{status_class}">{c.status}</td>
-                <td>{c.created_at.strftime('%d.%m.%Y') if c.created_at else ''}</td>
-                <td>{c.contact}</td>
-            </tr>
-        """
+    def __init__(self, vacancy_id: int, filename: str):
+        super().__init__(filename=filename)
+        self.vacancy_id = vacancy_id
+    
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        yield csv_chunk([], with_headers=True)
+        async for rows in iter_export_chunks(self.vacancy_id):
+            yield csv_chunk(rows)
+
+
+# ===== XLSX =====
+
+# (заголовок, ширина колонки в символах)
+XLSX_COLUMNS = [
+    ('ID', 8),
+    ('Имя', 24),
+    ('Город', 14),
+    ('Опыт', 30),
+    ('Опыт, лет', 10),
+    ('Навыки', 30),
+    ('Источник', 12),
+    ('Оценка', 9),
+    ('Объяснение оценки', 40),
+    ('Статус', 12),
+    ('Дата найден', 17),
+    ('Ожидания по зарплате', 14),
+    ('Телефон', 16),
+    ('Email', 22),
+    ('Telegram', 18),
+    ('Результат предквалификации', 14),
+]
+
+
+def candidate_xlsx_row(c) -> list:
+    """
+    Строка XLSX с типами ячеек: оценка, опыт и зарплата — числа,
+    дата — дата Excel; пустые значения — пустые ячейки
+    """
+    phone, email, telegram = split_contact(c.contact)
+    return [
+        c.id,
+        c.name_or_nick,
+        c.city,
+        c.experience_text,
+        c.experience_years,
+        c.skills_text,
+        c.source,
+        c.score,
+        candidate_explanation(c) or None,
+        c.status,
+        c.created_at,
+        c.salary_expectations,
+        phone or None,
+        email or None,
+        telegram or None,
+        round(c.qualification_score, 1) if c.qualification_score else None,
+    ]
+
+
+def candidates_xlsx_writer(sheet_name: str = 'Кандидаты') -> XlsxStreamWriter:
+    """XlsxStreamWriter с колонками XLSX_COLUMNS"""
+    return XlsxStreamWriter(
+        [title for title, _ in XLSX_COLUMNS],
+        sheet_name=sheet_name,
+        column_widths=[width for _, width in XLSX_COLUMNS],
+    )
+
+
+class CandidatesXLSXFile(InputFile):
+    """
+    Выгрузка кандидатов вакансии в Excel (.xlsx), потоково как CandidatesCSVFile:
+    пачки из iter_export_chunks пишутся в XlsxStreamWriter, готовые байты
+    архива сразу уходят в запрос к Telegram
+    """
+    
+    def __init__(self, vacancy_id: int, filename: str, sheet_name: str = 'Кандидаты'):
+        super().__init__(filename=filename)
+        self.vacancy_id = vacancy_id
+        self.sheet_name = sheet_name
+    
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        writer = candidates_xlsx_writer(self.sheet_name)
+        async for rows in iter_export_chunks(self.vacancy_id):
+            data = writer.write_rows(candidate_xlsx_row(c) for c in rows)
+            if data:
+                yield data
+        yield writer.close()
+
+
+def generate_html_report(
+    candidates: List[Candidate],
+    vacancy: Vacancy,
+    company: Company,
+    max_rows: int = None,
+    truncated_note: str = '',
+) -> str:
+    """
+    Генерирует HTML отчёт по кандидатам (html_report.py) одной строкой —
+    для тела письма. max_rows ограничивает число строк в таблицах
+    """
+    renderer = HtmlReportRenderer(
+        vacancy, company, report_counts(candidates), max_rows=max_rows, truncated_note=truncated_note
+    )
+    return ''.join(iter_html_report(renderer, [candidates]))
+
+
+class CandidatesHTMLFile(InputFile):
+    """
+    HTML-отчёт по вакансии для answer_document, потоково как CandidatesCSVFile:
+    статистика шапки — из счётчиков воронки, кандидаты — пачками
+    из iter_export_chunks, разделами по html_report.HTML_SECTION_SIZE
+    """
+    
+    def __init__(self, vacancy: Vacancy, company: Company, filename: str):
+        super().__init__(filename=filename)
+        self.vacancy = vacancy
+        self.company = company
     
-    html += """
-        </table>
-        <p><small>Отчёт сгенерирован автоматически ботом GWork HR</small></p>
-    </body>
-    </html>
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        from db import get_async_session
+        from pipeline import get_pipeline_counts
+        
+        vacancy_id = self.vacancy.id
+        async with get_async_session() as session:
+            pipeline = await session.run_sync(lambda s: get_pipeline_counts(s, vacancy_id))
+        counts = {
+            'total': pipeline['total'],
+            'qualified': pipeline[CandidateStatus.QUALIFIED.value],
+            'interview': pipeline[CandidateStatus.INTERVIEW.value],
+            'rejected': pipeline[CandidateStatus.REJECTED.value],
+        }
+        
+        renderer = HtmlReportRenderer(self.vacancy, self.company, counts)
+        yield renderer.head().encode('utf-8')
+        async for rows in iter_export_chunks(vacancy_id):
+            yield renderer.rows(rows).encode('utf-8')
+        yield renderer.tail().encode('utf-8')
+
+
+# ===== АРХИВ КОМПАНИИ =====
+
+EXPORT_ARCHIVE_FORMATS = ('csv', 'xlsx')
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^\w\-. ]+')
+
+
+def archive_member_name(index: int, vacancy: Vacancy, export_format: str) -> str:
+    """Имя файла вакансии внутри архива: порядковый номер, должность, id"""
+    role = _UNSAFE_FILENAME_CHARS.sub('_', vacancy.role or '').strip(' ._')[:60] or 'vacancy'
+    return f"{index:02d}_{role}_{vacancy.id}.{export_format}"
+
+
+class CompanyExportArchive(InputFile):
+    """
+    ZIP со всеми активными вакансиями компании для одного answer_document:
+    по файлу CSV или XLSX на вакансию. Архив пишется потоково (zipfile без seek):
+    кандидаты каждой вакансии читаются пачками из iter_export_chunks, пачка
+    сразу попадает в свой файл архива, готовые байты уходят в запрос к Telegram.
+    В памяти — одна пачка кандидатов и буфер сжатия, сколько бы ни было вакансий.
     """
     
-    return html
+    def __init__(self, vacancies: List[Vacancy], filename: str, export_format: str = 'csv'):
+        if export_format not in EXPORT_ARCHIVE_FORMATS:
+            raise ValueError(f"Неизвестный формат выгрузки: {export_format}")
+        super().__init__(filename=filename)
+        self.vacancies = vacancies
+        self.export_format = export_format
+        self.rows_written = 0
+    
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        sink = ChunkSink()
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for index, vacancy in enumerate(self.vacancies, start=1):
+                name = archive_member_name(index, vacancy, self.export_format)
+                with archive.open(name, 'w') as member:
+                    if self.export_format == 'csv':
+                        member.write(csv_chunk([], with_headers=True))
+                        async for rows in iter_export_chunks(vacancy.id):
+                            member.write(csv_chunk(rows))
+                            self.rows_written += len(rows)
+                            data = sink.take()
+                            if data:
+                                yield data
+                    else:
+                        writer = candidates_xlsx_writer()
+                        async for rows in iter_export_chunks(vacancy.id):
+                            member.write(writer.write_rows(candidate_xlsx_row(c) for c in rows))
+                            self.rows_written += len(rows)
+                            data = sink.take()
+                            if data:
+                                yield data
+                        member.write(writer.close())
+                logger.info(f"🗂️ Архив выгрузки: {name} готов")
+        yield sink.take()
 
 
 def filter_by_date(candidates: List[Candidate], days: int = None) -> List[Candidate]:
@@ -1,5 +1,7 @@
 # filters.py
 import re
+from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Dict, List, Tuple, Optional
 from models import Candidate, Vacancy, Company
 import logging
@@ -145,16 +147,8 @@ def count_critical_skills_match(candidate_text: str, critical_requirements: str)
     if not critical_requirements or not candidate_text:
         return 0
     
-    # Разбиваем требования на отдельные ключевые слова
-    requirements = [req.strip().lower() for req in critical_requirements.split(',')]
-    candidate_lower = candidate_text.lower()
-    
-    matches = 0
-    for req in requirements:
-        if len(req) > 2 and req in candidate_lower:  # Игнорируем слишком короткие слова
-            matches += 1
-    
-    return matches
+    # Требования разбираются и компилируются один раз (см. compile_requirements)
+    return compile_requirements(critical_requirements).count(candidate_text, min_length=3)
 
 
 # ===== КРАСНЫЕ ФЛАГИ =====
@@ -504,6 +498,20 @@ def normalize_skills_list(skills_text: str) -> list[str]:
 
 # ===== ИЗВЛЕЧЕНИЕ КЛЮЧЕВЫХ СЛОВ =====
 
+# Стоп-слова (часто встречающиеся, но неинформативные)
+STOP_WORDS = {
+    'это', 'что', 'как', 'так', 'для', 'все', 'еще', 'уже', 'которые',
+    'можно', 'нужно', 'будет', 'когда', 'только', 'после', 'перед',
+    'очень', 'также', 'занимаюсь', 'работаю', 'являюсь', 'имеется',
+    'качестве', 'основном', 'помощь', 'своих', 'своей', 'своем',
+    'был', 'была', 'были', 'было', 'этого', 'этом', 'тому', 'этот',
+    'всем', 'всего', 'всех', 'ними', 'ними', 'вас', 'вам', 'ваш',
+    'нашей', 'нашего', 'нашим', 'нашем', 'которые', 'который',
+    'которая', 'которое', 'которые', 'также', 'именно', 'всегда',
+    'никогда', 'сегодня', 'завтра', 'вчера', 'сейчас', 'потом',
+}
+
+
 def extract_keywords(text: str, min_length: int = 4) -> list[str]:
     """
     Извлекает ключевые слова из текста (слова длиннее min_length)
@@ -514,20 +522,7 @@ def extract_keywords(text: str, min_length: int = 4) -> list[str]:
     # Разделяем на слова (русские и английские)
     words = re.findall(r'\b[a-zA-Zа-яА-Я]{4,}\b', text.lower())
     
-    # Стоп-слова (часто встречающиеся, но неинформативные)
-    stop_words = {
-        'это', 'что', 'как', 'так', 'для', 'все', 'еще', 'уже', 'которые',
-        'можно', 'нужно', 'будет', 'когда', 'только', 'после', 'перед',
-        'очень', 'также', 'занимаюсь', 'работаю', 'являюсь', 'имеется',
-        'качестве', 'основном', 'помощь', 'своих', 'своей', 'своем',
-        'был', 'была', 'были', 'было', 'этого', 'этом', 'тому', 'этот',
-        'всем', 'всего', 'всех', 'ними', 'ними', 'вас', 'вам', 'ваш',
-        'нашей', 'нашего', 'нашим', 'нашем', 'которые', 'который',
-        'которая', 'которое', 'которые', 'также', 'именно', 'всегда',
-        'никогда', 'сегодня', 'завтра', 'вчера', 'сейчас', 'потом',
-    }
-    
-    keywords = [w for w in words if w not in stop_words and len(w) >= min_length]
+    keywords = [w for w in words if w not in STOP_WORDS and len(w) >= min_length]
     
     # Возвращаем уникальные ключевые слова
     return sorted(list(set(keywords)))
@@ -677,6 +672,123 @@ def extract_city_from_text(text: str) -> str | None:
     return None
 
 
+# ===== ПРОФИЛЬ ВАКАНСИИ (ПРЕДКОМПИЛИРОВАННЫЕ ТРЕБОВАНИЯ) =====
+
+# Обратный словарь синонимов: "python" → {"python", "питон", "пайтон"}
+SKILL_SYNONYMS: Dict[str, set] = {}
+for _key, _value in SKILL_NORMALIZATION.items():
+    SKILL_SYNONYMS.setdefault(_value.lower(), {_value.lower()}).add(_key)
+
+
+@dataclass
+class RequirementsMatcher:
+    """
+    Скомпилированные требования вакансии.
+
+    Все варианты написания всех требований собраны в одно регулярное выражение
+    с lookahead, поэтому текст кандидата просматривается один раз, а найденные
+    варианты (в том числе перекрывающиеся) сопоставляются с требованиями.
+    """
+    requirements: List[str]
+    pattern: Optional[re.Pattern] = None
+    alternatives: Dict[str, Tuple[int, ...]] = field(default_factory=dict)
+
+    def matched(self, text: str) -> set:
+        """Индексы требований, найденных в тексте"""
+        if not self.pattern or not text:
+            return set()
+        found = set()
+        for match in self.pattern.finditer(text.lower()):
+            found.update(self.alternatives[match.group(1)])
+        return found
+
+    def count(self, text: str, min_length: int = 1) -> int:
+        """Сколько требований (не короче min_length символов) найдено в тексте"""
+        return sum(1 for i in self.matched(text) if len(self.requirements[i]) >= min_length)
+
+
+@lru_cache(maxsize=512)
+def compile_requirements(must_have: str) -> RequirementsMatcher:
+    """
+    Разбирает строку требований («python, sql, докер») один раз:
+    нижний регистр, синонимы из SKILL_NORMALIZATION, единый regex
+    """
+    if not must_have or must_have.strip() == "-":
+        return RequirementsMatcher(requirements=[])
+
+    requirements = [req.strip().lower() for req in must_have.split(',') if req.strip()]
+    if not requirements:
+        # Одни разделители («, ,»): пустой regex совпал бы в каждой позиции
+        return RequirementsMatcher(requirements=[])
+
+    variants = []
+    for req in requirements:
+        canonical = SKILL_NORMALIZATION.get(req, req).lower()
+        synonyms = {s for s in SKILL_SYNONYMS.get(canonical, ()) if len(s) > 2}
+        variants.append({req} | synonyms)
+
+    # Найденный вариант засчитывает все требования, чей вариант является его подстрокой
+    all_variants = sorted(set().union(*variants), key=len, reverse=True)
+    alternatives = {
+        alt: tuple(i for i, req_variants in enumerate(variants) if any(v in alt for v in req_variants))
+        for alt in all_variants
+    }
+    pattern = re.compile("(?=(" + "|".join(re.escape(alt) for alt in all_variants) + "))")
+    return RequirementsMatcher(requirements=requirements, pattern=pattern, alternatives=alternatives)
+
+
+@dataclass
+class VacancyProfile:
+    """Нормализованные параметры вакансии, которые нужны для оценки каждого кандидата"""
+    vacancy_id: Optional[int]
+    version: int
+    city: str
+    """Нормализованный город (normalize_city)"""
+    city_lower: str
+    """Город вакансии как есть, в нижнем регистре"""
+    salary_from: Optional[int]
+    salary_to: Optional[int]
+    experience_required: bool
+    requirements: RequirementsMatcher
+
+    @property
+    def has_requirements(self) -> bool:
+        return bool(self.requirements.requirements)
+
+
+_PROFILE_CACHE: Dict[Tuple[int, int], VacancyProfile] = {}
+_PROFILE_CACHE_MAX = 1024
+
+
+def get_vacancy_profile(vacancy: Vacancy) -> VacancyProfile:
+    """
+    Профиль вакансии из кэша по (id, scoring_version).
+    При изменении требований вакансии нужно увеличить vacancy.scoring_version.
+    """
+    version = getattr(vacancy, "scoring_version", None) or 1
+    key = (vacancy.id, version)
+    if vacancy.id is not None and key in _PROFILE_CACHE:
+        return _PROFILE_CACHE[key]
+
+    must_have = vacancy.must_have if vacancy.must_have and vacancy.must_have != "-" else ""
+    profile = VacancyProfile(
+        vacancy_id=vacancy.id,
+        version=version,
+        city=normalize_city(vacancy.city or ""),
+        city_lower=(vacancy.city or "").lower(),
+        salary_from=vacancy.salary_from,
+        salary_to=vacancy.salary_to,
+        experience_required=bool(vacancy.experience_required),
+        requirements=compile_requirements(must_have),
+    )
+
+    if vacancy.id is not None:
+        if len(_PROFILE_CACHE) >= _PROFILE_CACHE_MAX:
+            _PROFILE_CACHE.clear()
+        _PROFILE_CACHE[key] = profile
+    return profile
+
+
 # ===== ЖЁСТКИЕ ФИЛЬТРЫ =====
 
 def apply_hard_filters(candidate: Candidate, vacancy: Vacancy, company: Company = None) -> tuple[bool, str]:
@@ -710,37 +822,37 @@ def apply_hard_filters(candidate: Candidate, vacancy: Vacancy, company: Company
         if serious_flags:
             return False, f"Обнаружены подозрительные фразы: {', '.join(red_flags_list[:2])}"
     
+    profile = get_vacancy_profile(vacancy)
+    
     # 1. Фильтр по городу
     if filters_settings.get('city', True):
         candidate_city = normalize_city(candidate.city)
-        vacancy_city = normalize_city(vacancy.city)
         
-        if candidate_city and vacancy_city and candidate_city != vacancy_city:
+        if candidate_city and profile.city and candidate_city != profile.city:
             return False, f"Город {candidate.city} не соответствует требуемому {vacancy.city}"
     
     # 2. Фильтр по зарплате
     if filters_settings.get('salary', True):
-        if vacancy.salary_to and candidate.salary_expectations:
-            if candidate.salary_expectations > vacancy.salary_to * 1.2:  # Запас 20%
-                return False, f"Ожидания по зарплате ({candidate.salary_expectations}) выше вилки ({vacancy.salary_to})"
+        if profile.salary_to and candidate.salary_expectations:
+            if candidate.salary_expectations > profile.salary_to * 1.2:  # Запас 20%
+                return False, f"Ожидания по зарплате ({candidate.salary_expectations}) выше вилки ({profile.salary_to})"
     
     # 3. Фильтр по опыту
     if filters_settings.get('experience', True):
-        if vacancy.experience_required:
+        if profile.experience_required:
             if not candidate.experience_years or candidate.experience_years < 1:
                 return False, "Требуется опыт работы, но у кандидата нет опыта"
     
     # 4. Фильтр по критичным требованиям (МОЖНО ПРОПУСТИТЬ)
     if filters_settings.get('skills', True):
-        if vacancy.must_have and vacancy.must_have.strip() and vacancy.must_have != "-":
-            matches = count_critical_skills_match(
+        if profile.has_requirements:
+            matches = profile.requirements.count(
                 f"{candidate.experience_text} {candidate.skills_text}",
-                vacancy.must_have
+                min_length=3,  # Игнорируем слишком короткие слова
             )
             candidate.critical_skills_match = matches
             
-            if matches == 0 and len(vacancy.must_have.split(',')) > 0:
-                # Проверяем, не является ли требование пустым или прочерком
+            if matches == 0:
                 return False, f"Не найдены критичные требования: {vacancy.must_have}"
     
     return True, ""
\ No newline at end of file
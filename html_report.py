@@ -0,0 +1,243 @@
+# html_report.py
+"""
+HTML-отчёт по кандидатам вакансии (письмо /send_report и выгрузка /export).
+
+Шаблоны с подстановками $имя разбираются один раз при импорте, отчёт отдаётся
+частями (HtmlReportRenderer, iter_html_report): шапка со статистикой, затем
+разделы по HTML_SECTION_SIZE кандидатов — строки рендерятся пачками по мере
+чтения, весь документ в памяти не собирается. Все значения из БД экранируются.
+"""
+import re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from html import escape
+from typing import Dict, Iterable, Iterator, Optional
+
+from models import CandidateStatus, Company, Vacancy
+
+# Кандидатов в одном разделе (отдельная таблица со своим заголовком)
+HTML_SECTION_SIZE = 500
+# Кандидаты, найденные не раньше чем столько назад, подсвечиваются
+NEW_CANDIDATE_AGE = timedelta(days=1)
+
+
+def _compile(template: str) -> str:
+    """
+    Шаблон с подстановками $имя → строка для str.format. Разбирается один раз
+    при импорте; format в разы быстрее string.Template.substitute на каждой строке
+    """
+    return re.sub(r"\$(\w+)", r"{\1}", template.replace("{", "{{").replace("}", "}}"))
+
+
+_STATUS_CLASSES = {
+    CandidateStatus.QUALIFIED.value: "qualified",
+    CandidateStatus.INTERVIEW.value: "interview",
+    CandidateStatus.REJECTED.value: "rejected",
+}
+
+_HEAD = _compile("""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>Отчёт по вакансии: $role</title>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; }
+        h1 { color: #333; }
+        .stats { background: #f5f5f5; padding: 15px; border-radius: 5px; margin: 20px 0; }
+        table { border-collapse: collapse; width: 100%; margin-bottom: 20px; }
+        th { background: #4CAF50; color: white; padding: 10px; text-align: left; }
+        td { padding: 8px; border-bottom: 1px solid #ddd; }
+        tr:hover { background: #f5f5f5; }
+        .qualified { color: green; font-weight: bold; }
+        .interview { color: blue; font-weight: bold; }
+        .rejected { color: red; font-weight: bold; }
+        .new { background-color: #e8f5e8; }
+    </style>
+</head>
+<body>
+    <h1>📊 Отчёт по вакансии: $role</h1>
+    <p>Компания: $company | Город: $city | Дата: $generated_at</p>
+
+    <div class="stats">
+        <h2>Статистика</h2>
+        <p>Всего кандидатов: <b>$total</b></p>
+        <p>✅ Прошли предквалификацию: <b>$qualified</b></p>
+        <p>📅 Назначено собеседований: <b>$interview</b></p>
+        <p>❌ Отсеяно: <b>$rejected</b></p>
+    </div>
+
+    <h2>Список кандидатов</h2>
+""")
+
+_SECTION_START = _compile("""    <h3>Кандидаты $first–$last</h3>
+    <table>
+        <tr>
+            <th>ID</th>
+            <th>Имя</th>
+            <th>Город</th>
+            <th>Опыт</th>
+            <th>Оценка</th>
+            <th>Статус</th>
+            <th>Дата</th>
+            <th>Контакт</th>
+        </tr>
+""")
+_SECTION_END = "    </table>\n"
+
+_ROW = _compile("""        <tr class="$row_class">
+            <td>$id</td>
+            <td>$name</td>
+            <td>$city</td>
+            <td>$experience</td>
+            <td>$score</td>
+            <td class="$status_class">$status</td>
+            <td>$created</td>
+            <td>$contact</td>
+        </tr>
+""")
+
+_TRUNCATED = _compile("""    <p>Показаны первые $shown из $total кандидатов$note.</p>
+""")
+
+_FOOT = """    <p><small>Отчёт сгенерирован автоматически ботом GWork HR</small></p>
+</body>
+</html>
+"""
+
+
+def report_counts(candidates: Iterable) -> Dict[str, int]:
+    """Статистика для шапки отчёта по списку кандидатов"""
+    counts = {"total": 0, "qualified": 0, "interview": 0, "rejected": 0}
+    for c in candidates:
+        counts["total"] += 1
+        status_class = _STATUS_CLASSES.get(c.status)
+        if status_class:
+            counts[status_class] += 1
+    return counts
+
+
+# Символы, которые escape заменяет: без них строка выводится как есть
+_HTML_SPECIAL = re.compile("[&<>\"']").search
+
+
+def _text(value) -> str:
+    # escape — пять replace на каждое значение; в большинстве полей заменять нечего
+    if value is None:
+        return ""
+    value = str(value)
+    return escape(value) if _HTML_SPECIAL(value) else value
+
+
+# Город и статус у кандидатов вакансии повторяются
+_repeated_text = lru_cache(maxsize=4096)(_text)
+
+
+@lru_cache(maxsize=4096)
+def _day_text(day: date) -> str:
+    # strftime — самая дорогая часть строки; у кандидатов вакансии дни повторяются
+    return day.strftime("%d.%m.%Y")
+
+
+def render_row(c, new_since: datetime) -> str:
+    """Строка таблицы по кандидату: объект Candidate или строка с колонками queries.EXPORT_COLUMNS"""
+    created_at = c.created_at
+    return _ROW.format(
+        row_class="new" if created_at and created_at >= new_since else "",
+        id=c.id,
+        name=_text(c.name_or_nick),
+        city=_repeated_text(c.city),
+        experience=_text((c.experience_text or "")[:50]),
+        score=c.score if c.score is not None else "",
+        status_class=_STATUS_CLASSES.get(c.status, ""),
+        status=_repeated_text(c.status),
+        created=_day_text(created_at.date()) if created_at else "",
+        contact=_text(c.contact),
+    )
+
+
+class HtmlReportRenderer:
+    """
+    Отчёт по частям: head() — шапка со статистикой, rows(пачка) — строки
+    кандидатов (разделы открываются и закрываются сами), tail() — конец документа.
+    counts — статистика шапки (total, qualified, interview, rejected).
+    max_rows ограничивает число строк (например, для тела письма): после него
+    full = True и rows() возвращает пустую строку; truncated_note дописывается
+    к пометке об обрезке.
+    """
+
+    def __init__(
+        self,
+        vacancy: Vacancy,
+        company: Company,
+        counts: Dict[str, int],
+        max_rows: Optional[int] = None,
+        section_size: int = HTML_SECTION_SIZE,
+        truncated_note: str = "",
+        now: Optional[datetime] = None,
+    ):
+        self.vacancy = vacancy
+        self.company = company
+        self.counts = counts
+        self.max_rows = max_rows
+        self.section_size = section_size
+        self.truncated_note = truncated_note
+        self.now = now or datetime.now()
+        self.new_since = self.now - NEW_CANDIDATE_AGE
+        self.shown = 0
+
+    @property
+    def full(self) -> bool:
+        return self.max_rows is not None and self.shown >= self.max_rows
+
+    def head(self) -> str:
+        return _HEAD.format(
+            role=_text(self.vacancy.role),
+            company=_text(self.company.name_and_industry),
+            city=_text(self.vacancy.city),
+            generated_at=self.now.strftime("%d.%m.%Y %H:%M"),
+            total=self.counts.get("total", 0),
+            qualified=self.counts.get("qualified", 0),
+            interview=self.counts.get("interview", 0),
+            rejected=self.counts.get("rejected", 0),
+        )
+
+    def _section_start(self) -> str:
+        last = self.shown + self.section_size
+        if self.max_rows is not None:
+            last = min(last, self.max_rows)
+        # total мог отстать от кандидатов, добавленных во время выгрузки
+        last = min(last, max(self.counts.get("total", 0), self.shown + 1))
+        return _SECTION_START.format(first=self.shown + 1, last=last)
+
+    def rows(self, chunk: Iterable) -> str:
+        parts = []
+        for c in chunk:
+            if self.full:
+                break
+            if self.shown % self.section_size == 0:
+                if self.shown:
+                    parts.append(_SECTION_END)
+                parts.append(self._section_start())
+            parts.append(render_row(c, self.new_since))
+            self.shown += 1
+        return "".join(parts)
+
+    def tail(self) -> str:
+        parts = [_SECTION_END] if self.shown else []
+        total = self.counts.get("total", 0)
+        if self.shown < total:
+            parts.append(_TRUNCATED.format(shown=self.shown, total=total, note=_text(self.truncated_note)))
+        parts.append(_FOOT)
+        return "".join(parts)
+
+
+def iter_html_report(renderer: HtmlReportRenderer, chunks: Iterable[Iterable]) -> Iterator[str]:
+    """Отчёт частями по пачкам кандидатов (в порядке вывода)"""
+    yield renderer.head()
+    for chunk in chunks:
+        if renderer.full:
+            break
+        part = renderer.rows(chunk)
+        if part:
+            yield part
+    yield renderer.tail()
@@ -0,0 +1,251 @@
+# migrations.py
+"""
+Версионные миграции схемы БД.
+
+Применённые миграции записываются в таблицу schema_version. При старте
+init_db() сравнивает максимальную применённую версию с последней в MIGRATIONS:
+если они совпадают, DDL не выполняется вообще.
+
+Новая миграция — функция migration_NNNN_<описание>(conn), добавленная в конец
+MIGRATIONS с номером на единицу больше предыдущего. Миграции не должны
+импортировать модели: схема в них фиксируется на момент написания.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION_TABLE = "schema_version"
+
+
+# ===== ПОМОЩНИКИ =====
+
+def _has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl_type: str) -> None:
+    """ALTER TABLE ... ADD COLUMN, если колонки ещё нет"""
+    if not _has_column(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+        logger.info(f"🧱 Добавлена колонка {table}.{column}")
+
+
+def _create_index(conn: Connection, name: str, table: str, columns: str) -> None:
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+# ===== МИГРАЦИИ =====
+
+def migration_0001_interview_slot_text(conn: Connection) -> None:
+    _add_column(conn, "candidates", "interview_slot_text", "VARCHAR(255)")
+
+
+def migration_0002_scoring_versions(conn: Connection) -> None:
+    _add_column(conn, "candidates", "scoring_hash", "VARCHAR(40)")
+    _add_column(conn, "candidates", "scored_config", "VARCHAR(64)")
+    _add_column(conn, "vacancies", "scoring_version", "INTEGER DEFAULT 1")
+    _add_column(conn, "companies", "scoring_version", "INTEGER DEFAULT 1")
+
+
+def migration_0003_score_breakdown(conn: Connection) -> None:
+    _add_column(conn, "candidates", "score_breakdown", "JSON")
+
+
+def migration_0004_query_indexes(conn: Connection) -> None:
+    _create_index(conn, "ix_candidates_vacancy_status", "candidates", "vacancy_id, status, created_at")
+    _create_index(conn, "ix_candidates_vacancy_score", "candidates", "vacancy_id, score, created_at")
+    _create_index(conn, "ix_candidates_vacancy_rejection", "candidates", "vacancy_id, rejection_reason")
+    _create_index(conn, "ix_candidates_vacancy_source", "candidates", "vacancy_id, source")
+    _create_index(conn, "ix_candidates_contact", "candidates", "contact")
+    _create_index(conn, "ix_vacancies_company_created", "vacancies", "company_id, created_at")
+
+
+PIPELINE_STATUSES = [
+    "found", "filtered", "invited", "answering", "interview", "no_show",
+    "offer", "rejected", "archive", "favorite", "clarify", "qualified",
+]
+
+
+def migration_0005_pipeline_counts(conn: Connection) -> None:
+    """Таблица счётчиков воронки и её заполнение по текущим кандидатам"""
+    counters = ["total", "score_top", "score_mid", *PIPELINE_STATUSES]
+    columns = ", ".join(f"{name} INTEGER NOT NULL DEFAULT 0" for name in counters)
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS vacancy_pipeline_counts ("
+        "vacancy_id INTEGER NOT NULL PRIMARY KEY REFERENCES vacancies (id), "
+        f"{columns})"
+    ))
+    sums = [
+        "COUNT(*)",
+        "SUM(CASE WHEN score >= 80 THEN 1 ELSE 0 END)",
+        "SUM(CASE WHEN score >= 60 AND score < 80 THEN 1 ELSE 0 END)",
+        # Пустой статус считается «found», как default колонки
+        "SUM(CASE WHEN status = 'found' OR status IS NULL THEN 1 ELSE 0 END)",
+        *(f"SUM(CASE WHEN status = '{status}' THEN 1 ELSE 0 END)" for status in PIPELINE_STATUSES[1:]),
+    ]
+    conn.execute(text("DELETE FROM vacancy_pipeline_counts"))
+    conn.execute(text(
+        f"INSERT INTO vacancy_pipeline_counts (vacancy_id, {', '.join(counters)}) "
+        f"SELECT vacancy_id, {', '.join(sums)} FROM candidates "
+        "WHERE vacancy_id IS NOT NULL GROUP BY vacancy_id"
+    ))
+
+
+def migration_0006_vacancy_archived_at(conn: Connection) -> None:
+    _add_column(conn, "vacancies", "archived_at", "TIMESTAMP")
+
+
+JSONB_COLUMNS = ("extracted_skills", "extracted_keywords", "red_flags")
+
+
+def migration_0007_jsonb_gin(conn: Connection) -> None:
+    """PostgreSQL: JSON-массивы кандидата → JSONB с GIN-индексами. В SQLite ничего не меняется"""
+    if conn.dialect.name != "postgresql":
+        return
+    for column in JSONB_COLUMNS:
+        conn.execute(text(
+            f"ALTER TABLE candidates ALTER COLUMN {column} TYPE JSONB USING {column}::jsonb"
+        ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_candidates_skills_gin ON candidates USING gin (extracted_skills)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_candidates_keywords_gin ON candidates USING gin (extracted_keywords)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_candidates_red_flags_gin ON candidates USING gin (red_flags)"))
+
+
+REPORT_INDEX_COLUMNS = (
+    "vacancy_id, source, created_at, score, status, last_message_at, last_reply_at, qualification_date"
+)
+
+
+def migration_0008_report_index(conn: Connection) -> None:
+    """Покрывающий индекс для отчёта /analytics вместо ix_candidates_vacancy_source (его префикс)"""
+    _create_index(conn, "ix_candidates_vacancy_report", "candidates", REPORT_INDEX_COLUMNS)
+    conn.execute(text("DROP INDEX IF EXISTS ix_candidates_vacancy_source"))
+
+
+def migration_0009_daily_rollups(conn: Connection) -> None:
+    """Таблица дневных агрегатов; заполнит её задача rollups.py при первом запуске"""
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS candidate_daily_rollups ("
+        "vacancy_id INTEGER NOT NULL REFERENCES vacancies (id), "
+        "day DATE NOT NULL, "
+        "source VARCHAR(64) NOT NULL, "
+        "status VARCHAR(32) NOT NULL, "
+        "company_id INTEGER NOT NULL REFERENCES companies (id), "
+        "candidates INTEGER NOT NULL DEFAULT 0, "
+        "score_top INTEGER NOT NULL DEFAULT 0, "
+        "PRIMARY KEY (vacancy_id, day, source, status))"
+    ))
+    _create_index(conn, "ix_rollups_company_day", "candidate_daily_rollups", "company_id, day")
+
+
+def migration_0010_status_events(conn: Connection) -> None:
+    """
+    Журнал смен статуса. История до миграции неизвестна: каждому кандидату
+    записывается одно событие создания (from_status = NULL) с текущим статусом.
+    Время этапов отчёт теперь берёт из журнала — индекс отчёта сужается
+    до колонок, которые он ещё читает
+    """
+    id_type = "SERIAL" if conn.dialect.name == "postgresql" else "INTEGER"
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS candidate_status_events ("
+        f"id {id_type} NOT NULL PRIMARY KEY, "
+        "candidate_id INTEGER NOT NULL, "
+        "vacancy_id INTEGER NOT NULL, "
+        "from_status VARCHAR(32), "
+        "to_status VARCHAR(32) NOT NULL, "
+        "created_at TIMESTAMP NOT NULL)"
+    ))
+    _create_index(
+        conn, "ix_status_events_vacancy_candidate", "candidate_status_events",
+        "vacancy_id, candidate_id, to_status, created_at, from_status",
+    )
+    conn.execute(text(
+        "INSERT INTO candidate_status_events (candidate_id, vacancy_id, from_status, to_status, created_at) "
+        "SELECT id, vacancy_id, NULL, status, COALESCE(created_at, CURRENT_TIMESTAMP) FROM candidates "
+        "WHERE NOT EXISTS (SELECT 1 FROM candidate_status_events)"
+    ))
+    conn.execute(text("DROP INDEX IF EXISTS ix_candidates_vacancy_report"))
+    _create_index(conn, "ix_candidates_vacancy_report", "candidates", "vacancy_id, source, created_at, score")
+
+
+MIGRATIONS: List[Tuple[int, Callable[[Connection], None]]] = [
+    (1, migration_0001_interview_slot_text),
+    (2, migration_0002_scoring_versions),
+    (3, migration_0003_score_breakdown),
+    (4, migration_0004_query_indexes),
+    (5, migration_0005_pipeline_counts),
+    (6, migration_0006_vacancy_archived_at),
+    (7, migration_0007_jsonb_gin),
+    (8, migration_0008_report_index),
+    (9, migration_0009_daily_rollups),
+    (10, migration_0010_status_events),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# ===== ЗАПУСК =====
+
+def _ensure_version_table(conn: Connection) -> None:
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR(255) NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def current_version(conn: Connection) -> int:
+    """Максимальная применённая версия (0 — миграций ещё не было)"""
+    if not inspect(conn).has_table(SCHEMA_VERSION_TABLE):
+        return 0
+    return conn.execute(text(f"SELECT MAX(version) FROM {SCHEMA_VERSION_TABLE}")).scalar() or 0
+
+
+def _record(conn: Connection, version: int, name: str) -> None:
+    conn.execute(
+        text(f"INSERT INTO {SCHEMA_VERSION_TABLE} (version, name, applied_at) VALUES (:v, :n, :t)"),
+        {"v": version, "n": name, "t": datetime.utcnow()},
+    )
+
+
+def stamp_latest(engine: Engine) -> None:
+    """
+    Помечает все миграции применёнными без выполнения.
+    Для новой БД, которую create_all уже создал по актуальным моделям.
+    """
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        applied = current_version(conn)
+        for version, migration in MIGRATIONS:
+            if version > applied:
+                _record(conn, version, migration.__name__)
+    logger.info(f"🧱 Новая БД: схема помечена версией {LATEST_VERSION}")
+
+
+def run_migrations(engine: Engine) -> int:
+    """
+    Применяет недостающие миграции по порядку, каждую в своей транзакции.
+    Возвращает количество применённых миграций.
+    """
+    with engine.connect() as conn:
+        applied = current_version(conn)
+    if applied >= LATEST_VERSION:
+        return 0
+
+    count = 0
+    for version, migration in MIGRATIONS:
+        if version <= applied:
+            continue
+        with engine.begin() as conn:
+            _ensure_version_table(conn)
+            migration(conn)
+            _record(conn, version, migration.__name__)
+        logger.info(f"🧱 Применена миграция {version}: {migration.__name__}")
+        count += 1
+    return count
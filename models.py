@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
 
 from sqlalchemy import (
@@ -11,9 +11,13 @@ from sqlalchemy import (
     ForeignKey,
     JSON,
     Float,
+    Index,
+    Date,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 
+from compression import CompressedJSON, CompressedText
 from db import Base
 
 
@@ -72,6 +76,9 @@ class Company(Base):
     
     report_frequency: Mapped[str | None] = mapped_column(String(20), nullable=True, default="never")
     """Частота отправки отчётов: daily, weekly, monthly, never"""
+    
+    scoring_version: Mapped[int] = mapped_column(Integer, default=1)
+    """Версия настроек компании, влияющих на скоринг (растёт при изменении фильтров)"""
 
     vacancies: Mapped[list["Vacancy"]] = relationship(
         "Vacancy", back_populates="company", cascade="all, delete-orphan"
@@ -80,6 +87,10 @@ class Company(Base):
 
 class Vacancy(Base):
     __tablename__ = "vacancies"
+    __table_args__ = (
+        # Последняя вакансия компании: WHERE company_id = ? ORDER BY created_at DESC
+        Index("ix_vacancies_company_created", "company_id", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     company_id: Mapped[int] = mapped_column(ForeignKey("companies.id"), index=True)
@@ -98,6 +109,12 @@ class Vacancy(Base):
     # Дата последнего поиска кандидатов
     last_search_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     """Дата последнего поиска кандидатов"""
+    
+    scoring_version: Mapped[int] = mapped_column(Integer, default=1)
+    """Версия требований вакансии: при изменении полей, влияющих на скоринг, увеличивается"""
+
+    archived_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    """Когда кандидаты вакансии перенесены в архив (archive.py); None — вакансия в основной БД"""
 
     company: Mapped[Company] = relationship("Company", back_populates="vacancies")
     candidates: Mapped[list["Candidate"]] = relationship(
@@ -168,23 +185,55 @@ class Payment(Base):
     completed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
 
+# JSON-массивы, по которым ищут вхождение элемента (sql_functions.json_array_contains):
+# в PostgreSQL — JSONB с GIN-индексом, в SQLite — обычный JSON
+JSON_ARRAY = JSON().with_variant(JSONB(), "postgresql")
+
+
+# Группа «тяжёлых» колонок кандидата (тексты и JSON). Они не читаются списочными
+# запросами; где нужны — загружать явно: .options(undefer_group(PAYLOAD_GROUP))
+# Самые большие из них (резюме, детали предквалификации) хранятся сжатыми:
+# CompressedText/CompressedJSON из compression.py
+PAYLOAD_GROUP = "payload"
+
+
 class Candidate(Base):
     __tablename__ = "candidates"
+    __table_args__ = (
+        # Индексы под реальные запросы (проверка планов: check_query_plans.py)
+        # Списки по статусу и воронка: WHERE vacancy_id = ? AND status = ? ORDER BY created_at DESC
+        Index("ix_candidates_vacancy_status", "vacancy_id", "status", "created_at"),
+        # Выдача по оценке: WHERE vacancy_id = ? ORDER BY score DESC, created_at DESC
+        Index("ix_candidates_vacancy_score", "vacancy_id", "score", "created_at"),
+        # Статистика отсева: GROUP BY rejection_reason
+        Index("ix_candidates_vacancy_rejection", "vacancy_id", "rejection_reason"),
+        # Статистика по источникам (GROUP BY source) и отчёт /analytics одним проходом:
+        # все читаемые отчётом колонки есть в индексе, строки с резюме не читаются
+        Index("ix_candidates_vacancy_report", "vacancy_id", "source", "created_at", "score"),
+        # Ответы кандидатов в Telegram: WHERE contact = '@username'
+        Index("ix_candidates_contact", "contact"),
+        # Поиск по навыкам и красным флагам (JSONB @>) — только в PostgreSQL
+        Index("ix_candidates_skills_gin", "extracted_skills", postgresql_using="gin").ddl_if(dialect="postgresql"),
+        Index("ix_candidates_keywords_gin", "extracted_keywords", postgresql_using="gin").ddl_if(dialect="postgresql"),
+        Index("ix_candidates_red_flags_gin", "red_flags", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     vacancy_id: Mapped[int] = mapped_column(ForeignKey("vacancies.id"), index=True)
     name_or_nick: Mapped[str] = mapped_column(String(255))
     contact: Mapped[str] = mapped_column(String(255))
     city: Mapped[str] = mapped_column(String(255))
-    experience_text: Mapped[str] = mapped_column(Text)
+    experience_text: Mapped[str] = mapped_column(CompressedText)
     skills_text: Mapped[str] = mapped_column(Text)
     source: Mapped[str] = mapped_column(String(64))
     source_link: Mapped[str] = mapped_column(String(512))
-    raw_text: Mapped[str] = mapped_column(Text)
-    score: Mapped[int] = mapped_column(Integer, default=0)
-    explanation: Mapped[str] = mapped_column(Text, default="")
+    raw_text: Mapped[str] = mapped_column(CompressedText, deferred=True, deferred_group=PAYLOAD_GROUP)
+    score: Mapped[int] = mapped_column(Integer, default=0, active_history=True)
+    explanation: Mapped[str] = mapped_column(CompressedText, default="")
+    score_breakdown: Mapped[list | None] = mapped_column(JSON, nullable=True)
+    """Компактная разбивка локальной оценки: [[критерий, баллы, аргумент], ...]"""
     status: Mapped[str] = mapped_column(
-        String(32), default=CandidateStatus.FOUND.value, index=True
+        String(32), default=CandidateStatus.FOUND.value, index=True, active_history=True
     )
     interview_slot_text: Mapped[str | None] = mapped_column(String(255), nullable=True)
     created_at: Mapped[datetime] = mapped_column(
@@ -193,13 +242,13 @@ class Candidate(Base):
     
     # ===== ПОЛЯ ДЛЯ АВТОМАТИЧЕСКОГО ДИАЛОГА =====
     dialog_step: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
-    last_reply: Mapped[str | None] = mapped_column(Text, nullable=True)
+    last_reply: Mapped[str | None] = mapped_column(Text, nullable=True, deferred=True, deferred_group=PAYLOAD_GROUP)
     last_reply_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
-    last_message_sent: Mapped[str | None] = mapped_column(Text, nullable=True)
+    last_message_sent: Mapped[str | None] = mapped_column(Text, nullable=True, deferred=True, deferred_group=PAYLOAD_GROUP)
     last_message_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     
     # ===== ПОЛЯ ДЛЯ ХРАНЕНИЯ СЛОТОВ И КАЛЕНДАРЯ =====
-    available_slots: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    available_slots: Mapped[dict | None] = mapped_column(JSON, nullable=True, deferred=True, deferred_group=PAYLOAD_GROUP)
     """Список доступных слотов для выбора (JSON)"""
     
     calendar_event_id: Mapped[str | None] = mapped_column(String(255), nullable=True)
@@ -227,17 +276,24 @@ class Candidate(Base):
     rejection_reason: Mapped[str | None] = mapped_column(Text, nullable=True)
     """Причина отсева фильтрами (если не прошёл)"""
     
+    # ===== ПОЛЯ ДЛЯ ИНКРЕМЕНТАЛЬНОГО ПЕРЕСЧЁТА =====
+    scoring_hash: Mapped[str | None] = mapped_column(String(40), nullable=True)
+    """Хэш входных данных скоринга на момент последней оценки"""
+    
+    scored_config: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    """Версия алгоритма и настроек вакансии/компании, с которыми посчитан score"""
+    
     # ===== ПОЛЯ ДЛЯ НОРМАЛИЗАЦИИ ДАННЫХ =====
     normalized_experience_level: Mapped[str | None] = mapped_column(String(20), nullable=True)
     """Уровень опыта: '0-1', '1-3', '3-5', '5+' """
     
-    extracted_skills: Mapped[list | None] = mapped_column(JSON, nullable=True)
+    extracted_skills: Mapped[list | None] = mapped_column(JSON_ARRAY, nullable=True)
     """Нормализованный список навыков (например: ['Python', 'SQL', 'Git'])"""
     
-    extracted_keywords: Mapped[list | None] = mapped_column(JSON, nullable=True)
+    extracted_keywords: Mapped[list | None] = mapped_column(JSON_ARRAY, nullable=True, deferred=True, deferred_group=PAYLOAD_GROUP)
     """Извлечённые ключевые слова из текста для анализа"""
     
-    red_flags: Mapped[list | None] = mapped_column(JSON, nullable=True)
+    red_flags: Mapped[list | None] = mapped_column(JSON_ARRAY, nullable=True)
     """Найденные красные флаги в тексте (список строк)"""
     
     # ===== ПОЛЯ ДЛЯ АНАЛИТИКИ =====
@@ -266,17 +322,17 @@ class Candidate(Base):
     qualification_score: Mapped[float | None] = mapped_column(Float, nullable=True)
     """Общий балл предквалификации (0-100)"""
     
-    qualification_details: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    qualification_details: Mapped[dict | None] = mapped_column(CompressedJSON, nullable=True, deferred=True, deferred_group=PAYLOAD_GROUP)
     """Детали предквалификации (анализ по категориям: график, зарплата, сроки, тон)"""
     
     qualification_date: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     """Дата проведения предквалификации"""
     
     # ===== ПОЛЯ ДЛЯ УЛУЧШЕННОЙ ПРЕДКВАЛИФИКАЦИИ =====
-    qualification_history: Mapped[list | None] = mapped_column(JSON, nullable=True)
+    qualification_history: Mapped[list | None] = mapped_column(CompressedJSON, nullable=True, deferred=True, deferred_group=PAYLOAD_GROUP)
     """История ответов кандидата для улучшенной предквалификации"""
     
-    extracted_keywords_from_answers: Mapped[list | None] = mapped_column(JSON, nullable=True)
+    extracted_keywords_from_answers: Mapped[list | None] = mapped_column(JSON, nullable=True, deferred=True, deferred_group=PAYLOAD_GROUP)
     """Ключевые слова, извлечённые из ответов кандидата"""
     
     # ===== ПОЛЯ ДЛЯ ДАТЫ ПУБЛИКАЦИИ И СТАТИСТИКИ =====
@@ -299,7 +355,92 @@ class Candidate(Base):
     calendar_updated_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     """Когда событие в календаре было обновлено"""
     
-    calendar_attendees: Mapped[list | None] = mapped_column(JSON, nullable=True)
+    calendar_attendees: Mapped[list | None] = mapped_column(JSON, nullable=True, deferred=True, deferred_group=PAYLOAD_GROUP)
     """Список участников события (email'ы)"""
 
     vacancy: Mapped[Vacancy] = relationship("Vacancy", back_populates="candidates")
+
+
+class VacancyPipelineCounts(Base):
+    """
+    Счётчики воронки по вакансии: одна строка на вакансию, колонка на статус.
+
+    Поддерживаются инкрементально в той же транзакции, что и изменения
+    кандидатов (pipeline.py), поэтому воронка читается одной строкой
+    независимо от числа кандидатов. Вручную не изменять.
+    """
+    __tablename__ = "vacancy_pipeline_counts"
+
+    vacancy_id: Mapped[int] = mapped_column(ForeignKey("vacancies.id"), primary_key=True)
+    total: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    score_top: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    """Кандидатов с оценкой 80+"""
+    score_mid: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    """Кандидатов с оценкой 60-79"""
+
+    found: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    filtered: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    invited: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    answering: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    interview: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    no_show: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    offer: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    rejected: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    archive: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    favorite: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    clarify: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    qualified: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+
+class CandidateDailyRollup(Base):
+    """
+    Дневные агрегаты кандидатов для аналитики компании: сколько кандидатов,
+    найденных в этот день из источника, сейчас в этом статусе.
+
+    Заполняется задачей rollups.py (пересчёт последних дней), аналитика компании
+    (/company_stats) читает только эти строки — их число зависит от дней, источников
+    и статусов, но не от числа кандидатов. Строки архивных вакансий не пересчитываются
+    и сохраняют историю. Вручную не изменять.
+    """
+    __tablename__ = "candidate_daily_rollups"
+    __table_args__ = (
+        # Аналитика компании за период: WHERE company_id = ? AND day >= ?
+        Index("ix_rollups_company_day", "company_id", "day"),
+    )
+
+    vacancy_id: Mapped[int] = mapped_column(ForeignKey("vacancies.id"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    source: Mapped[str] = mapped_column(String(64), primary_key=True)
+    status: Mapped[str] = mapped_column(String(32), primary_key=True)
+    company_id: Mapped[int] = mapped_column(ForeignKey("companies.id"))
+    candidates: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    score_top: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    """Из них с оценкой 80+"""
+
+
+class CandidateStatusEvent(Base):
+    """
+    Журнал смен статуса кандидатов (только добавление).
+
+    Пишется в той же транзакции, что и смена статуса (pipeline.py): при создании
+    кандидата — событие с from_status = NULL, дальше — каждый переход. Строки
+    не удаляются вместе с кандидатом (архивация, удаление), поэтому воронка
+    «сколько кандидатов дошло до этапа» и время до этапа считаются по истории.
+    """
+    __tablename__ = "candidate_status_events"
+    __table_args__ = (
+        # Воронка и время до этапа по вакансии: WHERE vacancy_id = ? GROUP BY candidate_id —
+        # покрывающий индекс, строки журнала не читаются
+        Index(
+            "ix_status_events_vacancy_candidate",
+            "vacancy_id", "candidate_id", "to_status", "created_at", "from_status",
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # Без внешнего ключа: история остаётся после архивации и удаления кандидата
+    candidate_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    vacancy_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    from_status: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    to_status: Mapped[str] = mapped_column(String(32), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
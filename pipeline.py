@@ -0,0 +1,316 @@
+# pipeline.py
+"""
+Статусы кандидатов и счётчики воронки по вакансиям.
+
+Статус кандидата меняется через set_candidate_status(). Счётчики в таблице
+vacancy_pipeline_counts поддерживаются в той же транзакции:
+— изменения ORM-объектов (новые, изменённые, удалённые кандидаты) учитываются
+  обработчиком before_flush автоматически;
+— пакетные INSERT/UPDATE в обход ORM (queries.bulk_*, bulk_set_status) передают
+  изменения явно через apply_pipeline_deltas().
+
+Каждая смена статуса (и создание кандидата) дописывается в журнал
+candidate_status_events теми же путями: ORM — обработчиком after_flush,
+пакетные операции — через record_status_events(). По журналу считаются
+воронка «дошли до этапа» и время до этапа (get_funnel_stats).
+
+Чтение воронки — get_pipeline_counts(): одна строка по первичному ключу.
+"""
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, case, event, func, insert, inspect, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from analytics_cache import mark_vacancies_changed
+from models import Candidate, CandidateStatus, CandidateStatusEvent, VacancyPipelineCounts
+from sql_functions import hours_between
+
+logger = logging.getLogger(__name__)
+
+COUNTS_TABLE = VacancyPipelineCounts.__table__
+COUNTER_KEYS = [c.name for c in COUNTS_TABLE.columns if c.name != "vacancy_id"]
+EVENTS_TABLE = CandidateStatusEvent.__table__
+
+# Изменения счётчиков: vacancy_id → {колонка: приращение}
+PipelineDeltas = Dict[int, Counter]
+
+
+# ===== СМЕНА СТАТУСА =====
+
+def set_candidate_status(candidate: Candidate, status: CandidateStatus | str) -> None:
+    """Единая точка смены статуса кандидата; счётчики обновятся при flush"""
+    candidate.status = status.value if isinstance(status, CandidateStatus) else status
+
+
+def bulk_set_status(session: Session, candidate_ids: List[int], status: CandidateStatus | str) -> int:
+    """
+    Пакетная смена статуса одним UPDATE со счётчиками в той же транзакции.
+    Для AsyncSession: await session.run_sync(bulk_set_status, ids, status).
+    """
+    if not candidate_ids:
+        return 0
+    status = status.value if isinstance(status, CandidateStatus) else status
+    connection = session.connection()
+    rows = connection.execute(
+        select(Candidate.id, Candidate.vacancy_id, Candidate.status, Candidate.score)
+        .where(Candidate.id.in_(candidate_ids))
+    ).all()
+    connection.execute(
+        update(Candidate.__table__)
+        .where(Candidate.__table__.c.id.in_(candidate_ids))
+        .values(status=status)
+    )
+    deltas: PipelineDeltas = defaultdict(Counter)
+    for _, vacancy_id, old_status, score in rows:
+        _count(deltas, vacancy_id, old_status, score, -1)
+        _count(deltas, vacancy_id, status, score, +1)
+    apply_pipeline_deltas(connection, deltas)
+    record_status_events(connection, [
+        (candidate_id, vacancy_id, old_status, status) for candidate_id, vacancy_id, old_status, _ in rows
+    ])
+    mark_vacancies_changed(session, {vacancy_id for _, vacancy_id, _, _ in rows})
+    return len(rows)
+
+
+# ===== ИЗМЕНЕНИЯ СЧЁТЧИКОВ =====
+
+def _score_bucket(score: Optional[int]) -> Optional[str]:
+    score = score or 0
+    if score >= 80:
+        return "score_top"
+    if score >= 60:
+        return "score_mid"
+    return None
+
+
+def _count(
+    deltas: PipelineDeltas,
+    vacancy_id: Optional[int],
+    status: Optional[str],
+    score: Optional[int],
+    sign: int,
+) -> None:
+    """Учитывает одного кандидата (sign=+1) или его исключение (sign=-1)"""
+    if vacancy_id is None:
+        return
+    counter = deltas[vacancy_id]
+    counter["total"] += sign
+    status = status or CandidateStatus.FOUND.value
+    if status in COUNTER_KEYS:
+        counter[status] += sign
+    bucket = _score_bucket(score)
+    if bucket:
+        counter[bucket] += sign
+
+
+def candidates_deltas(candidates: Iterable[Candidate], sign: int = 1) -> PipelineDeltas:
+    """Изменения счётчиков от добавления (или удаления) кандидатов с текущими значениями"""
+    deltas: PipelineDeltas = defaultdict(Counter)
+    for c in candidates:
+        _count(deltas, c.vacancy_id, c.status, c.score, sign)
+    return deltas
+
+
+def transition_deltas(previous: Iterable[Tuple[int, str, int]], candidates: Iterable[Candidate]) -> PipelineDeltas:
+    """
+    Изменения счётчиков от пакетного обновления:
+    previous — (vacancy_id, status, score) до обновления, candidates — после.
+    """
+    deltas: PipelineDeltas = defaultdict(Counter)
+    for vacancy_id, status, score in previous:
+        _count(deltas, vacancy_id, status, score, -1)
+    for c in candidates:
+        _count(deltas, c.vacancy_id, c.status, c.score, +1)
+    return deltas
+
+
+def _upsert(connection: Connection, vacancy_id: int, delta: Dict[str, int]):
+    """INSERT ... ON CONFLICT DO UPDATE col = col + delta (SQLite и PostgreSQL)"""
+    values = {"vacancy_id": vacancy_id, **{key: max(delta.get(key, 0), 0) for key in COUNTER_KEYS}}
+    increments = {key: COUNTS_TABLE.c[key] + value for key, value in delta.items()}
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(COUNTS_TABLE).values(values).on_conflict_do_update(
+        index_elements=[COUNTS_TABLE.c.vacancy_id], set_=increments
+    )
+
+
+def apply_pipeline_deltas(connection: Connection, deltas: PipelineDeltas) -> None:
+    """Применяет изменения счётчиков в текущей транзакции соединения"""
+    for vacancy_id, delta in deltas.items():
+        delta = {key: value for key, value in delta.items() if value}
+        if delta:
+            connection.execute(_upsert(connection, vacancy_id, delta))
+
+
+# ===== АВТОМАТИЧЕСКИЙ УЧЁТ ORM-ИЗМЕНЕНИЙ =====
+
+def _previous(candidate: Candidate) -> Tuple[Optional[int], Optional[str], Optional[int]]:
+    """(vacancy_id, status, score) кандидата до несохранённых изменений"""
+    state = inspect(candidate)
+    values = []
+    for key in ("vacancy_id", "status", "score"):
+        history = state.attrs[key].history
+        if history.deleted:
+            values.append(history.deleted[0])
+        elif history.unchanged:
+            values.append(history.unchanged[0])
+        else:
+            values.append(getattr(candidate, key))
+    return values[0], values[1], values[2]
+
+
+@event.listens_for(Session, "before_flush")
+def _track_candidate_changes(session: Session, flush_context, instances) -> None:
+    deltas: PipelineDeltas = defaultdict(Counter)
+    for obj in session.new:
+        if isinstance(obj, Candidate):
+            _count(deltas, obj.vacancy_id, obj.status, obj.score, +1)
+    for obj in session.deleted:
+        if isinstance(obj, Candidate):
+            _count(deltas, *_previous(obj), -1)
+    for obj in session.dirty:
+        if not isinstance(obj, Candidate):
+            continue
+        state = inspect(obj)
+        if not any(state.attrs[key].history.has_changes() for key in ("vacancy_id", "status", "score")):
+            continue
+        _count(deltas, *_previous(obj), -1)
+        _count(deltas, obj.vacancy_id, obj.status, obj.score, +1)
+    if any(any(counter.values()) for counter in deltas.values()):
+        apply_pipeline_deltas(session.connection(), deltas)
+
+
+# ===== ЖУРНАЛ СМЕН СТАТУСА =====
+
+# (candidate_id, vacancy_id, from_status, to_status); from_status = None — создание кандидата
+StatusEvent = Tuple[int, int, Optional[str], str]
+
+
+def record_status_events(connection: Connection, events: Iterable[StatusEvent]) -> None:
+    """Дописывает смены статуса в журнал одним executemany в текущей транзакции"""
+    now = datetime.utcnow()
+    rows = [
+        {
+            "candidate_id": candidate_id,
+            "vacancy_id": vacancy_id,
+            "from_status": from_status,
+            "to_status": to_status,
+            "created_at": now,
+        }
+        for candidate_id, vacancy_id, from_status, to_status in events
+        if from_status != to_status
+    ]
+    if rows:
+        connection.execute(insert(EVENTS_TABLE), rows)
+
+
+@event.listens_for(Session, "after_flush")
+def _log_status_changes(session: Session, flush_context) -> None:
+    # after_flush: у новых кандидатов уже есть id, а история атрибутов ещё не сброшена
+    events: List[StatusEvent] = []
+    for obj in session.new:
+        if isinstance(obj, Candidate):
+            events.append((obj.id, obj.vacancy_id, None, obj.status))
+    for obj in session.dirty:
+        if not isinstance(obj, Candidate):
+            continue
+        history = inspect(obj).attrs.status.history
+        if history.added and history.deleted:
+            events.append((obj.id, obj.vacancy_id, history.deleted[0], history.added[0]))
+    if events:
+        record_status_events(session.connection(), events)
+
+
+# ===== ЧТЕНИЕ =====
+
+def get_pipeline_counts(session: Session, vacancy_id: int) -> Dict[str, int]:
+    """Счётчики воронки вакансии одной строкой: total, score_top, score_mid и по статусам"""
+    row = session.execute(
+        select(COUNTS_TABLE).where(COUNTS_TABLE.c.vacancy_id == vacancy_id)
+    ).first()
+    if row is None:
+        return {key: 0 for key in COUNTER_KEYS}
+    return {key: int(row._mapping[key] or 0) for key in COUNTER_KEYS}
+
+
+# ===== ВОРОНКА ПО ЖУРНАЛУ =====
+
+# Этапы воронки по порядку. Кандидат «дошёл до этапа», если хоть раз был
+# в статусе этого этапа или более позднего (глубина статуса ниже)
+FUNNEL_STAGES = [
+    CandidateStatus.FOUND.value,
+    CandidateStatus.FILTERED.value,
+    CandidateStatus.INVITED.value,
+    CandidateStatus.ANSWERING.value,
+    CandidateStatus.QUALIFIED.value,
+    CandidateStatus.INTERVIEW.value,
+]
+STATUS_DEPTH = {
+    CandidateStatus.FOUND.value: 0,
+    CandidateStatus.FILTERED.value: 1,
+    CandidateStatus.INVITED.value: 2,
+    CandidateStatus.ANSWERING.value: 3,
+    CandidateStatus.CLARIFY.value: 3,
+    CandidateStatus.QUALIFIED.value: 4,
+    CandidateStatus.INTERVIEW.value: 5,
+    CandidateStatus.NO_SHOW.value: 5,
+    CandidateStatus.OFFER.value: 6,
+}
+# Время до этапа: ключ → (статус этапа, от какого статуса считать; None — от создания кандидата)
+STAGE_TIMINGS = {
+    "avg_invite_time": (CandidateStatus.INVITED.value, None),
+    "avg_response_time": (CandidateStatus.ANSWERING.value, CandidateStatus.INVITED.value),
+    "avg_qualify_time": (CandidateStatus.QUALIFIED.value, CandidateStatus.ANSWERING.value),
+}
+
+
+def funnel_select(vacancy_id: int):
+    """
+    Воронка и время до этапов по журналу одним запросом. Внутренний GROUP BY
+    candidate_id идёт по покрывающему индексу ix_status_events_vacancy_candidate:
+    глубина кандидата, время создания и первого перехода в каждый этап.
+    События создания (from_status = NULL) не считаются переходом в этап —
+    в том числе события, восстановленные миграцией для старых кандидатов.
+    """
+    ev = EVENTS_TABLE.c
+    stage_statuses = {status for stage in STAGE_TIMINGS.values() for status in stage if status}
+    per_candidate = select(
+        ev.candidate_id,
+        func.max(case(STATUS_DEPTH, value=ev.to_status)).label("depth"),
+        func.min(ev.created_at).label("started_at"),
+        *[
+            func.min(case((and_(ev.to_status == status, ev.from_status.isnot(None)), ev.created_at))).label(f"{status}_at")
+            for status in sorted(stage_statuses)
+        ],
+    ).where(ev.vacancy_id == vacancy_id).group_by(ev.candidate_id).subquery()
+
+    columns = [func.count().label(FUNNEL_STAGES[0])]
+    for depth, stage in enumerate(FUNNEL_STAGES[1:], start=1):
+        columns.append(func.count(case((per_candidate.c.depth >= depth, 1))).label(stage))
+    for key, (status, since) in STAGE_TIMINGS.items():
+        started = per_candidate.c[f"{since}_at"] if since else per_candidate.c.started_at
+        columns.append(func.avg(hours_between(per_candidate.c[f"{status}_at"], started)).label(key))
+    return select(*columns).select_from(per_candidate)
+
+
+def get_funnel_stats(session: Session, vacancy_id: int) -> Dict[str, Dict]:
+    """
+    По журналу смен статуса: reached — сколько кандидатов дошли до каждого этапа
+    (FUNNEL_STAGES), timings — среднее время до этапа в часах (None — нет данных)
+    """
+    row = session.execute(funnel_select(vacancy_id)).one()._mapping
+    timings = {}
+    for key in STAGE_TIMINGS:
+        hours = row[key]
+        timings[key] = round(float(hours), 1) if hours else None
+    return {
+        "reached": {stage: int(row[stage] or 0) for stage in FUNNEL_STAGES},
+        "timings": timings,
+    }
@@ -0,0 +1,216 @@
+# queries.py
+"""
+Запросы для списков и страниц кандидатов и пакетная запись.
+
+Счётчики читаются одной строкой из счётчиков воронки (pipeline.py), полные строки кандидатов
+(с «тяжёлыми» колонками группы PAYLOAD_GROUP) загружаются только для
+текущей страницы. Функции принимают сессию, поэтому их можно вызывать
+и из бота, и из бенчмарков на отдельной БД.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session, undefer_group
+
+from analytics_cache import mark_vacancies_changed
+from models import PAYLOAD_GROUP, Candidate, CandidateStatus
+from pipeline import (
+    apply_pipeline_deltas,
+    candidates_deltas,
+    get_pipeline_counts,
+    record_status_events,
+    transition_deltas,
+)
+
+
+def vacancy_candidate_counts(session: Session, vacancy_id: int) -> Dict[str, int]:
+    """Сводка по вакансии (всего, по оценке, по статусам) из счётчиков воронки — одна строка"""
+    pipeline = get_pipeline_counts(session, vacancy_id)
+    counts = {
+        "total": pipeline["total"],
+        "top": pipeline["score_top"],
+        "mid": pipeline["score_mid"],
+        "rest": pipeline["total"] - pipeline["score_top"] - pipeline["score_mid"],
+        "rejected": pipeline[CandidateStatus.REJECTED.value],
+        "clarify": pipeline[CandidateStatus.CLARIFY.value],
+        "qualified": pipeline[CandidateStatus.QUALIFIED.value],
+    }
+    counts["payable"] = counts["total"] - counts["rejected"]
+    return counts
+
+
+def payable_candidates_select(vacancy_id: int):
+    """Кандидаты, доступные для показа (без отсеянных), лучшие первыми"""
+    return (
+        select(Candidate)
+        .where(Candidate.vacancy_id == vacancy_id, Candidate.status != CandidateStatus.REJECTED.value)
+        .order_by(Candidate.score.desc(), Candidate.created_at.desc())
+    )
+
+
+def count_payable_candidates(session: Session, vacancy_id: int) -> int:
+    return vacancy_candidate_counts(session, vacancy_id)["payable"]
+
+
+def get_candidates_page(
+    session: Session,
+    vacancy_id: int,
+    page: int,
+    per_page: int = 5,
+    max_candidates: Optional[int] = None,
+) -> Tuple[List[Candidate], int, int, Dict[str, int]]:
+    """
+    Страница кандидатов для показа карточками.
+
+    Возвращает (кандидаты страницы, номер страницы после нормализации,
+    всего доступно к показу с учётом max_candidates, сводные счётчики).
+    """
+    counts = vacancy_candidate_counts(session, vacancy_id)
+    available = counts["payable"]
+    if max_candidates is not None:
+        available = min(available, max_candidates)
+    if available == 0:
+        return [], 0, 0, counts
+
+    total_pages = (available + per_page - 1) // per_page
+    page = max(0, min(page, total_pages - 1))
+    offset = page * per_page
+    limit = min(per_page, available - offset)
+
+    page_cands = session.scalars(
+        payable_candidates_select(vacancy_id)
+        .options(undefer_group(PAYLOAD_GROUP))
+        .offset(offset)
+        .limit(limit)
+    ).all()
+    return list(page_cands), page, available, counts
+
+
+# ===== ВЫГРУЗКА =====
+
+# Колонки кандидата для выгрузки (CSV, XLSX): без резюме и истории диалога
+EXPORT_COLUMNS = (
+    Candidate.id,
+    Candidate.name_or_nick,
+    Candidate.city,
+    Candidate.experience_text,
+    Candidate.skills_text,
+    Candidate.source,
+    Candidate.score,
+    Candidate.explanation,
+    Candidate.score_breakdown,
+    Candidate.status,
+    Candidate.created_at,
+    Candidate.contact,
+    Candidate.qualification_score,
+    Candidate.experience_years,
+    Candidate.salary_expectations,
+)
+EXPORT_CHUNK_SIZE = 1000
+
+
+def export_chunk_select(vacancy_id: int, after_id: int = 0, limit: int = EXPORT_CHUNK_SIZE):
+    """
+    Очередная пачка строк для выгрузки: keyset по id (WHERE id > after_id),
+    поэтому каждая пачка — короткий запрос по индексу, без OFFSET
+    """
+    return (
+        select(*EXPORT_COLUMNS)
+        .where(Candidate.vacancy_id == vacancy_id, Candidate.id > after_id)
+        .order_by(Candidate.id)
+        .limit(limit)
+    )
+
+
+# ===== ПАКЕТНАЯ ЗАПИСЬ =====
+
+_CANDIDATE_COLUMNS = [c for c in Candidate.__table__.columns if not c.primary_key]
+_CANDIDATE_DEFAULTS = [c for c in _CANDIDATE_COLUMNS if c.default is not None]
+
+# Поля, которые выставляет скоринг (для пакетного UPDATE по первичному ключу)
+SCORING_FIELDS = (
+    "score",
+    "score_breakdown",
+    "explanation",
+    "keyword_match_percentage",
+    "status",
+    "rejection_reason",
+    "scoring_hash",
+    "scored_config",
+)
+
+
+def _column_default(column):
+    default = column.default
+    if default is None:
+        return None
+    if default.is_callable:
+        return default.arg(None)
+    return default.arg
+
+
+def _insert_row(candidate: Candidate) -> dict:
+    """
+    Значения всех колонок нового кандидата: в executemany у всех строк должен
+    быть одинаковый набор ключей. Незаданные поля с default получают его
+    и на объекте, как после обычного flush.
+    """
+    state = candidate.__dict__
+    for column in _CANDIDATE_DEFAULTS:
+        if column.key not in state:
+            setattr(candidate, column.key, _column_default(column))
+    return {column.key: state.get(column.key) for column in _CANDIDATE_COLUMNS}
+
+
+def bulk_insert_candidates(session: Session, candidates: List[Candidate]) -> List[int]:
+    """
+    Вставляет новых (transient) кандидатов пакетным INSERT ... RETURNING id
+    (insertmanyvalues) и проставляет им id. Объекты остаются вне сессии.
+
+    sort_by_parameter_order не используем: на SQLite он вырождается в INSERT
+    на каждую строку. Id одного пакета в одной транзакции выдаются по
+    возрастанию в порядке строк, поэтому отсортированные id совпадают с порядком
+    кандидатов.
+    """
+    if not candidates:
+        return []
+    ids = sorted(session.scalars(
+        insert(Candidate).returning(Candidate.id),
+        [_insert_row(c) for c in candidates],
+    ).all())
+    for candidate, candidate_id in zip(candidates, ids):
+        candidate.id = candidate_id
+    apply_pipeline_deltas(session.connection(), candidates_deltas(candidates))
+    record_status_events(session.connection(), [(c.id, c.vacancy_id, None, c.status) for c in candidates])
+    mark_vacancies_changed(session, {c.vacancy_id for c in candidates})
+    return ids
+
+
+def bulk_update_candidates(session: Session, candidates: Iterable[Candidate], fields: Iterable[str]) -> int:
+    """Пакетный UPDATE указанных полей по первичному ключу (один executemany)"""
+    candidates = list(candidates)
+    fields = tuple(fields)
+    rows = [{"id": c.id, **{field: getattr(c, field) for field in fields}} for c in candidates]
+    if not rows:
+        return 0
+    # Значения до UPDATE нужны счётчикам воронки (vacancy_id, статус, оценка) и журналу смен статуса
+    previous = None
+    if {"vacancy_id", "status", "score"} & set(fields):
+        previous = session.execute(
+            select(Candidate.id, Candidate.vacancy_id, Candidate.status, Candidate.score)
+            .where(Candidate.id.in_([c.id for c in candidates]))
+        ).all()
+    session.execute(update(Candidate), rows)
+    if previous is not None:
+        apply_pipeline_deltas(
+            session.connection(),
+            transition_deltas([(vacancy_id, status, score) for _, vacancy_id, status, score in previous], candidates),
+        )
+        if "status" in fields:
+            old_status = {candidate_id: status for candidate_id, _, status, _ in previous}
+            record_status_events(
+                session.connection(),
+                [(c.id, c.vacancy_id, old_status.get(c.id), c.status) for c in candidates],
+            )
+    mark_vacancies_changed(session, {c.vacancy_id for c in candidates} | {row[1] for row in previous or ()})
+    return len(rows)
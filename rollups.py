@@ -0,0 +1,206 @@
+# rollups.py
+"""
+Дневные агрегаты кандидатов (candidate_daily_rollups) для аналитики компании.
+
+Задача пересчитывает строки (компания, вакансия, день, источник, статус) →
+число кандидатов одним INSERT ... SELECT с GROUP BY. Пересчитываются
+последние settings.rollup_window_days дней, а из более старых — только дни,
+в которые пришли кандидаты, сменившие статус за это окно (по журналу
+candidate_status_events). Если таблица пуста (первый запуск) — вся история.
+Кандидаты архивных вакансий уже не в основной БД, поэтому их строки
+не пересчитываются и остаются историей; перед архивацией вакансии её агрегаты
+пересчитываются полностью (archive.py).
+
+Аналитика компании (company_rollup_stats) читает только агрегаты: время
+не зависит от числа кандидатов, только от длины периода.
+
+Запуск вручную:
+    python rollups.py [дней]  — пересчитать последние дни (по умолчанию из настроек)
+    python rollups.py rebuild — пересобрать всю историю неархивных вакансий
+Бот пересчитывает агрегаты сам раз в settings.rollup_interval_hours.
+"""
+import logging
+import sys
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import case, delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from config import settings
+from db import get_session
+from models import Candidate, CandidateDailyRollup, CandidateStatusEvent, Vacancy
+from sql_functions import day_of
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS_TABLE = CandidateDailyRollup.__table__
+_ROLLUP_COLUMNS = ["company_id", "vacancy_id", "day", "source", "status", "candidates", "score_top"]
+
+
+# ===== ПЕРЕСЧЁТ =====
+
+def _rollup_select(since: Optional[datetime], vacancy_ids: Optional[Iterable[int]], *conditions):
+    """GROUP BY по кандидатам: строки для candidate_daily_rollups; conditions — доп. фильтры WHERE"""
+    day = day_of(Candidate.created_at)
+    stmt = (
+        select(
+            Vacancy.company_id,
+            Candidate.vacancy_id,
+            day,
+            Candidate.source,
+            Candidate.status,
+            func.count(),
+            func.count(case((Candidate.score >= 80, 1))),
+        )
+        .join(Vacancy, Vacancy.id == Candidate.vacancy_id)
+        .where(*conditions)
+        .group_by(Vacancy.company_id, Candidate.vacancy_id, day, Candidate.source, Candidate.status)
+    )
+    if since is not None:
+        stmt = stmt.where(Candidate.created_at >= since)
+    if vacancy_ids is None:
+        stmt = stmt.where(Vacancy.archived_at.is_(None))
+    else:
+        stmt = stmt.where(Candidate.vacancy_id.in_(vacancy_ids))
+    return stmt
+
+
+def refresh_rollups(session: Session, days: Optional[int] = None, vacancy_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Пересчитывает агрегаты за последние days дней (None — settings.rollup_window_days,
+    0 — вся история) в транзакции сессии. vacancy_ids — только эти вакансии
+    (в том числе архивируемые); по умолчанию все неархивные.
+    Возвращает число записанных строк агрегатов.
+    """
+    days = settings.rollup_window_days if days is None else days
+    if vacancy_ids is not None:
+        vacancy_ids = list(vacancy_ids)
+    is_empty = session.scalar(select(ROLLUPS_TABLE.c.vacancy_id).limit(1)) is None
+    since = None
+    if days > 0 and not is_empty:
+        since = datetime.combine(date.today() - timedelta(days=days), time.min)
+
+    stale = delete(ROLLUPS_TABLE)
+    if since is not None:
+        stale = stale.where(ROLLUPS_TABLE.c.day >= since.date())
+    if vacancy_ids is None:
+        stale = stale.where(ROLLUPS_TABLE.c.vacancy_id.in_(select(Vacancy.id).where(Vacancy.archived_at.is_(None))))
+    else:
+        stale = stale.where(ROLLUPS_TABLE.c.vacancy_id.in_(vacancy_ids))
+    session.execute(stale)
+
+    result = session.execute(
+        insert(ROLLUPS_TABLE).from_select(_ROLLUP_COLUMNS, _rollup_select(since, vacancy_ids))
+    )
+    written = result.rowcount
+    if since is not None:
+        written += _refresh_status_changed(session, since, vacancy_ids)
+    return written
+
+
+def _refresh_status_changed(session: Session, since: datetime, vacancy_ids: Optional[list]) -> int:
+    """
+    Дни до окна, в которые пришли кандидаты, сменившие статус после since:
+    их строки агрегатов устарели (отчёт компании берёт период длиннее окна).
+    Пересчитываются целиком дни × вакансии таких кандидатов.
+    """
+    changed = select(CandidateStatusEvent.candidate_id).where(
+        CandidateStatusEvent.created_at >= since,
+        CandidateStatusEvent.from_status.is_not(None),
+    )
+    if vacancy_ids is not None:
+        changed = changed.where(CandidateStatusEvent.vacancy_id.in_(vacancy_ids))
+    day = day_of(Candidate.created_at)
+    touched = session.execute(
+        select(Candidate.vacancy_id, day).distinct()
+        .where(Candidate.created_at < since, Candidate.id.in_(changed))
+    ).all()
+    if not touched:
+        return 0
+
+    touched_vacancies = sorted({vacancy_id for vacancy_id, _ in touched})
+    touched_days = sorted({d for _, d in touched})
+    session.execute(
+        delete(ROLLUPS_TABLE)
+        .where(ROLLUPS_TABLE.c.vacancy_id.in_(touched_vacancies), ROLLUPS_TABLE.c.day.in_(touched_days))
+    )
+    result = session.execute(
+        insert(ROLLUPS_TABLE).from_select(_ROLLUP_COLUMNS, _rollup_select(
+            None, touched_vacancies, Candidate.created_at < since, day.in_(touched_days),
+        ))
+    )
+    return result.rowcount
+
+
+def refresh_all_rollups(days: Optional[int] = None) -> int:
+    """Пересчёт агрегатов в отдельной транзакции (для планировщика и запуска вручную)"""
+    with get_session() as session:
+        written = refresh_rollups(session, days)
+    logger.info(f"📈 Дневные агрегаты пересчитаны: строк {written}")
+    return written
+
+
+# ===== ЧТЕНИЕ =====
+
+def company_rollup_stats(session: Session, company_id: int, days: int = 90) -> Dict:
+    """
+    Аналитика компании за последние days дней только по агрегатам:
+    итоги, по вакансиям, источникам, статусам и месяцам
+    """
+    since = date.today() - timedelta(days=days)
+    period = (ROLLUPS_TABLE.c.company_id == company_id, ROLLUPS_TABLE.c.day >= since)
+    candidates = func.sum(ROLLUPS_TABLE.c.candidates)
+    score_top = func.sum(ROLLUPS_TABLE.c.score_top)
+
+    groups = session.execute(
+        select(ROLLUPS_TABLE.c.vacancy_id, ROLLUPS_TABLE.c.source, ROLLUPS_TABLE.c.status, candidates, score_top)
+        .where(*period)
+        .group_by(ROLLUPS_TABLE.c.vacancy_id, ROLLUPS_TABLE.c.source, ROLLUPS_TABLE.c.status)
+    ).all()
+    daily = session.execute(
+        select(ROLLUPS_TABLE.c.day, candidates).where(*period).group_by(ROLLUPS_TABLE.c.day)
+    ).all()
+    roles = dict(session.execute(select(Vacancy.id, Vacancy.role).where(Vacancy.company_id == company_id)).all())
+
+    by_vacancy: Dict[int, Dict] = {}
+    by_source: Dict[str, int] = defaultdict(int)
+    by_status: Dict[str, int] = defaultdict(int)
+    total = total_top = 0
+    for vacancy_id, source, status, count, top in groups:
+        vacancy = by_vacancy.setdefault(
+            vacancy_id, {"role": roles.get(vacancy_id, f"#{vacancy_id}"), "candidates": 0, "score_top": 0}
+        )
+        vacancy["candidates"] += count
+        vacancy["score_top"] += top
+        by_source[source] += count
+        by_status[status] += count
+        total += count
+        total_top += top
+
+    by_month: Dict[str, int] = {}
+    for day, count in sorted(daily):
+        month = day.strftime("%m.%Y")
+        by_month[month] = by_month.get(month, 0) + count
+
+    return {
+        "total": total,
+        "score_top": total_top,
+        "by_vacancy": by_vacancy,
+        "by_source": dict(by_source),
+        "by_status": dict(by_status),
+        "by_month": by_month,
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    arg = sys.argv[1] if len(sys.argv) > 1 else None
+    if arg == "rebuild":
+        print(f"📈 Агрегаты пересобраны: строк {refresh_all_rollups(0)}")
+    elif arg is None or arg.isdigit():
+        print(f"📈 Агрегаты пересчитаны: строк {refresh_all_rollups(int(arg) if arg else None)}")
+    else:
+        print("Использование: python rollups.py [дней] | rebuild")
+        sys.exit(1)
@@ -0,0 +1,330 @@
+# scoring.py
+import hashlib
+import json
+import logging
+from typing import List, Tuple
+
+from config import settings
+from filters import get_vacancy_profile
+from models import Candidate, Vacancy, Company
+
+logger = logging.getLogger(__name__)
+
+# Версия алгоритма локального скоринга: увеличивать при изменении весов/критериев,
+# чтобы /recalculate пересчитал всех кандидатов
+SCORING_ALGORITHM_VERSION = 3
+
+
+# ===== ЛОКАЛЬНЫЙ СКОРИНГ =====
+
+# Базовая оценка при поиске: прежний запасной скоринг поиска (без DeepSeek)
+# начинал с 50, и пороги 60/80 для найденных кандидатов рассчитаны на эту шкалу
+SEARCH_BASE_SCORE = 50
+
+
+def calculate_candidate_score(
+    candidate: Candidate, vacancy: Vacancy, company: Company, relevance: float | None = None, base: int = 0
+) -> tuple:
+    """
+    Улучшенный алгоритм оценки кандидата без использования внешнего API
+    Оценивает по нескольким критериям с весами
+    relevance — TF-IDF близость текста кандидата к вакансии (см. similarity.py)
+    base — стартовая оценка (SEARCH_BASE_SCORE при поиске новых кандидатов)
+    Возвращает (score, breakdown) — breakdown в компактном виде, см. render_score_explanation
+    """
+    score = base
+    breakdown = [["base", base]] if base else []
+    profile = get_vacancy_profile(vacancy)
+    
+    # 1. Город (вес: 20 баллов)
+    city_score = 0
+    if profile.city_lower in (candidate.city or "").lower():
+        city_score = 20
+        breakdown.append(["city", city_score])
+    elif candidate.normalized_city and profile.city_lower in candidate.normalized_city.lower():
+        city_score = 15
+        breakdown.append(["city_norm", city_score])
+    else:
+        if candidate.normalized_city_from_text and profile.city_lower in candidate.normalized_city_from_text.lower():
+            city_score = 10
+            breakdown.append(["city_text", city_score])
+        else:
+            breakdown.append(["city_miss", city_score])
+    score += city_score
+    
+    # 2. Опыт работы (вес: 25 баллов)
+    experience_score = 0
+    if candidate.experience_years:
+        exp_years = candidate.experience_years
+        if exp_years >= 5:
+            experience_score = 25
+            breakdown.append(["exp_expert", experience_score, exp_years])
+        elif exp_years >= 3:
+            experience_score = 20
+            breakdown.append(["exp_good", experience_score, exp_years])
+        elif exp_years >= 1:
+            experience_score = 12
+            breakdown.append(["exp_junior", experience_score, exp_years])
+        else:
+            experience_score = 5
+            breakdown.append(["exp_low", experience_score, exp_years])
+    else:
+        exp_text = (candidate.experience_text or "").lower()
+        if "более 5" in exp_text or "более пяти" in exp_text:
+            experience_score = 20
+            breakdown.append(["exp_text5", experience_score])
+        elif "более 3" in exp_text or "более трех" in exp_text:
+            experience_score = 15
+            breakdown.append(["exp_text3", experience_score])
+        elif "опыт работы" in exp_text or "стаж" in exp_text:
+            experience_score = 10
+            breakdown.append(["exp_mention", experience_score])
+        else:
+            experience_score = 5
+            breakdown.append(["exp_unknown", experience_score])
+    score += experience_score
+    
+    # 3. Навыки и ключевые слова (вес: 25 баллов)
+    skills_score = 0
+    
+    if profile.has_requirements:
+        total_skills = len(profile.requirements.requirements)
+        found_skills = len(
+            profile.requirements.matched(candidate.skills_text or "")
+            | profile.requirements.matched(" ".join(candidate.extracted_skills or []))
+        )
+        
+        if found_skills > 0:
+            skills_score = int((found_skills / total_skills) * 25)
+            breakdown.append(["skills_found", skills_score, f"{found_skills}/{total_skills}"])
+        else:
+            skills_score = 5
+            breakdown.append(["skills_missing", skills_score])
+    else:
+        skills_count = len(candidate.extracted_skills) if hasattr(candidate, 'extracted_skills') and candidate.extracted_skills else 0
+        if skills_count >= 10:
+            skills_score = 25
+            breakdown.append(["skills_many", skills_score, skills_count])
+        elif skills_count >= 5:
+            skills_score = 18
+            breakdown.append(["skills_good", skills_score, skills_count])
+        elif skills_count >= 2:
+            skills_score = 10
+            breakdown.append(["skills_basic", skills_score, skills_count])
+        else:
+            skills_score = 5
+            breakdown.append(["skills_none", skills_score])
+    score += skills_score
+    
+    # 4. Зарплатные ожидания (вес: 15 баллов)
+    salary_score = 0
+    if candidate.salary_expectations and (profile.salary_from or profile.salary_to):
+        salary_expected = candidate.salary_expectations
+        salary_min = profile.salary_from or 0
+        salary_max = profile.salary_to or float('inf')
+        
+        if salary_min <= salary_expected <= salary_max:
+            salary_score = 15
+            breakdown.append(["salary_in", salary_score, salary_expected])
+        elif salary_expected < salary_min:
+            diff_percent = ((salary_min - salary_expected) / salary_min) * 100 if salary_min > 0 else 0
+            if diff_percent <= 20:
+                salary_score = 10
+                breakdown.append(["salary_below", salary_score])
+            else:
+                salary_score = 5
+                breakdown.append(["salary_far_below", salary_score])
+        else:
+            diff_percent = ((salary_expected - salary_max) / salary_max) * 100 if salary_max != float('inf') else 0
+            if diff_percent <= 20:
+                salary_score = 8
+                breakdown.append(["salary_above", salary_score])
+            else:
+                salary_score = 3
+                breakdown.append(["salary_far_above", salary_score])
+    else:
+        salary_score = 7
+        breakdown.append(["salary_unknown", salary_score])
+    score += salary_score
+    
+    # 5. Качество резюме/текста (вес: 10 баллов)
+    quality_score = 0
+    text_length = len(candidate.raw_text or "")
+    if text_length > 500:
+        quality_score = 10
+        breakdown.append(["text_full", quality_score, text_length])
+    elif text_length > 200:
+        quality_score = 7
+        breakdown.append(["text_good", quality_score, text_length])
+    elif text_length > 50:
+        quality_score = 4
+        breakdown.append(["text_short", quality_score, text_length])
+    else:
+        quality_score = 1
+        breakdown.append(["text_tiny", quality_score])
+    score += quality_score
+    
+    # 6. Релевантность текста вакансии по TF-IDF (вес: 5 баллов)
+    if relevance is not None:
+        relevance_score = relevance_points(relevance)
+        breakdown.append(["relevance", relevance_score, round(relevance * 100)])
+        score += relevance_score
+    
+    return min(100, score), breakdown
+
+
+def relevance_points(relevance: float) -> int:
+    """Переводит TF-IDF близость (0-1) в баллы скоринга (до 5)"""
+    if relevance >= 0.35:
+        return 5
+    if relevance >= 0.2:
+        return 3
+    if relevance >= 0.1:
+        return 1
+    return 0
+
+
+# ===== ОБЪЯСНЕНИЕ ОЦЕНКИ =====
+
+# Подписи критериев для компактного breakdown: [код, баллы] или [код, баллы, аргумент].
+# Текст собирается только при показе карточки или выгрузке, в БД хранятся коды и числа.
+BREAKDOWN_LABELS = {
+    "base": "⚖️ Базовая оценка",
+    "city": "🏙️ Город совпадает",
+    "city_norm": "🏙️ Город (нормализованный) совпадает",
+    "city_text": "🏙️ Город упомянут в тексте",
+    "city_miss": "🏙️ Город не совпадает",
+    "exp_expert": "💼 Опыт {} лет (эксперт)",
+    "exp_good": "💼 Опыт {} лет (хорошо)",
+    "exp_junior": "💼 Опыт {} лет (начальный)",
+    "exp_low": "💼 Опыт {} лет (мало)",
+    "exp_text5": "💼 В тексте указан опыт более 5 лет",
+    "exp_text3": "💼 В тексте указан опыт более 3 лет",
+    "exp_mention": "💼 Есть упоминание опыта",
+    "exp_unknown": "💼 Опыт не указан явно",
+    "skills_found": "📋 Найдено {} требуемых навыков",
+    "skills_missing": "📋 Требуемые навыки не найдены",
+    "skills_many": "📋 Много навыков ({})",
+    "skills_good": "📋 Хороший набор навыков ({})",
+    "skills_basic": "📋 Базовые навыки ({})",
+    "skills_none": "📋 Навыки не указаны",
+    "salary_in": "💰 Зарплата {} руб. входит в вилку",
+    "salary_below": "💰 Зарплата немного ниже вилки",
+    "salary_far_below": "💰 Зарплата значительно ниже вилки",
+    "salary_above": "💰 Зарплата немного выше вилки",
+    "salary_far_above": "💰 Зарплата значительно выше вилки",
+    "salary_unknown": "💰 Зарплатные ожидания не указаны",
+    "text_full": "📝 Подробное резюме ({} символов)",
+    "text_good": "📝 Хорошее резюме ({} символов)",
+    "text_short": "📝 Короткое резюме ({} символов)",
+    "text_tiny": "📝 Очень краткое резюме",
+    "relevance": "📈 Релевантность описанию вакансии {}%",
+    "red_flags": "🚩 Штраф за красные флаги",
+}
+
+
+def render_score_explanation(breakdown: list | None) -> str:
+    """Собирает человекочитаемое объяснение из компактного breakdown"""
+    if not breakdown:
+        return ""
+    parts = []
+    for entry in breakdown:
+        code, points = entry[0], entry[1]
+        label = BREAKDOWN_LABELS.get(code, code)
+        if len(entry) > 2:
+            label = label.format(entry[2])
+        parts.append(f"{label}: {points:+d}")
+    return " | ".join(parts)
+
+
+def candidate_explanation(candidate: Candidate) -> str:
+    """
+    Объяснение оценки кандидата: текст от LLM (если есть),
+    иначе рендер breakdown локального скоринга
+    """
+    return candidate.explanation or render_score_explanation(candidate.score_breakdown)
+
+
+# ===== КАСКАДНЫЙ СКОРИНГ: ШОРТ-ЛИСТ ДЛЯ LLM =====
+
+# Пороги статусов: 80+ — FILTERED, 60-79 — FOUND, ниже — REJECTED
+SCORE_THRESHOLDS = (60, 80)
+
+
+def select_llm_shortlist(
+    scored: List[Tuple[Candidate, int]],
+    top_k: int,
+    band: int | None = None,
+    max_size: int | None = None,
+) -> List[Candidate]:
+    """
+    Выбирает кандидатов, которых имеет смысл отправить в LLM на уточнение оценки.
+
+    scored — пары (кандидат, локальный скор). В шорт-лист попадают:
+    • top_k лучших по локальному скору;
+    • кандидаты, чей скор лежит в полосе ±band около порогов 60/80 —
+      для них уточнение LLM может поменять статус.
+    Остальные сохраняют локальную оценку, и LLM для них не вызывается.
+    """
+    if band is None:
+        band = settings.llm_band_margin
+    if max_size is None:
+        max_size = max(settings.llm_shortlist_max, top_k)
+
+    ranked = sorted(scored, key=lambda item: item[1], reverse=True)
+    shortlist = [c for c, _ in ranked[:max(top_k, 0)]]
+    selected = {id(c) for c in shortlist}
+
+    def threshold_distance(score: int) -> int:
+        return min(abs(score - t) for t in SCORE_THRESHOLDS)
+
+    borderline = [
+        (c, s) for c, s in ranked[top_k:]
+        if threshold_distance(s) <= band and id(c) not in selected
+    ]
+    borderline.sort(key=lambda item: threshold_distance(item[1]))
+    for c, _ in borderline:
+        if len(shortlist) >= max_size:
+            break
+        shortlist.append(c)
+
+    logger.info(f"🎯 Шорт-лист для LLM: {len(shortlist)} из {len(scored)} кандидатов")
+    return shortlist
+
+
+# ===== ИНКРЕМЕНТАЛЬНЫЙ ПЕРЕСЧЁТ =====
+
+def scoring_inputs_hash(candidate: Candidate) -> str:
+    """Хэш полей кандидата, от которых зависит оценка"""
+    payload = json.dumps([
+        candidate.city,
+        candidate.normalized_city,
+        candidate.normalized_city_from_text,
+        candidate.experience_text,
+        candidate.experience_years,
+        candidate.skills_text,
+        candidate.extracted_skills,
+        candidate.salary_expectations,
+        candidate.raw_text,
+        candidate.red_flags,
+    ], ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def scoring_config_key(vacancy: Vacancy, company: Company) -> str:
+    """Ключ конфигурации скоринга: алгоритм + версия вакансии + версия компании"""
+    return f"{SCORING_ALGORITHM_VERSION}:{vacancy.scoring_version or 1}:{company.scoring_version or 1}"
+
+
+def needs_rescoring(candidate: Candidate, vacancy: Vacancy, company: Company) -> bool:
+    """True, если с момента последней оценки изменились данные кандидата или настройки"""
+    return (
+        candidate.scored_config != scoring_config_key(vacancy, company)
+        or candidate.scoring_hash != scoring_inputs_hash(candidate)
+    )
+
+
+def mark_scored(candidate: Candidate, vacancy: Vacancy, company: Company) -> None:
+    """Запоминает, с какими входными данными и настройками посчитан score"""
+    candidate.scoring_hash = scoring_inputs_hash(candidate)
+    candidate.scored_config = scoring_config_key(vacancy, company)
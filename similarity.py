@@ -0,0 +1,131 @@
+# similarity.py
+"""
+Локальный (без сети) матчинг вакансии и кандидатов по TF-IDF.
+
+Векторы разрежённые — словарь {термин: вес}. Вектор вакансии считается
+один раз, каждый кандидат оценивается скалярным произведением с ним,
+поэтому тысячи кандидатов обрабатываются за доли секунды.
+"""
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List
+
+from filters import SKILL_NORMALIZATION, STOP_WORDS
+from models import Candidate, Vacancy
+
+TOKEN_RE = re.compile(r"[a-zа-я0-9][a-zа-я0-9+#]*")
+
+# Окончания для лёгкого стемминга (от длинных к коротким)
+RU_ENDINGS = (
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ией",
+    "ой", "ей", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ие", "ов", "ев",
+    "ах", "ях", "ом", "ем", "ам", "ям", "ую", "юю", "ию",
+    "а", "я", "ы", "и", "е", "о", "у", "ю", "ь",
+)
+EN_ENDINGS = ("ing", "ed", "es", "s")
+
+# Однословные синонимы навыков: «питон» → «python», «докер» → «docker»
+SKILL_TOKENS = {
+    key: value.lower()
+    for key, value in SKILL_NORMALIZATION.items()
+    if " " not in key
+}
+
+Vector = Dict[str, float]
+
+
+def _stem(token: str) -> str:
+    """Отрезает типичное окончание, если основа остаётся достаточно длинной"""
+    endings = RU_ENDINGS if re.match(r"[а-я]", token) else EN_ENDINGS
+    for ending in endings:
+        if token.endswith(ending) and len(token) - len(ending) >= 4:
+            return token[:-len(ending)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Разбивает текст на нормализованные термины (русский и английский):
+    нижний регистр, ё→е, синонимы навыков, стоп-слова, лёгкий стемминг
+    """
+    if not text:
+        return []
+
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower().replace("ё", "е")):
+        if token in SKILL_TOKENS:
+            tokens.append(SKILL_TOKENS[token])
+            continue
+        if len(token) < 2 or token in STOP_WORDS or token.isdigit():
+            continue
+        tokens.append(_stem(token))
+    return tokens
+
+
+def vacancy_match_text(vacancy: Vacancy) -> str:
+    """Текст вакансии, с которым сравниваются кандидаты"""
+    must_have = vacancy.must_have if vacancy.must_have and vacancy.must_have != "-" else ""
+    return f"{vacancy.role} {must_have} {vacancy.schedule or ''}"
+
+
+def candidate_match_text(candidate: Candidate) -> str:
+    """Текст кандидата для сравнения с вакансией"""
+    return f"{candidate.experience_text or ''} {candidate.skills_text or ''} {candidate.raw_text or ''}"
+
+
+class TfidfMatcher:
+    """
+    TF-IDF матчер одной вакансии с набором кандидатов.
+
+    IDF считается по корпусу кандидатов (плюс текст вакансии), вектор вакансии
+    вычисляется один раз при создании. Оценка — косинусная близость в [0, 1].
+    """
+
+    def __init__(self, vacancy_text: str, corpus: Iterable[str]):
+        self._corpus_tokens = [tokenize(doc) for doc in corpus]
+        vacancy_tokens = tokenize(vacancy_text)
+
+        df: Counter = Counter()
+        for tokens in self._corpus_tokens:
+            df.update(set(tokens))
+        df.update(set(vacancy_tokens))
+
+        self.n_docs = len(self._corpus_tokens) + 1
+        self._default_idf = math.log(1 + self.n_docs) + 1
+        self.idf = {
+            term: math.log((1 + self.n_docs) / (1 + count)) + 1
+            for term, count in df.items()
+        }
+        self.vacancy_vector = self._vectorize(vacancy_tokens)
+
+    def _vectorize(self, tokens: List[str]) -> Vector:
+        """Сублинейный TF × IDF с L2-нормировкой"""
+        if not tokens:
+            return {}
+        vector = {
+            term: (1 + math.log(count)) * self.idf.get(term, self._default_idf)
+            for term, count in Counter(tokens).items()
+        }
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        return {term: w / norm for term, w in vector.items()}
+
+    def _dot(self, vector: Vector) -> float:
+        """Скалярное произведение с вектором вакансии (по меньшему из векторов)"""
+        small, large = (vector, self.vacancy_vector)
+        if len(small) > len(large):
+            small, large = large, small
+        return sum(w * large.get(term, 0.0) for term, w in small.items())
+
+    def score(self, text: str) -> float:
+        """Близость произвольного текста к вакансии"""
+        if not self.vacancy_vector:
+            return 0.0
+        return round(self._dot(self._vectorize(tokenize(text))), 4)
+
+    def corpus_scores(self) -> List[float]:
+        """Близость к вакансии для каждого документа корпуса (в исходном порядке)"""
+        if not self.vacancy_vector:
+            return [0.0] * len(self._corpus_tokens)
+        return [round(self._dot(self._vectorize(tokens)), 4) for tokens in self._corpus_tokens]
+
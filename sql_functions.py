@@ -0,0 +1,98 @@
+# sql_functions.py
+"""
+Переносимые SQL-выражения для SQLite и PostgreSQL.
+
+Выражение собирается как обычная функция SQLAlchemy, а текст SQL подставляется
+при компиляции под конкретную БД (sqlalchemy.ext.compiler). Для SQLite —
+вариант по умолчанию, для PostgreSQL — отдельный.
+"""
+import json
+
+from sqlalchemy import Boolean, Date, Float, bindparam, func
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+
+# ===== ДАТЫ =====
+
+class hours_between(FunctionElement):
+    """hours_between(later, earlier) — разница двух отметок времени в часах (float)"""
+    type = Float()
+    name = "hours_between"
+    inherit_cache = True
+
+
+@compiles(hours_between)
+def _hours_between_sqlite(element, compiler, **kw):
+    later, earlier = list(element.clauses)
+    return f"((julianday({compiler.process(later, **kw)}) - julianday({compiler.process(earlier, **kw)})) * 24.0)"
+
+
+@compiles(hours_between, "postgresql")
+def _hours_between_postgresql(element, compiler, **kw):
+    later, earlier = list(element.clauses)
+    return f"(EXTRACT(EPOCH FROM ({compiler.process(later, **kw)} - {compiler.process(earlier, **kw)})) / 3600.0)"
+
+
+def day_of(column):
+    """
+    Дата (без времени) отметки времени. date() есть и в SQLite, и в PostgreSQL;
+    type_=Date приводит строку SQLite к datetime.date при чтении.
+    """
+    return func.date(column, type_=Date)
+
+
+# ===== JSON-МАССИВЫ =====
+
+class json_array_contains(FunctionElement):
+    """
+    json_array_contains(column, value) — JSON-массив в колонке содержит элемент value.
+    PostgreSQL: column @> '["value"]' (использует GIN-индекс по JSONB),
+    SQLite: EXISTS по json_each.
+    """
+    type = Boolean()
+    name = "json_array_contains"
+    inherit_cache = True
+
+    def __init__(self, column, value):
+        # Значение для SQLite и готовый JSON-массив для PostgreSQL — оба как параметры,
+        # чтобы закэшированный скомпилированный запрос подходил для любого value
+        super().__init__(column, bindparam(None, value), bindparam(None, json.dumps([value], ensure_ascii=False)))
+
+
+@compiles(json_array_contains)
+def _json_array_contains_sqlite(element, compiler, **kw):
+    column, value, _ = list(element.clauses)
+    return (
+        f"EXISTS (SELECT 1 FROM json_each({compiler.process(column, **kw)}) "
+        f"WHERE json_each.value = {compiler.process(value, **kw)})"
+    )
+
+
+@compiles(json_array_contains, "postgresql")
+def _json_array_contains_postgresql(element, compiler, **kw):
+    column, _, array = list(element.clauses)
+    return f"({compiler.process(column, **kw)} @> CAST({compiler.process(array, **kw)} AS JSONB))"
+
+
+class json_array_elements(FunctionElement):
+    """
+    json_array_elements(column) — элементы JSON-массива как строки таблицы
+    с колонкой value; использовать через .table_valued("value").
+    SQLite: json_each, PostgreSQL: jsonb_array_elements_text.
+    Значение, которое не является массивом (NULL, JSON null), даёт ноль строк.
+    """
+    name = "json_array_elements"
+    inherit_cache = True
+
+
+@compiles(json_array_elements)
+def _json_array_elements_sqlite(element, compiler, **kw):
+    column = compiler.process(list(element.clauses)[0], **kw)
+    return f"json_each(CASE WHEN json_type({column}) = 'array' THEN {column} END)"
+
+
+@compiles(json_array_elements, "postgresql")
+def _json_array_elements_postgresql(element, compiler, **kw):
+    column = compiler.process(list(element.clauses)[0], **kw)
+    return f"jsonb_array_elements_text(CASE WHEN jsonb_typeof({column}) = 'array' THEN {column} END)"
@@ -7,7 +7,8 @@ import re
 from aiogram.types import Message
 
 from db import get_session
-from models import Candidate, CandidateStatus, Vacancy, Company
+from models import Candidate, CandidateStatus
+from user_context import get_owner_company_and_vacancy
 
 
 def _parse_contact_and_city(text: str, fallback_city: str) -> Tuple[str, str]:
@@ -55,17 +56,10 @@ async def import_candidate_from_forward(message: Message) -> Optional[int]:
         return None
 
     with get_session() as session:
-        vacancies = (
-            session.query(Vacancy)
-            .join(Company, Vacancy.company_id == Company.id)
-            .filter(Company.owner_id == message.from_user.id)
-            .order_by(Vacancy.created_at.desc())
-            .all()
-        )
-        if not vacancies:
+        _, vacancy = get_owner_company_and_vacancy(session, message.from_user.id)
+        if vacancy is None:
             await message.answer("Сначала создайте вакансию: /new_job")
             return None
-        vacancy = vacancies[0]
 
         # Наивный парсинг: первая строка — имя/ник, остальное — опыт/описание.
         lines = text.splitlines()
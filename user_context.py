@@ -0,0 +1,146 @@
+# user_context.py
+"""
+Кэш контекста пользователя: владелец → компания → активная (последняя) вакансия.
+
+Почти каждая команда бота начинает с поиска компании по owner_id и последней
+вакансии компании. Кэш хранит только идентификаторы (снимок), сами объекты
+загружаются по первичному ключу в сессии вызывающего кода — поэтому изменения
+полей компании и вакансии (фильтры, email, требования) не требуют сброса.
+
+Сброс нужен, когда меняется сам состав: создание/удаление компании или вакансии.
+Такие изменения собираются при flush любой сессии (бот, VK, импорт), а кэш
+сбрасывается после коммита — иначе параллельный запрос между flush и commit
+снова закэшировал бы старый состав; при откате сброса нет. Записи также
+устаревают по TTL (settings.user_context_ttl_seconds) — на случай изменений
+из другого процесса.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from config import settings
+from models import Company, Vacancy
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class UserContext:
+    """Снимок контекста владельца: id компании и id активной вакансии (если есть)"""
+    owner_id: int
+    company_id: int
+    vacancy_id: Optional[int]
+
+
+_CACHE: Dict[int, Tuple[float, UserContext]] = {}
+_CACHE_MAX = 4096
+_LOCK = threading.Lock()
+
+
+def active_vacancy_id(session: Session, company_id: int) -> Optional[int]:
+    """Id последней вакансии компании одним запросом с LIMIT 1"""
+    return session.scalar(
+        select(Vacancy.id)
+        .where(Vacancy.company_id == company_id)
+        .order_by(Vacancy.created_at.desc())
+        .limit(1)
+    )
+
+
+def get_user_context(session: Session, owner_id: int) -> Optional[UserContext]:
+    """Контекст владельца из кэша; при промахе — два коротких запроса. None — компании нет"""
+    now = time.monotonic()
+    with _LOCK:
+        cached = _CACHE.get(owner_id)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    company_id = session.scalar(select(Company.id).where(Company.owner_id == owner_id).limit(1))
+    if company_id is None:
+        # Отсутствие компании не кэшируем: онбординг создаст её в любой момент
+        return None
+
+    context = UserContext(
+        owner_id=owner_id,
+        company_id=company_id,
+        vacancy_id=active_vacancy_id(session, company_id),
+    )
+    with _LOCK:
+        if len(_CACHE) >= _CACHE_MAX:
+            _CACHE.clear()
+        _CACHE[owner_id] = (now + settings.user_context_ttl_seconds, context)
+    return context
+
+
+def get_owner_company(session: Session, owner_id: int) -> Optional[Company]:
+    """Компания владельца (загрузка по первичному ключу)"""
+    context = get_user_context(session, owner_id)
+    if context is None:
+        return None
+    return session.get(Company, context.company_id)
+
+
+def get_owner_company_and_vacancy(
+    session: Session, owner_id: int
+) -> Tuple[Optional[Company], Optional[Vacancy]]:
+    """Компания владельца и её последняя вакансия: (None, None) — нет компании, (company, None) — нет вакансий"""
+    context = get_user_context(session, owner_id)
+    if context is None:
+        return None, None
+    company = session.get(Company, context.company_id)
+    if company is None:
+        invalidate_user_context(owner_id)
+        return None, None
+    vacancy = session.get(Vacancy, context.vacancy_id) if context.vacancy_id is not None else None
+    return company, vacancy
+
+
+def invalidate_user_context(owner_id: Optional[int] = None) -> None:
+    """Сбросить кэш владельца (или весь кэш, если owner_id не задан)"""
+    with _LOCK:
+        if owner_id is None:
+            _CACHE.clear()
+        else:
+            _CACHE.pop(owner_id, None)
+
+
+# ===== СБРОС ПРИ ЗАПИСИ =====
+
+# Ключ в session.info: владельцы, чей контекст изменился в текущей транзакции
+# (None среди них — сбросить весь кэш)
+_CHANGED_KEY = "user_context_changed_owners"
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_changed_owners(session: Session, flush_context, instances) -> None:
+    changed = set()
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Company):
+            changed.add(obj.owner_id)
+        elif isinstance(obj, Vacancy):
+            # owner_id у вакансии нет, а вакансии создаются редко — сбрасываем весь кэш
+            changed.add(None)
+    if changed:
+        session.info.setdefault(_CHANGED_KEY, set()).update(changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session: Session) -> None:
+    changed = session.info.pop(_CHANGED_KEY, None)
+    if not changed:
+        return
+    if None in changed:
+        invalidate_user_context()
+        return
+    for owner_id in changed:
+        invalidate_user_context(owner_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session: Session) -> None:
+    session.info.pop(_CHANGED_KEY, None)
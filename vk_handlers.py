@@ -9,6 +9,8 @@ from typing import Dict, Any
 from config import settings
 from db import get_session
 from models import Candidate, CandidateStatus, Company, Vacancy
+from pipeline import set_candidate_status
+from user_context import get_owner_company, get_owner_company_and_vacancy
 import vk_bot as vk_module
 
 logger = logging.getLogger(__name__)
@@ -45,7 +47,7 @@ async def handle_vk_message(data: Dict[str, Any]):
     state = user_states[user_id]
     
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == user_id).first()
+        company = get_owner_company(session, user_id)
     
     # Обработка команд с параметрами
     if text.startswith('/invite_'):
@@ -226,7 +228,7 @@ async def handle_onboarding_step(user_id: int, vk_bot, state, text: str):
         state.data['tone'] = text
         
         with get_session() as session:
-            company = session.query(Company).filter(Company.owner_id == user_id).first()
+            company = get_owner_company(session, user_id)
             if not company:
                 company = Company(owner_id=user_id)
                 session.add(company)
@@ -255,7 +257,7 @@ async def handle_onboarding_step(user_id: int, vk_bot, state, text: str):
 async def handle_new_job_start(user_id: int, vk_bot, state):
     """Начало создания вакансии"""
     with get_session() as session:
-        company = session.query(Company).filter(Company.owner_id == user_id).first()
+        company = get_owner_company(session, user_id)
         if not company:
             vk_bot.send_message(user_id, "❌ Сначала пройдите онбординг: /onboarding")
             return
@@ -310,7 +312,7 @@ async def handle_new_job_step(user_id: int, vk_bot, state, text: str):
         must_have = '-' if text == '-' else text
         
         with get_session() as session:
-            company = session.query(Company).filter(Company.owner_id == user_id).first()
+            company = get_owner_company(session, user_id)
             vacancy = Vacancy(
                 company_id=company.id,
                 role=state.data['role'],
@@ -359,7 +361,7 @@ async def handle_search(user_id: int, vk_bot, company, state):
         return
     
     with get_session() as session:
-        vacancy = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).first()
+        _, vacancy = get_owner_company_and_vacancy(session, user_id)
         if not vacancy:
             vk_bot.send_message(user_id, "📭 Нет вакансий. Создайте: /new_job")
             return
@@ -404,7 +406,7 @@ async def auto_invite_candidates(vacancy_id: int, vk_bot, user_id: int):
                     invite_text = generate_invite_message_simple(candidate, vacancy, company)
                     success = vk_bot.send_message(int(candidate.contact), invite_text)
                     if success:
-                        candidate.status = CandidateStatus.INVITED.value
+                        set_candidate_status(candidate, CandidateStatus.INVITED)
                         invited_count += 1
                         logger.info(f"✅ Авто-приглашение отправлено {candidate.name_or_nick}")
             
@@ -504,7 +506,7 @@ async def handle_candidates(user_id: int, vk_bot, company, state):
         return
     
     with get_session() as session:
-        vacancy = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).first()
+        _, vacancy = get_owner_company_and_vacancy(session, user_id)
         if not vacancy:
             vk_bot.send_message(user_id, "📭 Нет вакансий. Создайте: /new_job")
             return
@@ -609,7 +611,7 @@ async def handle_invite(user_id: int, vk_bot, candidate_id: int):
         if candidate.contact and candidate.contact.isdigit():
             success = vk_bot.send_message(int(candidate.contact), invite_text)
             if success:
-                candidate.status = CandidateStatus.INVITED.value
+                set_candidate_status(candidate, CandidateStatus.INVITED)
                 session.commit()
                 vk_bot.send_message(user_id, f"✅ Приглашение отправлено кандидату {candidate.name_or_nick}")
                 return
@@ -632,7 +634,7 @@ async def handle_skip(user_id: int, vk_bot, candidate_id: int, state):
             vk_bot.send_message(user_id, "❌ Кандидат не найден")
             return
         
-        candidate.status = CandidateStatus.ARCHIVE.value
+        set_candidate_status(candidate, CandidateStatus.ARCHIVE)
         candidate.rejection_reason = "Пропущен HR"
         session.commit()
         
@@ -647,7 +649,7 @@ async def handle_fav(user_id: int, vk_bot, candidate_id: int):
             vk_bot.send_message(user_id, "❌ Кандидат не найден")
             return
         
-        candidate.status = CandidateStatus.FAVORITE.value
+        set_candidate_status(candidate, CandidateStatus.FAVORITE)
         session.commit()
         
         vk_bot.send_message(user_id, f"⭐ Кандидат {candidate.name_or_nick} добавлен в избранное")
@@ -704,7 +706,7 @@ async def handle_analytics(user_id: int, vk_bot, company):
         return
     
     with get_session() as session:
-        vacancy = session.query(Vacancy).filter(Vacancy.company_id == company.id).order_by(Vacancy.created_at.desc()).first()
+        _, vacancy = get_owner_company_and_vacancy(session, user_id)
         if not vacancy:
             vk_bot.send_message(user_id, "📭 Нет вакансий")
             return
@@ -0,0 +1,234 @@
+# xlsx_writer.py
+"""
+Потоковая запись XLSX без сторонних библиотек (zipfile + XML).
+
+Книга с одним листом пишется по мере поступления строк: каждый вызов
+write_rows() возвращает готовые байты файла, которые можно сразу отправлять
+дальше (в запрос к Telegram, в файл). ZIP пишется в режиме без seek
+(data descriptor), строки — inline-строками, без таблицы общих строк,
+поэтому расход памяти не зависит от числа строк.
+
+Типы ячеек: int/float → число, datetime/date → дата (числовой формат Excel),
+bool → логическое, None → пустая ячейка, остальное → текст.
+
+    writer = XlsxStreamWriter(["ID", "Имя", "Оценка"])
+    out.write(writer.write_rows([(1, "Иван", 87)]))
+    out.write(writer.close())
+"""
+import re
+import zipfile
+from datetime import date, datetime
+from typing import Iterable, List, Optional, Sequence
+from xml.sax.saxutils import escape
+
+# Excel считает даты от 30.12.1899 (с учётом несуществующего 29.02.1900)
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+# Максимальная длина текста в ячейке Excel
+MAX_CELL_TEXT = 32767
+# Управляющие символы, недопустимые в XML 1.0
+_ILLEGAL_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+_INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+
+# Индексы стилей в styles.xml: 0 — обычная ячейка, 1 — дата и время, 2 — дата, 3 — заголовок
+_STYLE_DATETIME = 1
+_STYLE_DATE = 2
+_STYLE_HEADER = 3
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="2">'
+    '<numFmt numFmtId="164" formatCode="dd.mm.yyyy hh:mm"/>'
+    '<numFmt numFmtId="165" formatCode="dd.mm.yyyy"/>'
+    '</numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    # Первая строка (заголовки) закреплена
+    '<sheetViews><sheetView workbookViewId="0">'
+    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+    '</sheetView></sheetViews>'
+)
+_SHEET_END = '</sheetData></worksheet>'
+
+
+def column_letter(index: int) -> str:
+    """Буквенное имя колонки по индексу с нуля: 0 → A, 26 → AA"""
+    letters = ""
+    index += 1
+    while index:
+        index, rest = divmod(index - 1, 26)
+        letters = chr(ord("A") + rest) + letters
+    return letters
+
+
+def excel_serial(value: date) -> float:
+    """Дата/время → число дней по календарю Excel"""
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    delta = value.replace(tzinfo=None) - _EXCEL_EPOCH
+    return delta.days + delta.seconds / 86400
+
+
+def _text(value: str) -> str:
+    return escape(_ILLEGAL_XML_CHARS.sub("", value[:MAX_CELL_TEXT]))
+
+
+def _cell(ref: str, value, style: int = 0) -> str:
+    """XML одной ячейки; None → пустая строка (ячейка не пишется)"""
+    style_attr = f' s="{style}"' if style else ""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"{style_attr}><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        if value != value or value in (float("inf"), float("-inf")):
+            return ""
+        return f'<c r="{ref}"{style_attr}><v>{value!r}</v></c>'
+    if isinstance(value, datetime):
+        return f'<c r="{ref}" s="{_STYLE_DATETIME}"><v>{excel_serial(value)!r}</v></c>'
+    if isinstance(value, date):
+        return f'<c r="{ref}" s="{_STYLE_DATE}"><v>{excel_serial(value)!r}</v></c>'
+    return f'<c r="{ref}" t="inlineStr"{style_attr}><is><t xml:space="preserve">{_text(str(value))}</t></is></c>'
+
+
+class ChunkSink:
+    """Приёмник для zipfile без seek/tell: копит байты до следующего take()"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class XlsxStreamWriter:
+    """
+    Потоковая запись книги XLSX с одним листом.
+
+    headers — заголовки колонок (первая строка, жирным), column_widths — ширина
+    колонок в символах. write_rows() и close() возвращают очередную часть файла;
+    склеенные по порядку части дают готовый .xlsx.
+    """
+
+    def __init__(
+        self,
+        headers: Sequence[str],
+        sheet_name: str = "Лист1",
+        column_widths: Optional[Sequence[float]] = None,
+        compresslevel: int = 6,
+    ):
+        self._columns = [column_letter(i) for i in range(len(headers))]
+        self._row = 0
+        self._sink = ChunkSink()
+        self._zip = zipfile.ZipFile(self._sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+
+        sheet_name = _INVALID_SHEET_CHARS.sub("_", sheet_name)[:31] or "Лист1"
+        self._zip.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        self._zip.writestr("_rels/.rels", _ROOT_RELS)
+        self._zip.writestr("xl/workbook.xml", _WORKBOOK.format(name=escape(sheet_name, {'"': "&quot;"})))
+        self._zip.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        self._zip.writestr("xl/styles.xml", _STYLES)
+
+        # Лист пишется последним: в ZIP без seek открытой может быть только одна запись
+        self._sheet = self._zip.open("xl/worksheets/sheet1.xml", "w")
+        parts = [_SHEET_START]
+        if column_widths:
+            parts.append("<cols>")
+            for i, width in enumerate(column_widths, start=1):
+                parts.append(f'<col min="{i}" max="{i}" width="{width}" customWidth="1"/>')
+            parts.append("</cols>")
+        parts.append("<sheetData>")
+        self._sheet.write("".join(parts).encode("utf-8"))
+        self._write([headers], style=_STYLE_HEADER)
+
+    def _write(self, rows: Iterable[Sequence], style: int = 0) -> None:
+        parts: List[str] = []
+        for row in rows:
+            self._row += 1
+            number = self._row
+            parts.append(f'<row r="{number}">')
+            for letter, value in zip(self._columns, row):
+                parts.append(_cell(f"{letter}{number}", value, style))
+            parts.append("</row>")
+        self._sheet.write("".join(parts).encode("utf-8"))
+
+    @property
+    def rows_written(self) -> int:
+        """Число записанных строк данных (без заголовка)"""
+        return max(self._row - 1, 0)
+
+    def write_rows(self, rows: Iterable[Sequence]) -> bytes:
+        """Дописывает строки; возвращает накопившиеся байты файла (может быть b"")"""
+        self._write(rows)
+        return self._sink.take()
+
+    def close(self) -> bytes:
+        """Завершает лист и архив; возвращает последние байты файла"""
+        self._sheet.write(_SHEET_END.encode("utf-8"))
+        self._sheet.close()
+        self._zip.close()
+        return self._sink.take()